@@ -27,7 +27,11 @@ app.logger.setLevel(config.Config.LEVEL_LOGGING)
 cors = CORS(app, resources={r'/api/*': {'origins': '*'}})
 
 # Scheduler
-apscheduler = BackgroundScheduler(timezone='UTC')
+apscheduler = BackgroundScheduler(timezone='UTC', job_defaults={
+    'coalesce': True,  # run a missed job once, not once per missed time
+    'max_instances': 1,
+    'misfire_grace_time': config.Config.SCHEDULER_MISFIRE_GRACE_TIME,
+})
 apscheduler.start()
 atexit.register(lambda: apscheduler.shutdown(wait=False))
 
@@ -85,6 +89,10 @@ migrate = Migrate(app, db)
 from application.base import common as app_common
 app.json_encoder = app_common.AppJSONEncoder
 
+# Performance metrics of requests
+from application.utils import perf_util
+perf_util.init_app(app)
+
 # Init sentry
 if app.config['USE_SENTRY']:
     import logging
@@ -37,6 +37,8 @@ api_v1.add_resource(admin.Maintenance, '/maintenance', endpoint='admin_maintenan
 api_v1.add_resource(admin.ModelObjects, '/admin/models/<model_class>', endpoint='admin_model_objects')
 api_v1.add_resource(admin.ModelObject, '/admin/model/<model_class>', endpoint='admin_model_object')
 api_v1.add_resource(admin.ServerActions, '/admin/server', endpoint='server_actions')
+api_v1.add_resource(admin.ServerStats, '/admin/stats', endpoint='admin_server_stats')
+api_v1.add_resource(admin.RequestStats, '/admin/stats/requests', endpoint='admin_request_stats')
 api_v1.add_resource(admin.Utilities, '/admin/utils', endpoint='admin_utils')
 
 #
@@ -83,6 +85,7 @@ api_v1.add_resource(user.ResetPassword, '/reset_password', endpoint='reset_passw
 api_v1.add_resource(product.Products, '/products', endpoint='products')
 api_v1.add_resource(product.Product, '/product/<int:product_id>', endpoint='product')
 api_v1.add_resource(product.Price, '/product_price', endpoint='product_price')
+api_v1.add_resource(product.PriceMatrix, '/products/prices/matrix', endpoint='product_price_matrix')
 
 #
 # PRODUCT TYPES
@@ -128,6 +131,7 @@ api_v1.add_resource(region.Region, '/region/<region_id>', endpoint='region')
 #
 api_v1.add_resource(task.Tasks, '/tasks', endpoint='tasks')
 api_v1.add_resource(task.Task, '/task/<int:task_id>', endpoint='task')
+api_v1.add_resource(task.ScheduledJobs, '/tasks/scheduled', endpoint='scheduled_jobs')
 
 #
 # CLUSTERS
@@ -81,6 +81,63 @@ class ServerActions(Resource):
         return do_server_action(args=args)
 
 
+#####################################################################
+# SERVER STATS
+#####################################################################
+
+def do_get_server_stats():
+    """
+    Do get server runtime statistics.
+    :return:
+    """
+    ctx = context.create_context(
+        task='get server stats')
+    return base.exec_manager_func(admin_mgr.get_server_stats, ctx)
+
+
+class ServerStats(Resource):
+    @auth.login_required(role=('ADMIN', 'ADMIN_IT'))
+    def get(self):
+        return do_get_server_stats()
+
+
+def do_get_request_stats(args):
+    """
+    Do get latency histograms of API endpoints.
+    :param args:
+    :return:
+    """
+    ctx = context.create_context(
+        task='get request stats',
+        data=args)
+    return base.exec_manager_func(admin_mgr.get_request_stats, ctx)
+
+
+def do_reset_request_stats():
+    """
+    Do clear latency histograms of API endpoints.
+    :return:
+    """
+    ctx = context.create_context(
+        task='reset request stats')
+    return base.exec_manager_func(admin_mgr.reset_request_stats, ctx)
+
+
+class RequestStats(Resource):
+    get_request_stats_args = {
+        'endpoint': fields.Str(required=False),  # filter by part of endpoint, e.g. /histories
+    }
+
+    @auth.login_required(role=('ADMIN', 'ADMIN_IT'))
+    @use_args(get_request_stats_args, location=LOCATION)
+    def get(self, args):
+        return do_get_request_stats(args=args)
+
+    @auth.login_required(role='ADMIN')
+    def delete(self):
+        return do_reset_request_stats()
+
+
 #####################################################################
 # MODEL OBJECTS
 #####################################################################
@@ -105,6 +162,7 @@ def do_get_model_objects(args):
     :param args:
     :return:
     """
+    args['stream'] = base.is_stream_request(args)
     ctx = context.create_context(
         task='get model objects',
         data=args)
@@ -152,7 +210,10 @@ def do_delete_model_object(args):
 
 
 class ModelObjects(Resource):
-    get_objs_args = base.LIST_OBJECTS_ARGS
+    get_objs_args = {
+        **base.LIST_OBJECTS_ARGS,
+        **base.STREAM_ARGS,
+    }
 
     @auth.login_required(role='ADMIN')
     @use_args(get_objs_args, location=LOCATION)
@@ -2,13 +2,69 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import gzip
+import hashlib
+import threading
+
 from flask_restful import Resource
-from flask import jsonify
+from flask import json, request, Response
 from flask_swagger import swagger
 
 from application import app
 
+# Built API docs: (route table signature, json bytes, gzipped bytes, etag)
+_docs_cache = None
+_docs_lock = threading.Lock()
+
+
+def _get_routes_signature():
+    """
+    Get signature of the route table, API docs are rebuilt when it changes.
+    :return:
+    """
+    rules = sorted((rule.rule, rule.endpoint, ','.join(sorted(rule.methods or ())))
+                   for rule in app.url_map.iter_rules())
+    return hashlib.sha1(repr(rules).encode('utf-8')).hexdigest()
+
+
+def get_api_docs():
+    """
+    Get API docs built by swagger, build once per route table.
+    :return: (json bytes, gzipped bytes, etag)
+    """
+    global _docs_cache
+
+    signature = _get_routes_signature()
+    cache = _docs_cache
+    if cache is None or cache[0] != signature:
+        with _docs_lock:
+            cache = _docs_cache
+            if cache is None or cache[0] != signature:
+                data = json.dumps(swagger(app)).encode('utf-8')
+                etag = hashlib.sha1(data).hexdigest()
+                cache = (signature, data, gzip.compress(data, compresslevel=9), etag)
+                _docs_cache = cache
+    return cache[1:]
+
 
 class ApiDocs(Resource):
     def get(self):
-        return jsonify(swagger(app))
+        data, gzip_data, etag = get_api_docs()
+
+        # Each encoding is a different representation, so has its own strong ETag
+        use_gzip = 'gzip' in request.accept_encodings
+        if use_gzip:
+            data = gzip_data
+            etag = etag + '-gzip'
+
+        if request.if_none_match.contains(etag):
+            resp = Response(status=304)
+        else:
+            resp = Response(data, mimetype='application/json')
+            if use_gzip:
+                resp.headers['Content-Encoding'] = 'gzip'
+
+        resp.set_etag(etag)
+        resp.headers['Vary'] = 'Accept-Encoding'
+        resp.headers['Cache-Control'] = 'no-cache'
+        return resp
@@ -3,7 +3,9 @@
 #
 import datetime
 from os import environ as env
+import zlib
 
+from flask import request, stream_with_context, Response
 from flask_httpauth import HTTPTokenAuth
 from flask_restful import abort
 from webargs import fields, validate
@@ -13,8 +15,9 @@ from webargs.multidictproxy import MultiDictProxy
 from application import app
 from application.base import common as app_common
 from application.base import errors
-from application.managers import history_mgr
+from application.managers import base as base_mgr, history_mgr
 from application import models as md
+from application.utils import perf_util
 
 LOG = app.logger
 DEBUG = app.config['DEBUG']
@@ -27,6 +30,9 @@ class ApiJSONEncoder(app_common.AppJSONEncoder):
     """
     JSON encoder for API.
     """
+    def encode(self, o):
+        with perf_util.timer('serialize'):
+            return super().encode(o)
 
 
 # Set some configurations
@@ -49,6 +55,7 @@ PAGING_ARGS = {
         missing=LIST_ITEMS_PER_PAGE,
         validate=[validate.Range(min=1, max=LIST_MAX_ITEMS_PER_PAGE)]),
     'sort_by': fields.List(fields.Str(), required=False),  # form: col1,col2__desc,col3__asc default asc
+    'cursor': fields.Str(required=False),  # keyset paging: empty for first page, then use next_cursor
 }
 FIELD_FILTER_ARGS = {
     'fields': fields.List(fields.Str(), required=False),
@@ -60,6 +67,9 @@ CONDITION_FILTER_ARGS = {
     'extra_field_condition': fields.Str(required=False),  # json object string
 }
 
+STREAM_ARGS = {
+    'stream': fields.Bool(required=False, missing=False),  # stream all items, no paging
+}
 GET_OBJECT_ARGS = {
     **REGION_ARGS,
     **FIELD_FILTER_ARGS,
@@ -75,6 +85,8 @@ LIST_OBJECTS_ARGS = {
     page: page index from 1 of data
     page_size: number of items in a page
     sort_by: sorting key, e.g. col1__asc,col2__desc
+    cursor: use keyset paging instead of page index, pass empty string for the first page
+        then `next_cursor` from the previous response (faster for deep pages, no total count)
     fields: data fields of object to get if don't want to get default fields
     extra_fields: data fields not it default fields list
     condition: a condition can be in several forms:
@@ -144,7 +156,8 @@ def _do_exec_manager_func(func, ctx):
     ex = None
     if ctx.succeed:
         try:
-            func(ctx)
+            with perf_util.timer('manager'):
+                func(ctx)
         except BaseException as e:
             ex = e
     # When context fails, rollback all uncommitted db changes
@@ -237,6 +250,8 @@ def process_result_context(ctx):
     """
     if ctx.succeed:
         response = ctx.response
+        if isinstance(response, base_mgr.ObjectStream):
+            return make_stream_response(response)
         if ctx.warning:
             if not response:
                 response = {}
@@ -260,3 +275,93 @@ def process_result_context(ctx):
         resp = {'error': ctx.error_json()}
         LOG.error('ERROR %s', resp)
         return resp, ctx.status or 500
+
+
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Size of serialized data to collect before sending a chunk of streaming response
+STREAM_BUFFER_SIZE = 64 * 1024
+
+
+def is_stream_request(args):
+    """
+    Check if client asks for a streaming response, by `stream` arg or NDJSON Accept header.
+    :param args:
+    :return:
+    """
+    return bool(args.get('stream')) or request.accept_mimetypes.best == NDJSON_MIMETYPE
+
+
+def _iter_stream_lines(stream, ndjson):
+    """
+    Serialize objects of the stream incrementally.
+    NDJSON output is one object per line, otherwise a JSON document like a list response.
+    :param stream:
+    :param ndjson:
+    :return:
+    """
+    if not ndjson:
+        yield '{"data": ['
+    first = True
+    error = None
+    try:
+        for obj in stream:
+            data = app_common.json_dumps(obj)
+            if ndjson:
+                yield data + '\n'
+            else:
+                yield data if first else ',' + data
+            first = False
+    except BaseException as e:
+        # Headers are already sent, so report the error at the end of the output
+        LOG.exception('Error when streaming objects: {}'.format(e))
+        error = errors.Error(message=errors.UNKNOWN_ERROR, cause=e).to_json()
+
+    if ndjson:
+        if error:
+            yield app_common.json_dumps({'error': error}) + '\n'
+    else:
+        tail = {'has_more': False, 'next_page': None, 'prev_page': None}
+        if error:
+            tail['error'] = error
+        yield '], ' + app_common.json_dumps(tail)[1:]
+
+
+def _iter_stream_chunks(lines, use_gzip):
+    """
+    Collect lines to chunks, gzip them if needed.
+    :param lines:
+    :param use_gzip:
+    :return:
+    """
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 16 + zlib.MAX_WBITS) if use_gzip else None
+    buffer = []
+    size = 0
+    for line in lines:
+        buffer.append(line)
+        size += len(line)
+        if size >= STREAM_BUFFER_SIZE:
+            data = ''.join(buffer).encode('utf-8')
+            yield compressor.compress(data) + compressor.flush(zlib.Z_SYNC_FLUSH) if use_gzip else data
+            buffer = []
+            size = 0
+    data = ''.join(buffer).encode('utf-8')
+    yield compressor.compress(data) + compressor.flush() if use_gzip else data
+
+
+def make_stream_response(stream):
+    """
+    Make streaming response for the objects.
+    :param stream: base_mgr.ObjectStream
+    :return:
+    """
+    ndjson = request.accept_mimetypes.best == NDJSON_MIMETYPE
+    use_gzip = 'gzip' in request.accept_encodings
+    chunks = _iter_stream_chunks(_iter_stream_lines(stream, ndjson=ndjson), use_gzip=use_gzip)
+
+    resp = Response(stream_with_context(chunks),
+                    mimetype=NDJSON_MIMETYPE if ndjson else 'application/json')
+    if use_gzip:
+        resp.headers['Content-Encoding'] = 'gzip'
+    resp.headers['Vary'] = 'Accept, Accept-Encoding'
+    return resp
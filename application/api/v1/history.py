@@ -39,6 +39,7 @@ def do_get_histories(args):
     :param args:
     :return:
     """
+    args['stream'] = base.is_stream_request(args)
     ctx = context.create_context(
         task='get histories',
         data=args)
@@ -82,7 +83,10 @@ def do_delete_history(args):
 
 
 class Histories(Resource):
-    get_histories_args = base.LIST_OBJECTS_ARGS
+    get_histories_args = {
+        **base.LIST_OBJECTS_ARGS,
+        **base.STREAM_ARGS,
+    }
 
     create_history_args = {
         # TODO
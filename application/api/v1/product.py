@@ -226,3 +226,30 @@ class Price(Resource):
     @use_args(get_price_args, location=LOCATION)
     def post(self, args):
         return do_get_price(args=args)
+
+
+def do_get_price_matrix(args):
+    """
+    Do get price matrix of all products.
+    :param args:
+    :return:
+    """
+    ctx = context.create_context(
+        task='get product price matrix',
+        check_token=False,
+        data=args,
+    )
+    return base.exec_manager_func(product_mgr.get_price_matrix, ctx)
+
+
+class PriceMatrix(Resource):
+    get_price_matrix_args = {
+        'product_ids': fields.List(fields.Int(), required=False),
+        'product_types': fields.List(fields.Str(), required=False),
+        'durations': fields.List(fields.Int(), required=False),
+        'currency': fields.Str(required=False),
+    }
+
+    @use_args(get_price_matrix_args, location=LOCATION)
+    def get(self, args):
+        return do_get_price_matrix(args=args)
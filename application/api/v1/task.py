@@ -79,6 +79,16 @@ def do_delete_task(args):
     return base.exec_manager_func(task_mgr.delete_task, ctx)
 
 
+def do_get_scheduled_jobs():
+    """
+    Do get scheduled background jobs.
+    :return:
+    """
+    ctx = context.create_context(
+        task='get scheduled jobs')
+    return base.exec_manager_func(task_mgr.get_scheduled_jobs, ctx)
+
+
 class Tasks(Resource):
     get_tasks_args = base.LIST_OBJECTS_ARGS
 
@@ -124,3 +134,9 @@ class Task(Resource):
     def delete(self, args, task_id):
         args['task_id'] = task_id
         return do_delete_task(args=args)
+
+
+class ScheduledJobs(Resource):
+    @auth.login_required(role=('ADMIN', 'ADMIN_SALE', 'ADMIN_IT'))
+    def get(self):
+        return do_get_scheduled_jobs()
@@ -11,7 +11,7 @@ from flask import json as flask_json
 
 from application import app
 from application.base import objects
-from application.utils import date_util
+from application.utils import date_util, json_util
 
 
 DATE_FORMAT = '%Y-%m-%d'
@@ -23,20 +23,25 @@ DATE_TIME_MICROSEC_FORMAT = '%Y-%m-%dT%H:%M:%S.%fZ'
 class AppJSONEncoder(flask_json.JSONEncoder):
     """
     Custom JSON encoder for the app.
+    Encoding is done by the backend of json_util if possible.
     """
     def default(self, obj):
         if isinstance(obj, objects.FmtDatetime):
-            return str(obj)
+            # Value may be seconds since epoch
+            return obj.__str__()
         # if isinstance(obj, date):
         #     return date_util.format(obj, format=DATE_FORMAT)
         # if isinstance(obj, time):
         #     return date_util.format(obj, format=TIME_FORMAT)
         if isinstance(obj, datetime):
             # Another way: date_util.format(obj, format=DATE_TIME_FORMAT)
-            return obj.strftime(DATE_TIME_FORMAT)
+            return json_util.format_datetime(obj)
 
         return super().default(obj)
 
+    def encode(self, o):
+        return json_util.get_backend().encode(self, o)
+
 
 def json_dumps(value, **kw):
     """
@@ -20,6 +20,40 @@ def _get_context():
     return getattr(_request_ctx_stack.top, 'context', None)
 
 
+def _get_request_cache():
+    """
+    Get cache dict bound to the current request context.
+    :return: None if there is no request context.
+    """
+    ctx_stack_top = _request_ctx_stack.top
+    if ctx_stack_top is None:
+        return None
+    cache = getattr(ctx_stack_top, 'request_cache', None)
+    if cache is None:
+        cache = ctx_stack_top.request_cache = {}
+    return cache
+
+
+def load_request_user(user_id):
+    """
+    Load user by id at most once per request.
+    The loaded user is shared by token verification, context and locale selector.
+    :param user_id:
+    :return:
+    """
+    cache = _get_request_cache()
+    if cache is None:
+        return md.User.query.get(user_id)
+
+    key = ('user', user_id)
+    user = cache.get(key)
+    if user is None:
+        user = md.User.query.get(user_id)
+        if user:
+            cache[key] = user
+    return user
+
+
 class Context(object):
     def __init__(self, task,
                  request_user=None, target_user=None,
@@ -39,6 +73,8 @@ class Context(object):
         self.error = None
         self.warning = None
         self.log_args = dict(data) if data else {}
+        # Functions called with the history log id once the log of this context is saved
+        self.log_callbacks = []
 
     def copy(self, task=None, data=None):
         return Context(task=task if task is not None else self.task,
@@ -212,7 +248,7 @@ class Context(object):
             if not user_id:
                 self.set_error(errors.USER_NOT_AUTHORIZED, status=401)
                 return
-            self.request_user = md.User.query.get(user_id)
+            self.request_user = load_request_user(user_id)
             if not self.request_user:
                 self.set_error(errors.USER_NOT_AUTHORIZED, status=401)
                 return
@@ -220,6 +256,8 @@ class Context(object):
         # Target user
         target_user = (self.target_user or data.get('user_id') or
                        data.get('user_name') or self.request_user)
+        if isinstance(target_user, int) and self.request_user and target_user == self.request_user.id:
+            target_user = self.request_user
         self.target_user = md.load_user(target_user) if target_user else None
 
         # Request user
@@ -13,6 +13,8 @@ _l('Failed to release lock in database')
 
 OBJECT_LIST_CONDITION_INVALID = 'Object listing condition invalid'
 _l('Object listing condition invalid')
+OBJECT_LIST_CURSOR_INVALID = 'Object listing cursor invalid'
+_l('Object listing cursor invalid')
 REQUEST_PARAM_INVALID = 'Request param invalid'
 _l('Request param invalid')
 
@@ -4,7 +4,9 @@
 
 from datetime import timedelta
 import logging
+import os
 from os import environ as env
+import tempfile
 
 
 def _env_bool(name):
@@ -17,6 +19,8 @@ def _env_bool(name):
 class Config(object):
     DEBUG = _env_bool('FLASK_DEBUG') or True
     SECRET_KEY = 'Fti-Cas-82~d9^&(@!#6%1*7'
+    # Key of encrypted data stored in DB (e.g. credentials of queued tasks), default is SECRET_KEY
+    DATA_ENCRYPTION_KEY = env.get('CAS_DATA_ENCRYPTION_KEY') or SECRET_KEY
     ENV = env.get('FLASK_ENV', 'development')
     LEVEL_LOGGING = logging.DEBUG if DEBUG else logging.INFO
 
@@ -36,6 +40,19 @@ class Config(object):
     # API
     API_ACCESS_TOKEN_EXPIRATION = timedelta(days=1000) if DEBUG else timedelta(minutes=10)
     API_REFRESH_TOKEN_EXPIRATION = API_ACCESS_TOKEN_EXPIRATION * 2
+    # Process cache of verified access token -> user snapshot (0 to disable).
+    # A user change (role, status) may take up to this time to apply on other processes.
+    API_USER_CACHE_TTL = int(env.get('CAS_API_USER_CACHE_TTL') or 0)
+    API_USER_CACHE_SIZE = 10000
+    # Process cache of verified JWT payloads (tokens, encrypted user data).
+    # Items expire at the token "exp" or after the TTL, whichever comes first.
+    JWT_DECODE_CACHE_SIZE = 10000
+    JWT_DECODE_CACHE_TTL = 300
+
+    # JSON encoder of responses: auto, json, orjson (if installed)
+    JSON_ENCODER_BACKEND = env.get('CAS_JSON_ENCODER_BACKEND') or 'auto'
+    # Number of formatted datetime values cached by the JSON encoder
+    JSON_DATETIME_CACHE_SIZE = 4096
 
     # Database
     DB_HOST = 'localhost' if DEBUG else env.get('CAS_DB_HOST')
@@ -45,18 +62,25 @@ class Config(object):
     DB_PASSWORD = 'Fti@123' if DEBUG else env.get('CAS_DB_PASSWORD')
     DB_NAME = 'foxcloud' if DEBUG else env.get('CAS_DB_NAME')
 
+    # Backend of locks used by managers: auto, mysql, postgresql, table.
+    # auto uses DB advisory locks if supported, otherwise rows in `lock` table.
+    DB_LOCK_BACKEND = env.get('CAS_DB_LOCK_BACKEND') or 'auto'
+
     # DB object listing
     DB_MAX_ITEMS_PER_PAGE = 1000
     DB_ITEMS_PER_PAGE = 20
+    # Objects loaded at a time (one keyset page query) for streaming list responses
+    DB_STREAM_CHUNK_SIZE = 500
 
     # SQLAlchemy
-    SQLALCHEMY_DATABASE_URI = '{0}+pymysql://{1}:{2}@{3}:{4}/{5}?charset=utf8mb4'.format(DB_TYPE, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
+    # CAS_DB_URI replaces the DB settings above, e.g. sqlite:////tmp/cas-bench.db for benchmarks
+    SQLALCHEMY_DATABASE_URI = env.get('CAS_DB_URI') or '{0}+pymysql://{1}:{2}@{3}:{4}/{5}?charset=utf8mb4'.format(DB_TYPE, DB_USER, DB_PASSWORD, DB_HOST, DB_PORT, DB_NAME)
     SQLALCHEMY_TRACK_MODIFICATIONS = False
     SQLALCHEMY_ENGINE_OPTIONS = {
         'pool_size': 10,
         'max_overflow': 20,
         'pool_timeout': 20,
-    }
+    } if not SQLALCHEMY_DATABASE_URI.startswith('sqlite') else {}
 
     # Session
     SESSION_TYPE = 'null'  # null, redis, memcached, filesystem, mongodb, sqlalchemy
@@ -174,12 +198,65 @@ class Config(object):
         'digit': not DEBUG,
         'symbol': not DEBUG,
     }
+    # Computes synchronized with backend in less than this interval (seconds) are not synchronized again
+    # when listed
+    COMPUTE_STATUS_SYNC_INTERVAL = 60
+    # Max number of computes whose last sync time is kept in memory of each process
+    COMPUTE_STATUS_SYNC_CACHE_SIZE = 100000
+    # Daily reconciliation of computes with backend servers: clusters reconciled in parallel,
+    # fixes saved per batch, and whether servers of expired computes are stopped
+    COMPUTE_SYNC_MAX_WORKERS = 4
+    COMPUTE_SYNC_BATCH_SIZE = 200
+    COMPUTE_SYNC_STOP_EXPIRED = _env_bool('CAS_COMPUTE_SYNC_STOP_EXPIRED') or False
 
     # Background Jobs
     JOB_CLEAR_OLD_HISTORY_LOGS = {'trigger': 'cron', 'hour': 19, 'minute': 0}      # 2:00 AM daily
     JOB_CLEAR_OLD_REPORTS = {'trigger': 'cron', 'hour': 19, 'minute': 10}          # 2:10 AM daily
     JOB_CLEAR_OLD_SUPPORTS = {'trigger': 'cron', 'hour': 19, 'minute': 20}         # 2:20 AM daily
     JOB_SYNC_COMPUTES_DAILY = {'trigger': 'cron', 'hour': 20, 'minute': 0}         # 3:00 AM daily
+    JOB_CLEAR_OLD_JOB_RUNS = {'trigger': 'cron', 'hour': 19, 'minute': 30}         # 2:30 AM daily
+
+    # Retention of old history logs, reports and supports:
+    # rows are deleted in batches under a speed limit (rows/second, 0 for no limit),
+    # and archived to gzipped JSON lines files in the archive path if it is set.
+    RETENTION_BATCH_SIZE = 1000
+    RETENTION_ROWS_PER_SECOND = 5000
+    RETENTION_ARCHIVE_PATH = env.get('CAS_RETENTION_ARCHIVE_PATH') or ''
+
+    # Background scheduler
+    #   leader: only the process holding the lease runs jobs (for multiple gunicorn workers)
+    #   all: every process runs jobs
+    #   none: jobs are not run in this process
+    SCHEDULER_MODE = env.get('CAS_SCHEDULER_MODE') or 'leader'
+    SCHEDULER_LEASE_BACKEND = env.get('CAS_SCHEDULER_LEASE_BACKEND') or 'db'  # db, file
+    SCHEDULER_LEASE_FILE = env.get('CAS_SCHEDULER_LEASE_FILE') or os.path.join(
+        env.get('CAS_RUN_PATH') or tempfile.gettempdir(), 'cas_scheduler.lock')
+    SCHEDULER_LEASE_TTL = 60  # seconds
+    SCHEDULER_LEASE_RENEW_INTERVAL = 15  # seconds
+    SCHEDULER_MISFIRE_GRACE_TIME = 3600  # seconds, run a late job if it is not later than this
+    SCHEDULER_JOB_RUNS_KEEP_DAYS = 30
+
+    # Durable queue of OpenStack tasks executed by method 'mq', run by queue_worker.py processes
+    #   db: queue_task table of the app DB
+    #   sqlite: a local SQLite file, for workers on the same host only
+    TASK_QUEUE_BACKEND = env.get('CAS_TASK_QUEUE_BACKEND') or 'db'
+    TASK_QUEUE_SQLITE_PATH = env.get('CAS_TASK_QUEUE_SQLITE_PATH') or os.path.join(
+        env.get('CAS_RUN_PATH') or tempfile.gettempdir(), 'cas_task_queue.db')
+    # Running tasks are delivered again when not renewed by their worker in this time (seconds)
+    TASK_QUEUE_VISIBILITY_TIMEOUT = 120
+    TASK_QUEUE_MAX_ATTEMPTS = 5
+    # Retry delay is base * 2^(attempts - 1), up to max (seconds)
+    TASK_QUEUE_RETRY_BACKOFF = 10
+    TASK_QUEUE_RETRY_BACKOFF_MAX = 900
+    # Delay of new tasks, so requests commit the state of their objects before results come (seconds)
+    TASK_QUEUE_START_DELAY = 2
+    TASK_QUEUE_POLL_INTERVAL = 1  # seconds
+    TASK_QUEUE_WORKER_THREADS = 4
+    TASK_QUEUE_KEEP_DAYS = 7
+    # Method of long-running OpenStack calls (e.g. creating/rebuilding computes by Heat stacks):
+    # 'thread' runs them in the web process, 'mq' in queue_worker.py processes
+    # (only set 'mq' when queue workers are deployed)
+    OS_LONG_TASK_METHOD = env.get('CAS_OS_LONG_TASK_METHOD') or 'thread'
 
     # Sentry config
     USE_SENTRY = False
@@ -192,6 +269,80 @@ class Config(object):
         'nova': '2.87',  # 2.87 (Maximum in Ussuri)
         'trove': '2',
     }
+
+    # Check cached configurations for changes in DB after this interval (seconds)
+    CONFIG_CACHE_CHECK_INTERVAL = 30
+
+    # History logs writer
+    #   async: logs are queued and bulk inserted by a background thread
+    #   sync: each log is saved in the request
+    # In-progress logs (202 responses) are always saved in the request to get their id.
+    HISTORY_WRITER_MODE = env.get('CAS_HISTORY_WRITER_MODE') or 'async'
+    HISTORY_WRITER_BATCH_SIZE = 200
+    HISTORY_WRITER_FLUSH_INTERVAL = 0.2  # seconds
+    HISTORY_WRITER_MAX_BUFFER = 10000  # logs are saved in the request when buffer is full
+
+    # Product price matrix: durations (months) to precompute and interval (seconds)
+    # to check products and promotions in DB for changes
+    PRICE_MATRIX_DURATIONS = (1, 3, 6, 12, 24, 36)
+    PRICE_MATRIX_CHECK_INTERVAL = 60
+
+    # Rebuild in-memory index of enabled promotions from DB after this interval (seconds)
+    PROMOTION_INDEX_REBUILD_INTERVAL = 300
+
+    # Rebuild in-memory index of NETWORK_IP pools from DB after this interval (seconds)
+    NET_IP_POOL_INDEX_REBUILD_INTERVAL = 300
+
+    # Per-request metrics (DB, OpenStack calls, locks, serialization) and endpoint latency histograms
+    PERF_METRICS_ENABLED = _env_bool('CAS_PERF_METRICS_ENABLED') is not False
+    # Send request metrics to clients in Server-Timing header
+    PERF_SERVER_TIMING = _env_bool('CAS_PERF_SERVER_TIMING') is not False
+    # Upper bounds (milliseconds) of latency histogram buckets
+    PERF_LATENCY_BUCKETS = (5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+    # Pool of OpenStack API clients, reused per (cluster, os user, project, services, engine).
+    # Clients expire after the TTL or when their Keystone token is about to expire.
+    OS_CLIENT_POOL_MAX_SIZE = 200  # 0 to disable
+    OS_CLIENT_POOL_TTL = 30 * 60
+    OS_CLIENT_POOL_ENGINES = ('console', 'sim')
+
+    # In-process OpenStack simulator, used by clients created with engine 'sim'.
+    # Enable to make all OpenStack clients use it, e.g. for load tests without a cloud.
+    OS_SIMULATOR_ENABLED = _env_bool('CAS_OS_SIMULATOR_ENABLED') or False
+    OS_SIMULATOR = {
+        'seed': 1,
+        # Latency of calls in seconds, normally distributed by the jitter
+        'latency': float(env.get('CAS_OS_SIMULATOR_LATENCY') or 0.05),
+        'latency_jitter': 0.01,
+        # Ratio of calls failing with an error
+        'error_rate': float(env.get('CAS_OS_SIMULATOR_ERROR_RATE') or 0),
+        # Max concurrent calls per cluster, 0 for no limit (like API worker limit of a cloud)
+        'max_concurrency': 0,
+        # Per call configs by name, e.g. {'shade.get_servers': {'latency': 0.5, 'error_rate': 0.01}}
+        'calls': {},
+        # Number of resources generated per cluster by kind
+        'dataset': {
+            'server': 1000,
+            'volume': 1000,
+            'lb': 100,
+            'project': 100,
+            'neutron_network': 100,
+            'flavor': 20,
+        },
+        'quotas': {
+            'cores': 100,
+            'ram': 102400,
+            'instances': 50,
+        },
+    }
+
+    # Concurrent lookups of OpenStack child objects (e.g. extra fields of listing)
+    OS_FAN_OUT_MAX_WORKERS = 16
+    OS_FAN_OUT_CALL_TIMEOUT = 30  # seconds
+    # Max items of one list call when paging is pushed down to OpenStack API
+    OS_PUSHDOWN_MAX_LIMIT = 1000
+    # Expand LB listeners/pools: 'batch' uses one list call per LB, 'get' uses one get call per child
+    LBAAS_EXTRA_FIELD_MODE = 'batch'
     PROVIDER_SRIOV = "sriov"
     CURRENT_HEAT_VERSION = 'rocky'
     HEAT_TEMPLATE_VERSIONS = {
@@ -2,83 +2,24 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import base64
 import datetime
 from functools import wraps
 import re
-import time
 
-from sqlalchemy import and_, or_
+from sqlalchemy import and_, or_, inspect as sa_inspect
 
 from application import app, db
 from application.base import errors, common
 from application import models as md
-from application.utils import data_util, date_util
+from application.utils import data_util, date_util, lock_util
 
 LOG = app.logger
 
 DEFAULT_SORT_BY = ['create_date__desc']
 
-
-def get_lock(id, timeout=None):
-    """
-    Get lock object.
-    :param id:
-    :param timeout: timeout in seconds
-    :return:
-    """
-    lock = md.Lock.query.get(id)
-    if lock and timeout is not None:
-        if lock.timestamp + datetime.timedelta(seconds=timeout) < datetime.datetime.utcnow():
-            error = md.remove(lock)
-            return None
-    return lock
-
-
-def acquire_lock(ctx, id, timeout=None):
-    """
-    Create a lock to do an action with preventing race condition.
-    :param ctx:
-    :param id:
-    :param timeout:
-    :return:
-    """
-    lock = get_lock(id, timeout=timeout)
-    if lock:
-        ctx.set_error(errors.DB_LOCK_ACQUIRE_FAILED, status=406)
-        return
-    lock = md.Lock(id=id, timestamp=datetime.datetime.utcnow())
-    error = md.save_new(lock)
-    if error:
-        ctx.set_error(errors.DB_LOCK_ACQUIRE_FAILED, status=406)
-        return
-    return lock
-
-
-def release_lock(ctx, lock):
-    """
-    Release a lock.
-    :param lock:
-    :return:
-    """
-    error = md.remove(lock)
-    if error:
-        ctx.set_error(errors.DB_LOCK_RELEASE_FAILED, status=406)
-        return
-
-
-def release_lock_by_id(ctx, id):
-    """
-    Release a lock.
-    :param ctx:
-    :param id:
-    :return:
-    """
-    lock = get_lock(id)
-    if lock:
-        error = md.remove(lock)
-        if error:
-            ctx.set_error(errors.DB_LOCK_RELEASE_FAILED, status=406)
-            return
+# Number of objects loaded at a time when streaming objects
+DB_STREAM_CHUNK_SIZE = app.config['DB_STREAM_CHUNK_SIZE']
 
 
 def with_lock(ctx, id, timeout=None, wait_timeout=None, check_interval=1):
@@ -92,35 +33,27 @@ def with_lock(ctx, id, timeout=None, wait_timeout=None, check_interval=1):
 
     :param ctx:
     :param id: lock id
-    :param timeout:
-    :param wait_timeout:
-    :param check_interval:
+    :param timeout: consider the lock stale after this time (table lock backend)
+    :param wait_timeout: max time to wait for the lock, None to fail immediately
+    :param check_interval: max interval to check the lock (table lock backend)
     :return:
     """
-    check_interval = check_interval or 1
-
     def wrapper(func):
         @wraps(func)
         def func_wrapper(*a, **kw):
-            wait = 0
-            while True:
-                lock = acquire_lock(ctx, id, timeout=timeout)
-                if lock:
-                    LOG.debug('Lock acquired: ' + id)
-                    try:
-                        return func(*a, **kw)
-                    finally:
-                        release_lock(ctx, lock)
-                        LOG.debug('Lock released: ' + id)
-                else:
-                    if not wait_timeout:
-                        ctx.set_error(errors.DB_LOCK_ACQUIRE_FAILED, status=500)
-                        return
-                    time.sleep(check_interval)
-                    wait += check_interval
-                    if wait >= wait_timeout:
-                        ctx.set_error(errors.DB_LOCK_ACQUIRE_FAILED, status=500)
-                        return
+            lock = lock_util.acquire(id, timeout=timeout, wait_timeout=wait_timeout,
+                                     check_interval=check_interval)
+            if not lock:
+                ctx.set_error(errors.DB_LOCK_ACQUIRE_FAILED, status=500)
+                return
+
+            LOG.debug('Lock acquired: ' + id)
+            try:
+                return func(*a, **kw)
+            finally:
+                if not lock.release():
+                    ctx.set_error(errors.DB_LOCK_RELEASE_FAILED, status=406)
+                LOG.debug('Lock released: ' + id)
 
         return func_wrapper
     return wrapper
@@ -172,6 +105,9 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
                 - common case: user,user.id==order.user_id
                 - multiple columns: user,user.id==support.user1_id,user.id==support.user2_id
             sort_by: sorting key, e.g. col1__asc,col2__desc
+            cursor: enable keyset (cursor) pagination instead of page/page_size,
+                pass an empty string for the first page, then the returned `next_cursor`
+            stream: get all objects as an ObjectStream in ctx.response instead of a page
             extra_field_condition: condition applied on extra fields,
                 this way may have less performance, avoid to use it if not needed
     :param model_class:
@@ -190,6 +126,7 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
     region_id = data.get('region_id') or None
     page = int(data.get('page') or 1)
     page_size = int(data.get('page_size') or 1000)
+    cursor = data.get('cursor')
     sort_by = data.get('sort_by')
     condition = data.get('condition')
     fields = data.get('fields')
@@ -220,19 +157,13 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
     cond_kwargs = override_condition if isinstance(override_condition, dict) else {}
     cond_args = override_condition if isinstance(override_condition, (list, tuple)) else []
 
-    order_by = []
     if sort_by is None:
         sort_by = DEFAULT_SORT_BY
-    if sort_by:
-        for item in sort_by:
-            item = item.split('__')
-            attr = item[0]
-            direction = item[1] if len(item) == 2 else 'asc'
-
-            attr = getattr(model_class, attr, None)
-            if attr:
-                attr = getattr(attr, direction, None)
-                order_by.append(attr())
+    sort_columns = _parse_sort_by(model_class, sort_by)
+    if cursor is not None or data.get('stream'):
+        # Keyset pagination needs a unique and stable ordering
+        sort_columns = _add_sort_tie_breaker(model_class, sort_columns)
+    order_by = [getattr(column, direction)() for column, direction in sort_columns]
 
     # Create query first
     query = md.query(model_class, *conds, *cond_args, order_by=order_by, **cond_kwargs)
@@ -245,6 +176,12 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
             ctx.set_error(errors.OBJECT_LIST_CONDITION_INVALID, cause=e, status=406)
             return
 
+    # Prefetch relationships of requested fields for all items of the page to avoid N+1 queries
+    if hasattr(model_class, 'get_prefetch_options'):
+        prefetch_options = model_class.get_prefetch_options(list(fields) + list(extra_fields or []))
+        if prefetch_options:
+            query = query.options(*prefetch_options)
+
     # # Condition will be used on extra fields of objects
     # if isinstance(extra_field_condition, str):
     #     try:
@@ -252,6 +189,17 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
     #     except:
     #         extra_field_condition = None
 
+    # Stream all matched objects instead of a page
+    if data.get('stream'):
+        ctx.response = ObjectStream(ctx, query, sort_columns, fields=fields, extra_fields=extra_fields,
+                                    is_admin=is_admin, on_loaded_func=on_loaded_func)
+        return ctx.response
+
+    if cursor is not None:
+        return _dump_objects_by_cursor(ctx, query, sort_columns, cursor=cursor, page_size=page_size,
+                                       fields=fields, extra_fields=extra_fields, is_admin=is_admin,
+                                       on_loaded_func=on_loaded_func)
+
     prev_page = None
     objects_data = []
     all_objects = []
@@ -284,6 +232,221 @@ def dump_objects(ctx, model_class, override_condition=None, on_loaded_func=None,
     return all_objects
 
 
+class ObjectStream(object):
+    """
+    Iterable of dumped model objects for streaming responses.
+    Objects are loaded by chunks using keyset pagination and dumped one by one,
+    so memory use does not depend on the number of objects.
+    A server-side cursor (yield_per) is not used: prefetch and lazy loads of relationships
+    run other queries on the same connection, which ends an open cursor early on MySQL.
+    """
+
+    def __init__(self, ctx, query, sort_columns, fields=None, extra_fields=None, is_admin=False,
+                 on_loaded_func=None, chunk_size=None):
+        """
+        :param ctx:
+        :param query: ordered query
+        :param sort_columns: list of (column, direction), last item must be unique
+        :param fields:
+        :param extra_fields:
+        :param is_admin:
+        :param on_loaded_func:
+        :param chunk_size:
+        """
+        self.ctx = ctx
+        self.query = query
+        self.sort_columns = sort_columns
+        self.fields = fields
+        self.extra_fields = extra_fields
+        self.is_admin = is_admin
+        self.on_loaded_func = on_loaded_func
+        self.chunk_size = chunk_size or DB_STREAM_CHUNK_SIZE
+
+    def _dump(self, objects):
+        items = self.on_loaded_func(self.ctx, objects) if self.on_loaded_func else objects
+        for item in items:
+            yield item.to_dict(fields=self.fields,
+                               extra_fields=self.extra_fields,
+                               is_admin=self.is_admin)
+
+    def __iter__(self):
+        cursor_values = None
+        while True:
+            chunk = _query_after(self.query, self.sort_columns, cursor_values).limit(self.chunk_size).all()
+            if not chunk:
+                break
+            cursor_values = [getattr(chunk[-1], column.key) for column, _ in self.sort_columns]
+            yield from self._dump(chunk)
+            if len(chunk) < self.chunk_size:
+                break
+
+
+def _dump_objects_by_cursor(ctx, query, sort_columns, cursor, page_size,
+                            fields=None, extra_fields=None, is_admin=False,
+                            on_loaded_func=None):
+    """
+    Get multiple model objects using keyset (cursor) pagination.
+    No COUNT query is issued, and each page seeks directly to the position
+    after the cursor using the sorting columns instead of an OFFSET scan.
+    :param ctx:
+    :param query: ordered query
+    :param sort_columns: list of (column, direction), last item must be unique
+    :param cursor: cursor string returned from previous page or empty for the first page
+    :param page_size:
+    :param fields:
+    :param extra_fields:
+    :param is_admin:
+    :param on_loaded_func:
+    :return:
+    """
+    try:
+        cursor_values = decode_cursor(cursor) if cursor else None
+        if cursor_values is not None and len(cursor_values) != len(sort_columns):
+            raise ValueError('Cursor does not match sorting columns')
+    except BaseException as e:
+        ctx.set_error(errors.OBJECT_LIST_CURSOR_INVALID, cause=e, status=406)
+        return
+
+    objects_data = []
+    all_objects = []
+    while True:
+        # Load one more item to know if there are more items
+        objects = _query_after(query, sort_columns, cursor_values).limit(page_size + 1).all()
+        has_more = len(objects) > page_size
+        objects = objects[:page_size]
+        if objects:
+            cursor_values = [getattr(objects[-1], column.key) for column, _ in sort_columns]
+
+        items = on_loaded_func(ctx, objects) if on_loaded_func else objects
+        for item in items:
+            objects_data.append(item.to_dict(fields=fields,
+                                             extra_fields=extra_fields,
+                                             is_admin=is_admin))
+            all_objects.append(item)
+
+        if all_objects or not has_more:
+            break
+
+    ctx.response = {
+        'data': objects_data,
+        'has_more': has_more,
+        'next_cursor': encode_cursor(cursor_values) if has_more else None,
+    }
+    return all_objects
+
+
+def _query_after(query, sort_columns, cursor_values):
+    """
+    Filter query to get rows after the cursor values in the sorting order.
+    :param query: ordered query
+    :param sort_columns:
+    :param cursor_values: None to get from the first row
+    :return:
+    """
+    if cursor_values is None:
+        return query
+    return query.filter(_make_keyset_condition(sort_columns, cursor_values))
+
+
+def _parse_sort_by(model_class, sort_by):
+    """
+    Parse sorting keys to list of (column, direction).
+    :param model_class:
+    :param sort_by: list of keys, e.g. ['col1__asc', 'col2__desc']
+    :return:
+    """
+    result = []
+    for item in sort_by or []:
+        item = item.split('__')
+        attr = item[0]
+        direction = item[1] if len(item) == 2 else 'asc'
+        if direction not in ('asc', 'desc'):
+            continue
+
+        column = getattr(model_class, attr, None)
+        if column is not None and hasattr(column, direction):
+            result.append((column, direction))
+    return result
+
+
+def _add_sort_tie_breaker(model_class, sort_columns):
+    """
+    Add primary key to the sorting columns to make the ordering unique.
+    :param model_class:
+    :param sort_columns:
+    :return:
+    """
+    pk_column = sa_inspect(model_class).primary_key[0]
+    pk_column = getattr(model_class, pk_column.key)
+    for column, _ in sort_columns:
+        if column.key == pk_column.key:
+            return sort_columns
+    direction = sort_columns[-1][1] if sort_columns else 'desc'
+    return sort_columns + [(pk_column, direction)]
+
+
+def _make_keyset_condition(sort_columns, values):
+    """
+    Make condition to seek rows after the values in the sorting order.
+    E.g. (create_date desc, id desc) after (d, 10) results in:
+        create_date < d or (create_date == d and id < 10)
+    :param sort_columns:
+    :param values:
+    :return:
+    """
+    conds = []
+    for i, (column, direction) in enumerate(sort_columns):
+        value = values[i]
+        equals = [sort_columns[j][0] == values[j] for j in range(i)]
+        if value is None:
+            # NULL values are sorted first in asc order (and last in desc order) by MySQL
+            if direction == 'asc':
+                conds.append(and_(*equals, column.isnot(None)))
+            continue
+        if direction == 'asc':
+            after = column > value
+        else:
+            after = or_(column < value, column.is_(None))
+        conds.append(and_(*equals, after))
+    return or_(*conds)
+
+
+def encode_cursor(values):
+    """
+    Encode values of sorting columns to an opaque cursor string.
+    :param values:
+    :return:
+    """
+    items = []
+    for value in values:
+        if isinstance(value, datetime.datetime):
+            items.append({'dt': value.strftime(common.DATE_TIME_MICROSEC_FORMAT)})
+        elif isinstance(value, datetime.date):
+            items.append({'d': value.strftime(common.DATE_FORMAT)})
+        else:
+            items.append({'v': value})
+    content = common.json_dumps(items, separators=(',', ':'))
+    return base64.urlsafe_b64encode(content.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(cursor):
+    """
+    Decode cursor string created by encode_cursor().
+    :param cursor:
+    :return:
+    """
+    content = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4))
+    values = []
+    for item in common.json_loads(content.decode('utf-8')):
+        if 'dt' in item:
+            values.append(datetime.datetime.strptime(item['dt'], common.DATE_TIME_MICROSEC_FORMAT))
+        elif 'd' in item:
+            values.append(datetime.datetime.strptime(item['d'], common.DATE_FORMAT).date())
+        else:
+            values.append(item['v'])
+    return values
+
+
 def _parse_condition(model_class, condition):
     """
     Parse a condition object to a SQLAlchemy filter.
@@ -6,9 +6,11 @@ from flask import request
 
 from application import app, db
 from application.base import errors, common
-from application.managers import base
+from application.managers import base, config_mgr, history_mgr, product_mgr, promotion_mgr, queue_mgr
 from application import models as md
-from application.utils import data_util, date_util, str_util
+from application.product_types.openstack import os_client_pool, os_simulator
+from application.utils import (data_util, date_util, json_util, lock_util, perf_util,
+                               retention_util, str_util)
 
 LOG = app.logger
 
@@ -78,10 +80,67 @@ def do_server_action(ctx):
         ctx.response = {}
         return
 
+    if action == 'config_reload':
+        config_mgr.reload_configs()
+        ctx.response = {}
+        return
+
+    if action == 'os_client_pool_clear':
+        os_client_pool.clear()
+        ctx.response = {}
+        return
+
+    if action == 'os_simulator_reset':
+        os_simulator.reset()
+        ctx.response = {}
+        return
+
     e = ValueError('Admin server action "{}" invalid.'.format(action))
     ctx.set_error(errors.REQUEST_PARAM_INVALID, cause=e, status=406)
 
 
+def get_server_stats(ctx):
+    """
+    Get runtime statistics of server caches and pools.
+    :param ctx:
+    :return:
+    """
+    ctx.response = {
+        'os_client_pool': os_client_pool.get_stats(),
+        'jwt_decode_cache': str_util.jwt_decode_cache_stats(),
+        'user_token_cache': md.User.token_cache_stats(),
+        'locks': lock_util.get_stats(),
+        'history_writer': history_mgr.get_writer_stats(),
+        'retention': retention_util.get_stats(),
+        'json_encoder': json_util.get_stats(),
+        'os_simulator': os_simulator.get_stats(),
+        'task_queue': queue_mgr.get_stats(),
+    }
+
+
+def get_request_stats(ctx):
+    """
+    Get latency histograms and operation metrics of API endpoints.
+    :param ctx:
+    :return:
+    """
+    stats = perf_util.get_stats()
+    endpoint = ctx.data.get('endpoint')
+    if endpoint:
+        stats['endpoints'] = {k: v for k, v in stats['endpoints'].items() if endpoint in k}
+    ctx.response = stats
+
+
+def reset_request_stats(ctx):
+    """
+    Clear latency histograms of API endpoints.
+    :param ctx:
+    :return:
+    """
+    perf_util.reset_stats()
+    ctx.response = {}
+
+
 def get_model_object(ctx):
     """
     Get model object.
@@ -151,6 +210,13 @@ def create_model_object(ctx):
         ctx.set_error(error, status=500)
         return
 
+    if model_class is md.Configuration:
+        config_mgr.reload_configs()
+    if model_class in (md.Product, md.Promotion):
+        product_mgr.invalidate_price_matrix()
+    if model_class is md.Promotion:
+        promotion_mgr.invalidate_promotion_index()
+
 
 def update_model_object(ctx):
     """
@@ -184,6 +250,13 @@ def update_model_object(ctx):
         ctx.set_error(error, status=500)
         return
 
+    if model_class is md.Configuration:
+        config_mgr.reload_configs()
+    if model_class in (md.Product, md.Promotion):
+        product_mgr.invalidate_price_matrix()
+    if model_class is md.Promotion:
+        promotion_mgr.invalidate_promotion_index()
+
 
 def delete_model_object(ctx):
     """
@@ -205,6 +278,14 @@ def delete_model_object(ctx):
     error = md.remove(model_obj)
     if error:
         ctx.set_error(error, status=500)
+        return
+
+    if model_class is md.Configuration:
+        config_mgr.reload_configs()
+    if model_class in (md.Product, md.Promotion):
+        product_mgr.invalidate_price_matrix()
+    if model_class is md.Promotion:
+        promotion_mgr.invalidate_promotion_index()
 
 
 def sql_execute(ctx):
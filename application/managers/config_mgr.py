@@ -2,13 +2,19 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
-from application import app
+import threading
+import time
+
+from application import app, apscheduler, db
 from application.base import errors
 from application.managers import base as base_mgr, user_mgr
 from application import models as md
 
 LOG = app.logger
 
+# Interval to check if a cached config has a new version in DB
+CONFIG_CHECK_INTERVAL = app.config['CONFIG_CACHE_CHECK_INTERVAL']
+
 ADMIN_ROLES = (md.UserRole.ADMIN, md.UserRole.ADMIN_SALE, md.UserRole.ADMIN_IT)
 GET_ROLES = ADMIN_ROLES
 LIST_ROLES = ADMIN_ROLES
@@ -86,6 +92,173 @@ def delete_config(ctx):
     ctx.set_error('Not Implemented Yet', status=500)
 
 
+class CachedConfig(object):
+    """
+    Detached copy of a Configuration row, safe to share between requests and threads.
+    """
+    __slots__ = ('id', 'type', 'name', 'version', 'status', 'create_date', 'contents', 'extra')
+
+    def __init__(self, config):
+        for attr in self.__slots__:
+            setattr(self, attr, getattr(config, attr))
+
+    def __repr__(self):
+        return '<CachedConfig {}/{} v{}>'.format(self.type, self.name, self.version)
+
+
+class ConfigRegistry(object):
+    """
+    Cache of the enabled highest-version config per (type, name).
+    A cached config is revalidated by reloading the row after an interval,
+    when its version or contents change (e.g. edited in place by admin) listeners are notified.
+    """
+
+    def __init__(self, check_interval):
+        self.check_interval = check_interval
+        self._configs = {}  # (type, name) -> (CachedConfig or None, check time)
+        self._listeners = {}  # (type, name) -> list of functions
+        self._lock = threading.RLock()
+
+    def get(self, type, name=None, force_check=False):
+        """
+        Get config.
+        :param type:
+        :param name: None to get the highest version of all configs of the type
+        :param force_check: check version in DB even the interval has not passed
+        :return: CachedConfig or None if not found.
+        """
+        key = (type, name)
+        item = self._configs.get(key)
+        if item is not None and not force_check and time.monotonic() - item[1] < self.check_interval:
+            return item[0]
+
+        with self._lock:
+            item = self._configs.get(key)
+            if item is not None and not force_check and time.monotonic() - item[1] < self.check_interval:
+                return item[0]
+            return self._revalidate(key, item[0] if item else None)
+
+    def _filters(self, type, name):
+        filters = [md.Configuration.type == type,
+                   md.Configuration.status == md.ConfigurationStatus.ENABLED]
+        if name is not None:
+            filters.append(md.Configuration.name == name)
+        return filters
+
+    def _revalidate(self, key, config):
+        """
+        Reload config, listeners are notified if it has changed.
+        :param key:
+        :param config: current cached config
+        :return:
+        """
+        type, name = key
+        checked = time.monotonic()
+        # Version is not enough, configs can be edited in place with the same version
+        new_config = md.query(md.Configuration, *self._filters(type, name),
+                              order_by=md.Configuration.version.desc()).first()
+        new_config = CachedConfig(new_config) if new_config else None
+
+        if config is not None and new_config is not None and _same_config(config, new_config):
+            self._configs[key] = (config, checked)
+            return config
+        self._configs[key] = (new_config, checked)
+
+        if config is not None and new_config is not None:
+            LOG.info('Config {}/{} changed from version {} to {}.'.format(
+                type, name or '', config.version, new_config.version))
+            self._notify(key, new_config)
+        return new_config
+
+    def _notify(self, key, config):
+        for func in self._listeners.get(key) or []:
+            try:
+                func(config)
+            except BaseException as e:
+                LOG.exception('Config listener {} failed: {}'.format(func, e))
+
+    def add_listener(self, type, name, func):
+        """
+        Register a function called with the new config when config is reloaded.
+        :param type:
+        :param name:
+        :param func:
+        :return:
+        """
+        with self._lock:
+            listeners = self._listeners.setdefault((type, name), [])
+            # Product types may be initialized more than once
+            if func not in listeners:
+                listeners.append(func)
+
+    def refresh(self):
+        """
+        Check all cached configs for new versions, so listeners get
+        notified even when nobody reads the config.
+        :return:
+        """
+        for key in list(self._configs.keys()):
+            self.get(*key, force_check=True)
+
+    def invalidate(self):
+        """
+        Force checking all configs on next access.
+        :return:
+        """
+        with self._lock:
+            for key, (config, _) in list(self._configs.items()):
+                self._configs[key] = (config, float('-inf'))
+
+
+def _same_config(config1, config2):
+    return (config1.id == config2.id and config1.version == config2.version and
+            config1.contents == config2.contents and config1.extra == config2.extra)
+
+
+config_registry = ConfigRegistry(check_interval=CONFIG_CHECK_INTERVAL)
+
+
+def get_cached_config(type, name=None):
+    """
+    Get enabled highest-version config from the cache.
+    :param type:
+    :param name:
+    :return: CachedConfig or None
+    """
+    return config_registry.get(type, name)
+
+
+def on_config_changed(type, name, func):
+    """
+    Register a function to call when config is reloaded with a new version.
+    :param type:
+    :param name:
+    :param func: func(config)
+    :return:
+    """
+    config_registry.add_listener(type, name, func)
+
+
+def reload_configs():
+    """
+    Reload all cached configs now, e.g. after configs are changed by admin.
+    :return:
+    """
+    config_registry.invalidate()
+    config_registry.refresh()
+
+
+def refresh_configs():
+    """
+    Check cached configs for changes, run in all processes.
+    :return:
+    """
+    try:
+        config_registry.refresh()
+    finally:
+        db.session.remove()
+
+
 def get_app_config(ctx, config_name=None):
     """
     Get App config from DB.
@@ -93,11 +266,7 @@ def get_app_config(ctx, config_name=None):
     :param config_name:
     :return:
     """
-    app_config = md.query(md.Configuration,
-                          type=md.ConfigurationType.APP,
-                          **({'name': config_name} if config_name else {}),
-                          status=md.ConfigurationStatus.ENABLED,
-                          order_by=md.Configuration.version.desc()).first()
+    app_config = get_cached_config(md.ConfigurationType.APP, config_name)
     if not app_config:
         e = ValueError('Config APP/{} not found in database.'
                        .format(config_name or ''))
@@ -107,3 +276,8 @@ def get_app_config(ctx, config_name=None):
 
     ctx.response = app_config
     return app_config
+
+
+# Not added by task_mgr as every process needs to reload configs
+apscheduler.add_job(refresh_configs, trigger='interval', id='config_mgr.refresh_configs',
+                    seconds=CONFIG_CHECK_INTERVAL)
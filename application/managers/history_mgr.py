@@ -2,17 +2,27 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import atexit
 from functools import wraps
+import os
+import queue
+import threading
+import time
 
 from application import app, db
 from application.base import common, errors
 from application.base.context import create_admin_context
 from application.managers import base as base_mgr, config_mgr, task_mgr, user_mgr
 from application import models as md
-from application.utils import date_util
+from application.utils import date_util, retention_util
 
 LOG = app.logger
 
+HISTORY_WRITER_MODE = app.config['HISTORY_WRITER_MODE']
+HISTORY_WRITER_BATCH_SIZE = app.config['HISTORY_WRITER_BATCH_SIZE']
+HISTORY_WRITER_FLUSH_INTERVAL = app.config['HISTORY_WRITER_FLUSH_INTERVAL']
+HISTORY_WRITER_MAX_BUFFER = app.config['HISTORY_WRITER_MAX_BUFFER']
+
 ADMIN_ROLES = (md.UserRole.ADMIN, md.UserRole.ADMIN_SALE, md.UserRole.ADMIN_IT)
 GET_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
 LIST_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
@@ -93,8 +103,9 @@ def on_get_histories(ctx, histories):
                 timeout_at = date_util.utc_from_sec(timeout_at)
                 if timeout_at < date_util.utc_now():
                     hist.status = md.HistoryStatus.TIMED_OUT
-        # Save modified items
-        md.save(histories)
+        # Save modified items, but not while a streaming cursor is open on the connection
+        if not ctx.data.get('stream'):
+            md.save(histories)
     except Exception as e:
         LOG.error('Failed to parse history action time out. Error: {}'.format(e))
 
@@ -157,6 +168,186 @@ def log_ctx(action, func=None, **kwargs):
     return wrapper
 
 
+class HistoryWriter(object):
+    """
+    Buffered writer of history logs.
+    Logs are queued in process and a background thread bulk inserts them
+    when a batch is full or after the flush interval.
+    """
+    _STOP = object()
+
+    def __init__(self, batch_size, flush_interval, max_buffer):
+        """
+        Create writer.
+        :param batch_size: max number of logs in one insert
+        :param flush_interval: max time in seconds a queued log waits to be written
+        :param max_buffer: max number of queued logs, write() fails when the buffer is full
+        """
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_buffer = max_buffer
+        self.stats = {
+            'queued': 0,
+            'written': 0,
+            'failed': 0,
+            'rejected': 0,
+            'batches': 0,
+            'flush_time': 0.0,
+        }
+        self._queue = None
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._lock = threading.Lock()
+
+    def _ensure_started(self):
+        # Threads are not copied to forked workers, start a new one per process
+        if self._pid == os.getpid():
+            return
+        with self._lock:
+            if self._pid != os.getpid():
+                self._queue = queue.Queue(maxsize=self.max_buffer)
+                self._thread = threading.Thread(target=self._run, name='history-writer', daemon=True)
+                self._thread.start()
+                self._pid = os.getpid()
+
+    def write(self, row):
+        """
+        Queue a history log to write.
+        :param row: dict of History column values
+        :return: False if the log is not queued, caller should save it itself.
+        """
+        if self._stopped:
+            return False
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(row)
+        except queue.Full:
+            self.stats['rejected'] += 1
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def _take_batch(self):
+        """
+        Wait for a batch of logs.
+        :return: list of logs, None if the writer is stopped.
+        """
+        item = self._queue.get()
+        if item is self._STOP:
+            return None
+        batch = [item]
+        deadline = time.monotonic() + self.flush_interval
+        while len(batch) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            try:
+                item = self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait()
+            except queue.Empty:
+                break
+            if item is self._STOP:
+                # Write what we have, then stop
+                self._queue.put(item)
+                break
+            batch.append(item)
+        return batch
+
+    def _run(self):
+        while True:
+            batch = self._take_batch()
+            if batch is None:
+                return
+            self.flush(batch)
+
+    def flush(self, batch):
+        """
+        Insert logs in one statement, one by one if the batch insert fails.
+        :param batch:
+        :return:
+        """
+        table = md.History.__table__
+        started = time.monotonic()
+        with app.app_context():
+            try:
+                db.engine.execute(table.insert(), batch)
+                self.stats['written'] += len(batch)
+            except BaseException as e:
+                LOG.warning('Failed to write {} history logs in batch: {}'.format(len(batch), e))
+                for row in batch:
+                    try:
+                        db.engine.execute(table.insert(), row)
+                        self.stats['written'] += 1
+                    except BaseException as e:
+                        LOG.error('Failed to write history log {}: {}'.format(row, e))
+                        self.stats['failed'] += 1
+        self.stats['batches'] += 1
+        self.stats['flush_time'] += time.monotonic() - started
+
+    def stop(self, timeout=10):
+        """
+        Stop accepting logs and write all queued logs.
+        :param timeout:
+        :return:
+        """
+        self._stopped = True
+        if self._pid != os.getpid() or not self._thread.is_alive():
+            return
+        self._queue.put(self._STOP)
+        self._thread.join(timeout)
+
+    def get_stats(self):
+        stats = dict(self.stats)
+        stats['buffered'] = self._queue.qsize() if self._pid == os.getpid() else 0
+        return stats
+
+
+history_writer = HistoryWriter(batch_size=HISTORY_WRITER_BATCH_SIZE,
+                               flush_interval=HISTORY_WRITER_FLUSH_INTERVAL,
+                               max_buffer=HISTORY_WRITER_MAX_BUFFER)
+atexit.register(history_writer.stop)
+
+# History columns written by the writer, all rows of a batch need the same keys
+_HISTORY_ROW_COLUMNS = [c.name for c in md.History.__table__.columns if c.name != 'id']
+
+
+def _history_row(history):
+    return {name: getattr(history, name) for name in _HISTORY_ROW_COLUMNS}
+
+
+def _save_history(ctx, history):
+    """
+    Save history log, by the writer if possible.
+    :param ctx:
+    :param history:
+    :return: an Error object if failed or None.
+    """
+    # In-progress actions need the log id in the response and to update the log later.
+    # Also save right away if the session has pending changes, as saving the log commits them.
+    session = md.get_session()
+    if (HISTORY_WRITER_MODE == 'async' and
+            history.status != md.HistoryStatus.IN_PROGRESS and
+            not (session.new or session.dirty or session.deleted)):
+        if history_writer.write(_history_row(history)):
+            return None
+
+    error = md.save_new(history)
+    if not error:
+        ctx.log_args['log_id'] = history.id
+        for func in ctx.log_callbacks:
+            try:
+                func(history.id)
+            except BaseException as e:
+                LOG.error('Log callback {} failed: {}'.format(func, e))
+    return error
+
+
+def get_writer_stats():
+    """
+    Get history writer statistics.
+    :return:
+    """
+    return history_writer.get_stats()
+
+
 def _log_ctx_action(ctx, action, func, **kw):
     """
     Log context action.
@@ -190,12 +381,11 @@ def _log_ctx_action(ctx, action, func, **kw):
     try:
         func(ctx, history)
         # Save history log
-        error = md.save_new(history)
+        error = _save_history(ctx, history)
         if error:
             # TODO
             pass
         else:
-            ctx.log_args['log_id'] = history.id
             ctx.log_args['log_status'] = history.status
     except BaseException as e:
         LOG.warning('Exception when saving history: {}'.format(e))
@@ -216,4 +406,4 @@ def clear_old_logs():
 
     log_expiration = app_config['history_log_expiration_days']
     timestamp = date_util.utc_future(days=-log_expiration)
-    md.query(md.History, md.History.create_date < timestamp).delete(synchronize_session=False)
+    retention_util.purge(md.History, md.History.start_date < timestamp, name='history')
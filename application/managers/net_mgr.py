@@ -3,13 +3,15 @@
 #
 
 import ipaddress
+import threading
+import time
 
-from application import app
+from application import app, db
 from application.base import errors
 from application.base.context import create_admin_context
-from application.managers import base as base_mgr, user_mgr
+from application.managers import base as base_mgr, config_mgr, user_mgr
 from application import models as md
-from application.utils import date_util, net_util
+from application.utils import date_util, ip_pool_util, net_util
 
 LOG = app.logger
 
@@ -21,6 +23,13 @@ UPDATE_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
 DELETE_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
 
 IP_ASSIGNING_TIMEOUT = 3600  # seconds
+# In-memory index is rebuilt from DB after this time to catch changes by other processes
+IP_POOL_INDEX_REBUILD_INTERVAL = app.config['NET_IP_POOL_INDEX_REBUILD_INTERVAL']
+
+_ip_pool_index = None
+_ip_pool_index_key = None
+_ip_pool_index_time = 0
+_ip_pool_index_lock = threading.Lock()
 
 
 def get_ip(ctx):
@@ -175,6 +184,7 @@ def create_ip(ctx):
         if error:
             ctx.set_error(errors.NET_IP_CREATE_FAILED, cause=error, status=500)
             return
+        _update_ip_pool_index(ip)
 
         # Return the IP data to user
         ctx.data = {
@@ -230,6 +240,7 @@ def update_ip(ctx):
         if error:
             ctx.set_error(error, status=500)
             return
+        _update_ip_pool_index(ip)
 
         # Return the IP data to user
         ctx.data = {
@@ -275,6 +286,7 @@ def delete_ip(ctx):
         if error:
             ctx.set_error(error, status=500)
             return
+        _update_ip_pool_index(ip)
 
     # Execute the function
     return _delete_ip()
@@ -287,11 +299,7 @@ def get_ip_config(ctx, config_name=None):
     :param config_name:
     :return:
     """
-    ip_config = md.query(md.Configuration,
-                         type=md.ConfigurationType.NETWORK_IP,
-                         **({'name': config_name} if config_name else {}),
-                         status=md.ConfigurationStatus.ENABLED,
-                         order_by=md.Configuration.version.desc()).first()
+    ip_config = config_mgr.get_cached_config(md.ConfigurationType.NETWORK_IP, config_name)
     if not ip_config:
         e = ValueError('Config NETWORK_IP/{} not found in database.'
                        .format(config_name or ''))
@@ -415,37 +423,20 @@ def get_pool_contains_ip(ctx, ip):
     if ctx.failed:
         return
 
-    contents = ip_config.contents
-    ip_ver = contents['version']
-    pools = contents['pools']
-
-    IPNetCls = getattr(ipaddress, 'IPv{}Network'.format(ip_ver))
-    IPAddrCls = getattr(ipaddress, 'IPv{}Address'.format(ip_ver))
+    index = get_ip_pool_index(ctx, ip_config=ip_config)
+    if ctx.failed:
+        return
 
     try:
-        if isinstance(ip, IPAddrCls):
-            ip_obj = ip
-        else:
-            ip_obj = IPAddrCls(ip)
+        pool = index.get_pool(ip)
     except BaseException as e:
         LOG.error(e)
         ctx.set_error(errors.NET_IP_ADDRESS_INVALID, cause=e, status=406)
         return
 
-    try:
-        for pool in pools:
-            cidr_list = pool['cidr']
-            if isinstance(cidr_list, str):
-                cidr_list = [cidr_list]
-
-            for cidr in cidr_list:
-                if ip_obj in IPNetCls(cidr):
-                    ctx.response = pool
-                    return ctx.response
-    except BaseException as e:
-        LOG.error(e)
-        ctx.set_error(errors.NET_IP_POOL_INVALID, cause=e, status=406)
-        return
+    if pool is not None:
+        ctx.response = pool
+        return ctx.response
 
     e = ValueError('IP {} is out of pools config.'.format(ip))
     LOG.error(e)
@@ -515,23 +506,24 @@ def find_unused_ip(ctx, max_count=5):
         }
         return ctx.response
 
-    # Query the last created IP, so we can guess next available ones
-    item = md.query(md.PublicIP,
-                    order_by=md.PublicIP.create_date.desc()).first()
-    start_ip = ipaddress.ip_address(item.addr) + 1 if item else None
-
-    test_ips = []
-    for ctx, ip, net, pool in iterate_pool_ips(ctx, start_ip=start_ip):
-        if ctx.failed:
-            return
-        if not _add_ip(test_ips, str(ip)):
-            avail_ips = filter_unused_ips(test_ips)
-            test_ips = []
-            if avail_ips:
-                break
+    # Find never used IPs in the pool index
+    index = get_ip_pool_index(ctx, ip_config=ip_config)
+    if ctx.failed:
+        return
 
-    if test_ips:
+    # IPs are verified in DB as the index may miss changes by other processes
+    checked_ips = set()
+    while True:
+        test_ips = index.find_free(count=max_count, exclude=checked_ips)
+        if not test_ips:
+            break
+        checked_ips.update(test_ips)
         avail_ips = filter_unused_ips(test_ips)
+        for ip in test_ips:
+            if ip not in avail_ips:
+                index.set_used(ip)
+        if avail_ips:
+            break
 
     if avail_ips:
         ctx.response = {
@@ -543,6 +535,83 @@ def find_unused_ip(ctx, max_count=5):
     return
 
 
+def get_ip_pool_index(ctx, ip_config=None):
+    """
+    Get in-memory index of IP pools with used IPs loaded from DB.
+    The index is rebuilt when IP config changes or after an interval.
+    :param ctx:
+    :param ip_config:
+    :return:
+    """
+    global _ip_pool_index, _ip_pool_index_key, _ip_pool_index_time
+
+    ip_config = ip_config or ctx.data.get('ip_config') or get_ip_config(ctx)
+    if ctx.failed:
+        return
+
+    key = (ip_config.id, ip_config.version)
+    now = time.time()
+    index = _ip_pool_index
+    if (index is not None and key == _ip_pool_index_key and
+            now - _ip_pool_index_time < IP_POOL_INDEX_REBUILD_INTERVAL):
+        return index
+
+    with _ip_pool_index_lock:
+        if (_ip_pool_index is not None and key == _ip_pool_index_key and
+                now - _ip_pool_index_time < IP_POOL_INDEX_REBUILD_INTERVAL):
+            return _ip_pool_index
+        try:
+            index = _build_ip_pool_index(ip_config)
+        except BaseException as e:
+            LOG.error(e)
+            ctx.set_error(errors.NET_IP_POOL_INVALID, cause=e, status=406)
+            return
+        _ip_pool_index = index
+        _ip_pool_index_key = key
+        _ip_pool_index_time = now
+    return index
+
+
+def _build_ip_pool_index(ip_config):
+    """
+    Build IP pool index, load used IPs by one query.
+    :param ip_config:
+    :return:
+    """
+    index = ip_pool_util.IPPoolIndex(ip_config.contents)
+    used_statuses = (md.IPStatus.ASSIGNED, md.IPStatus.ASSIGNING)
+    rows = db.session.query(md.PublicIP.addr).filter(md.PublicIP.status.in_(used_statuses))
+    for addr, in rows:
+        try:
+            index.set_used(addr)
+        except ValueError:
+            LOG.warning('IP {} invalid.'.format(addr))
+
+    # Continue from the last created IP
+    last_ip = md.query(md.PublicIP, order_by=md.PublicIP.create_date.desc()).first()
+    if last_ip:
+        try:
+            index.set_cursor(int(ipaddress.ip_address(last_ip.addr)) + 1)
+        except ValueError:
+            pass
+    return index
+
+
+def _update_ip_pool_index(ip):
+    """
+    Update IP status in the pool index after IP is saved.
+    :param ip:
+    :return:
+    """
+    index = _ip_pool_index
+    if index is None:
+        return
+    try:
+        index.set_used(ip.addr, used=ip.status in (md.IPStatus.ASSIGNED, md.IPStatus.ASSIGNING))
+    except ValueError:
+        pass
+
+
 def filter_unused_ips(ip_list):
     """
     Filter unused IPs from the list.
@@ -4,7 +4,7 @@
 
 from application import app
 from application.base import errors, common
-from application.managers import base as base_mgr, product_mgr, user_mgr
+from application.managers import base as base_mgr, product_mgr, promotion_mgr, user_mgr
 from application import models as md
 from application import payment
 from application import product_types
@@ -839,19 +839,8 @@ def _validate_promotion(ctx, order, group_orders, promotion):
     # Number of promotions for this kind must not exceed the max value
     if max_uses_per_user or max_uses_across_regions:
         # Number of uses in DB
-        promo_count = 0
-        for o in md.iterate(md.Order,
-                            md.Order.status != md.OrderStatus.DELETED,
-                            md.Order.user_id == user.id):
-            if o.promotion_id == promotion.id:
-                promo_count += 1
-                continue
-
-            if max_uses_across_regions and o.promotion_id:
-                o_promo = o.promotion
-                if o_promo.name == promotion.name:
-                    promo_count += 1
-                    continue
+        promo_count = promotion_mgr.count_promotion_uses(user.id, promotion,
+                                                         across_regions=bool(max_uses_across_regions))
 
         # Number of uses in this order group (if there is)
         for o in group_orders:
@@ -875,19 +864,9 @@ def _find_trial_promotion(ctx, order, products):
     :param products:
     :return:
     """
-    promo_list = []
-    prod_types = [prod.type for prod in products]
-    prod_ids = [prod.id for prod in products]
-    for promo in md.iterate(md.Promotion,
-                            type=md.PromotionType.TRIAL,
-                            status=md.PromotionStatus.ENABLED,
-                            region_id=order.region_id,
-                            order_by=md.Promotion.create_date.desc()):
-        if not promo.enabled:
-            continue
-        if not promo.accept_product_type(prod_types) or not promo.accept_product_id(prod_ids):
-            continue
-        promo_list.append(promo)
+    promo_list = promotion_mgr.find_promotions(order.region_id, md.PromotionType.TRIAL,
+                                               product_types=[prod.type for prod in products],
+                                               product_ids=[prod.id for prod in products])
 
     if not promo_list:
         e = ValueError('TRIAL mode not found for order.')
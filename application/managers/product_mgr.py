@@ -2,15 +2,32 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import copy
+import hashlib
+import json
+import threading
+import time
+
 from application import app
 from application.base import errors
 from application.managers import base as base_mgr, user_mgr
 from application import models as md
 from application import product_types
-from application.utils import date_util
+from application.utils import data_util, date_util
 
 LOG = app.logger
 
+# Durations in months precomputed in the price matrix
+PRICE_MATRIX_DURATIONS = app.config['PRICE_MATRIX_DURATIONS']
+# Interval to check if products or promotions in DB have changed
+PRICE_MATRIX_CHECK_INTERVAL = app.config['PRICE_MATRIX_CHECK_INTERVAL']
+# Promotion user settings which do not restrict who can use it (only how many times)
+PUBLIC_PROMOTION_USER_SETTINGS = {'max_uses_per_user', 'max_uses_across_regions'}
+
+# Built price matrix: (signature of products and promotions, check time, matrix)
+_price_matrix = None
+_price_matrix_lock = threading.Lock()
+
 ADMIN_ROLES = (md.UserRole.ADMIN, md.UserRole.ADMIN_SALE, md.UserRole.ADMIN_IT)
 GET_ROLES = ()
 LIST_ROLES = ()
@@ -178,9 +195,18 @@ def get_products_price(ctx):
     amount_actual = None
     duration_actual = None
 
+    # Load all products in one query instead of one query per item
+    product_ids = [int(item['product_id']) for item in products
+                   if not item.get('product') and item.get('product_id')]
+    loaded_products = {}
+    if product_ids:
+        loaded_products = {p.id: p for p in md.query(md.Product, md.Product.id.in_(product_ids))}
+
     for product in products:
         item_ctx = ctx.copy(task='get product price',
                             data=dict(product))
+        if not product.get('product') and product.get('product_id'):
+            item_ctx.data['product'] = loaded_products.get(int(product['product_id']))
         item_ctx.data.update({
             'amount': amount,
             'duration': duration,
@@ -233,3 +259,219 @@ def get_products_price(ctx):
 
     ctx.response = result
     return result
+
+
+def _load_price_matrix_objects():
+    """
+    Load enabled products and promotions, each in one query.
+    :return: (products, promotions, signature of their pricing data)
+    """
+    products = md.query(md.Product, status=md.ProductStatus.ENABLED,
+                        order_by=md.Product.id).all()
+    products = [p for p in products if p.enabled]
+    promotions = md.query(md.Promotion, status=md.PromotionStatus.ENABLED,
+                          order_by=md.Promotion.id).all()
+    promotions = [p for p in promotions if p.enabled]
+
+    state = {
+        'products': [(p.id, p.type, p.name, p.region_id, p.info, p.pricing)
+                     for p in products],
+        'promotions': [(p.id, p.type, p.name, p.region_id, p.target_product_types, p.target_product_ids,
+                        p.product_settings, p.user_settings, p.settings, p.discount_code)
+                       for p in promotions],
+    }
+    signature = hashlib.sha1(json.dumps(state, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    return products, promotions, signature
+
+
+def _is_public_promotion(promotion, product):
+    """
+    Check if a promotion can be shown in the public price matrix for a product.
+    Promotions gated by a discount code, trial promotions, promotions of other regions
+    and promotions scoped to some users are only applied to orders.
+    :param promotion:
+    :param product:
+    :return:
+    """
+    if promotion.type != md.PromotionType.DISCOUNT:
+        return False
+    if promotion.discount_code or (promotion.settings or {}).get('discount_code'):
+        return False
+    if promotion.region_id and promotion.region_id != product.region_id:
+        return False
+    user_settings = promotion.user_settings or {}
+    if set(user_settings) - PUBLIC_PROMOTION_USER_SETTINGS:
+        return False
+    return True
+
+
+def _build_price_matrix(ctx, products, promotions):
+    """
+    Compute prices of all products for all matrix durations and currencies.
+    :param ctx:
+    :param products:
+    :param promotions:
+    :return: list of product prices
+    """
+    currencies = app.config['PAYMENT_CURRENCIES']
+    matrix = []
+
+    for product in products:
+        # Custom hardware is priced from user data, so it can not be precomputed
+        if product.name == 'custom':
+            continue
+
+        type_ctx = ctx.copy(task='get product type', data={})
+        product_type = product_types.get_product_type(type_ctx, product_type=product.type)
+        if type_ctx.failed:
+            continue
+
+        promos = [p for p in promotions
+                  if _is_public_promotion(p, product) and
+                  p.accept_product_type(product.type) and p.accept_product_id(product.id)]
+        info = None
+        prices = []
+
+        for currency in currencies:
+            for months in PRICE_MATRIX_DURATIONS:
+                price_data = {
+                    'product': product,
+                    'amount': 1,
+                    'duration': '{} month'.format(months),
+                    'currency': currency,
+                }
+                item_ctx = ctx.copy(task='get product price', data=dict(price_data))
+                pricing = product_type.do_get_price(item_ctx, product=product)
+                if item_ctx.failed or not pricing:
+                    LOG.debug('Product {}/{} has no price for {} months in {}.'
+                              .format(product.type, product.name, months, currency))
+                    continue
+
+                info = info or pricing.get('info')
+                deals = []
+                for promotion in promos:
+                    promo_ctx = ctx.copy(task='apply promotion', data=dict(price_data))
+                    promo_ctx.data.update({
+                        'pricing': copy.deepcopy(pricing),
+                        'promotion': promotion,
+                    })
+                    deal = product_type.apply_promotion(promo_ctx)
+                    if promo_ctx.failed or not deal:
+                        continue
+                    deals.append(data_util.no_null_kv_dict({
+                        'promotion_id': promotion.id,
+                        'promotion_type': deal.get('promotion_type'),
+                        'price_deal': deal.get('price_deal'),
+                        'price_monthly': deal.get('price_monthly'),
+                        'amount': deal.get('amount'),
+                        'duration': deal.get('duration'),
+                    }))
+
+                prices.append({
+                    'months': months,
+                    'duration': pricing['duration'],
+                    'currency': currency,
+                    'price': pricing['price'],
+                    'price_monthly': pricing.get('price_monthly'),
+                    'promotions': deals,
+                })
+
+        if prices:
+            matrix.append({
+                'id': product.id,
+                'type': product.type,
+                'code': product.code,
+                'name': product.name,
+                'region_id': product.region_id,
+                'info': info,
+                'prices': prices,
+            })
+
+    return matrix
+
+
+def _get_price_matrix(ctx):
+    """
+    Get the built price matrix, rebuild it when products or promotions have changed.
+    :param ctx:
+    :return:
+    """
+    global _price_matrix
+
+    cache = _price_matrix
+    if cache is not None and time.monotonic() - cache[1] < PRICE_MATRIX_CHECK_INTERVAL:
+        return cache[2]
+
+    with _price_matrix_lock:
+        cache = _price_matrix
+        if cache is not None and time.monotonic() - cache[1] < PRICE_MATRIX_CHECK_INTERVAL:
+            return cache[2]
+
+        products, promotions, signature = _load_price_matrix_objects()
+        if cache is not None and cache[0] == signature:
+            matrix = cache[2]
+        else:
+            matrix = _build_price_matrix(ctx, products, promotions)
+            LOG.info('Price matrix built for {} products and {} promotions.'
+                     .format(len(matrix), len(promotions)))
+        _price_matrix = (signature, time.monotonic(), matrix)
+        return matrix
+
+
+def invalidate_price_matrix():
+    """
+    Force checking products and promotions for changes on next access.
+    :return:
+    """
+    global _price_matrix
+
+    with _price_matrix_lock:
+        cache = _price_matrix
+        if cache is not None:
+            _price_matrix = (cache[0], float('-inf'), cache[2])
+
+
+def get_price_matrix(ctx):
+    """
+    Get prices of all enabled products for the common durations.
+    :param ctx: sample ctx data:
+        {
+            'product_ids': <list of product ids to get>,
+            'product_types': <list of product types to get>,
+            'durations': <list of durations in months>,
+            'currency': <str>,
+        }
+    :return:
+    """
+    data = ctx.data
+    product_ids = data.get('product_ids')
+    type_list = data.get('product_types')
+    durations = data.get('durations')
+    currency = data.get('currency')
+
+    if currency and currency.upper() not in app.config['PAYMENT_CURRENCIES']:
+        ctx.set_error(errors.PAYMENT_CURRENCY_NOT_SUPPORTED, status=406)
+        return
+
+    matrix = _get_price_matrix(ctx)
+
+    result = []
+    for item in matrix:
+        if product_ids and item['id'] not in product_ids:
+            continue
+        if type_list and item['type'] not in type_list:
+            continue
+        prices = item['prices']
+        if durations or currency:
+            prices = [x for x in prices
+                      if (not durations or x['months'] in durations) and
+                      (not currency or x['currency'] == currency.upper())]
+            item = dict(item, prices=prices)
+        result.append(item)
+
+    ctx.response = {
+        'durations': [x for x in PRICE_MATRIX_DURATIONS if not durations or x in durations],
+        'currencies': [currency.upper()] if currency else list(app.config['PAYMENT_CURRENCIES']),
+        'products': result,
+    }
+    return ctx.response
@@ -2,13 +2,22 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
-from application import app
+import threading
+import time
+
+from sqlalchemy import func as sa_func
+
+from application import app, db
 from application.base import errors
 from application.managers import base as base_mgr
 from application import models as md
+from application.utils import date_util
 
 LOG = app.logger
 
+# Interval to rebuild the promotion eligibility index from DB
+PROMOTION_INDEX_REBUILD_INTERVAL = app.config['PROMOTION_INDEX_REBUILD_INTERVAL']
+
 ADMIN_ROLES = (md.UserRole.ADMIN, md.UserRole.ADMIN_SALE, md.UserRole.ADMIN_IT)
 GET_ROLES = ()
 LIST_ROLES = ()
@@ -120,3 +129,174 @@ def get_promotions_for_products(ctx):
         'promotions': promotion_data,
     }
     return ctx.response
+
+
+def count_promotion_uses(user_id, promotion, across_regions=False):
+    """
+    Count orders of user using the promotion by a GROUP BY query.
+    :param user_id:
+    :param promotion:
+    :param across_regions: also count promotions of the same name in other regions
+    :return:
+    """
+    qry = db.session.query(md.Order.promotion_id, sa_func.count(md.Order.id)) \
+        .filter(md.Order.status != md.OrderStatus.DELETED,
+                md.Order.user_id == user_id)
+    if across_regions:
+        qry = qry.join(md.Promotion, md.Order.promotion_id == md.Promotion.id) \
+            .filter(md.Promotion.name == promotion.name)
+    else:
+        qry = qry.filter(md.Order.promotion_id == promotion.id)
+
+    return sum(count for _, count in qry.group_by(md.Order.promotion_id).all())
+
+
+class _PromotionBucket(object):
+    """
+    Promotions of a (region, type) with postings by target product type and product id.
+    """
+    __slots__ = ('entries', 'all_ids', 'any_type', 'by_type', 'any_product', 'by_product')
+
+    def __init__(self):
+        self.entries = []  # (id, create_date, start_date, end_date)
+        self.all_ids = set()
+        self.any_type = set()  # promotions accepting all product types
+        self.by_type = {}  # product type -> set of promotion ids
+        self.any_product = set()  # promotions accepting all product ids
+        self.by_product = {}  # product id -> set of promotion ids
+
+    def add(self, promotion):
+        promo_id = promotion.id
+        self.entries.append((promo_id, promotion.create_date,
+                             promotion.start_date, promotion.end_date))
+        self.all_ids.add(promo_id)
+
+        target_types = promotion.target_product_types
+        if target_types is None or 'ALL' in target_types:
+            self.any_type.add(promo_id)
+        else:
+            for product_type in target_types:
+                self.by_type.setdefault(product_type, set()).add(promo_id)
+
+        target_ids = promotion.target_product_ids
+        if target_ids is None or 'ALL' in target_ids:
+            self.any_product.add(promo_id)
+        else:
+            for product_id in target_ids:
+                self.by_product.setdefault(product_id, set()).add(promo_id)
+
+    def finish(self):
+        # Newest promotions first
+        self.entries.sort(key=lambda x: x[1] or date_util.EPOCH, reverse=True)
+
+    @staticmethod
+    def _accepted(values, any_set, posting, all_ids):
+        # Same as Promotion.accept_product_type/accept_product_id: all values must be targeted
+        if not values:
+            return all_ids
+        accepted = None
+        for value in values:
+            ids = posting.get(value) or set()
+            accepted = ids if accepted is None else accepted & ids
+        return any_set | accepted
+
+    def find(self, product_types, product_ids, now):
+        ids = self._accepted(product_types, self.any_type, self.by_type, self.all_ids) & \
+            self._accepted(product_ids, self.any_product, self.by_product, self.all_ids)
+        return [promo_id for promo_id, _, start_date, end_date in self.entries
+                if promo_id in ids and
+                (not start_date or start_date <= now) and
+                (not end_date or now <= end_date)]
+
+
+class PromotionIndex(object):
+    """
+    Index of enabled promotions by (region, type, product type, product id).
+    It is rebuilt from DB after an interval or when invalidated.
+    """
+
+    def __init__(self, rebuild_interval):
+        self.rebuild_interval = rebuild_interval
+        self._buckets = None
+        self._build_time = None
+        self._lock = threading.Lock()
+
+    def _get_buckets(self):
+        buckets = self._buckets
+        if buckets is not None and time.monotonic() - self._build_time < self.rebuild_interval:
+            return buckets
+
+        with self._lock:
+            buckets = self._buckets
+            if buckets is not None and time.monotonic() - self._build_time < self.rebuild_interval:
+                return buckets
+
+            buckets = {}
+            for promotion in md.query(md.Promotion, status=md.PromotionStatus.ENABLED).all():
+                key = (promotion.region_id, promotion.type)
+                bucket = buckets.get(key)
+                if bucket is None:
+                    bucket = buckets[key] = _PromotionBucket()
+                bucket.add(promotion)
+            for bucket in buckets.values():
+                bucket.finish()
+
+            self._buckets = buckets
+            self._build_time = time.monotonic()
+            return buckets
+
+    def find(self, region_id, promotion_type, product_types=None, product_ids=None):
+        """
+        Find ids of enabled promotions accepting all the products, newest first.
+        :param region_id:
+        :param promotion_type:
+        :param product_types: list of product types
+        :param product_ids: list of product ids
+        :return:
+        """
+        bucket = self._get_buckets().get((region_id, promotion_type))
+        if bucket is None:
+            return []
+        return bucket.find(product_types, product_ids, date_util.utc_now())
+
+    def invalidate(self):
+        """
+        Rebuild the index on next access.
+        :return:
+        """
+        with self._lock:
+            self._buckets = None
+
+
+promotion_index = PromotionIndex(rebuild_interval=PROMOTION_INDEX_REBUILD_INTERVAL)
+
+
+def find_promotions(region_id, promotion_type, product_types=None, product_ids=None):
+    """
+    Find enabled promotions accepting the products using the eligibility index.
+    :param region_id:
+    :param promotion_type:
+    :param product_types:
+    :param product_ids:
+    :return: list of promotion objects, newest first
+    """
+    result = []
+    for promo_id in promotion_index.find(region_id, promotion_type,
+                                         product_types=product_types,
+                                         product_ids=product_ids):
+        promotion = md.load_promotion(promo_id)
+        # The index may be stale, check again with the loaded promotion
+        if (promotion and promotion.enabled and
+                promotion.region_id == region_id and promotion.type == promotion_type and
+                promotion.accept_product_type(product_types) and
+                promotion.accept_product_id(product_ids)):
+            result.append(promotion)
+    return result
+
+
+def invalidate_promotion_index():
+    """
+    Rebuild the promotion index on next access, e.g. after promotions are changed by admin.
+    :return:
+    """
+    promotion_index.invalidate()
@@ -0,0 +1,390 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from concurrent import futures
+import datetime
+import json
+import threading
+import time
+
+from sqlalchemy import MetaData, and_, create_engine, func, select, types as sa_types
+from sqlalchemy import exc as sa_exc
+
+from application import app, db
+from application import models as md
+from application.managers import task_mgr
+
+LOG = app.logger
+
+QUEUE_BACKEND = app.config['TASK_QUEUE_BACKEND']
+QUEUE_SQLITE_PATH = app.config['TASK_QUEUE_SQLITE_PATH']
+VISIBILITY_TIMEOUT = app.config['TASK_QUEUE_VISIBILITY_TIMEOUT']
+MAX_ATTEMPTS = app.config['TASK_QUEUE_MAX_ATTEMPTS']
+RETRY_BACKOFF = app.config['TASK_QUEUE_RETRY_BACKOFF']
+RETRY_BACKOFF_MAX = app.config['TASK_QUEUE_RETRY_BACKOFF_MAX']
+START_DELAY = app.config['TASK_QUEUE_START_DELAY']
+POLL_INTERVAL = app.config['TASK_QUEUE_POLL_INTERVAL']
+WORKER_THREADS = app.config['TASK_QUEUE_WORKER_THREADS']
+KEEP_DAYS = app.config['TASK_QUEUE_KEEP_DAYS']
+
+DEFAULT_QUEUE = 'default'
+# Interval of deleting finished tasks older than TASK_QUEUE_KEEP_DAYS by workers (seconds)
+PURGE_INTERVAL = 3600
+
+# Task handlers by name, a handler is called with a QueuedTask
+_handlers = {}
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def _utc_now():
+    return datetime.datetime.utcnow()
+
+
+def _get_store():
+    """
+    Get (engine, table) of the queue backend, create it on first use.
+    :return:
+    """
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                if QUEUE_BACKEND == 'db':
+                    _store = db.engine, md.QueueTask.__table__
+                elif QUEUE_BACKEND == 'sqlite':
+                    engine = create_engine('sqlite:///' + QUEUE_SQLITE_PATH, connect_args={'timeout': 30})
+                    table = md.QueueTask.__table__.tometadata(MetaData())
+                    for column in table.c:
+                        # e.g. JSONB of PostgreSQL
+                        if isinstance(column.type, sa_types.JSON):
+                            column.type = sa_types.JSON()
+                    table.create(engine, checkfirst=True)
+                    _store = engine, table
+                else:
+                    raise ValueError('Task queue backend "{}" not supported.'.format(QUEUE_BACKEND))
+    return _store
+
+
+def _to_json(value):
+    # Values stored in JSON columns must round trip, e.g. errors are stored as strings
+    return json.loads(json.dumps(value, default=str))
+
+
+def register_handler(name, handler):
+    """
+    Register handler of tasks. Handlers are registered on import, so workers must import
+    modules of their handlers before running.
+    :param name:
+    :param handler: function(task), task is retried if it raises an exception
+    :return:
+    """
+    _handlers[name] = handler
+
+
+def enqueue(name, data, queue=DEFAULT_QUEUE, max_attempts=None, delay=None):
+    """
+    Add a task to queue. The task is saved before returning, so it is not lost
+    if this process exits.
+    :param name: handler name
+    :param data: JSON serializable task data
+    :param queue:
+    :param max_attempts:
+    :param delay: seconds before the task can be run, default is TASK_QUEUE_START_DELAY
+    :return: task id
+    """
+    engine, table = _get_store()
+    now = _utc_now()
+    delay = START_DELAY if delay is None else delay
+    with engine.begin() as conn:
+        result = conn.execute(table.insert().values(
+            queue=queue, name=name, status=md.QueueTaskStatus.PENDING, attempts=0,
+            max_attempts=max_attempts or MAX_ATTEMPTS, create_date=now,
+            available_date=now + datetime.timedelta(seconds=delay), data=data))
+        return result.inserted_primary_key[0]
+
+
+def update_pending_task_data(task_id, func):
+    """
+    Update data of a task not started yet.
+    :param task_id:
+    :param func: function(data) returns the new data
+    :return: True if updated, False if the task was started
+    """
+    engine, table = _get_store()
+    with engine.begin() as conn:
+        row = conn.execute(select([table.c.data, table.c.attempts]).where(and_(
+            table.c.id == task_id,
+            table.c.status == md.QueueTaskStatus.PENDING))).first()
+        if row is None or row.attempts:
+            return False
+        # Compare-and-set, the task may be claimed meanwhile
+        result = conn.execute(table.update().where(and_(
+            table.c.id == task_id,
+            table.c.status == md.QueueTaskStatus.PENDING,
+            table.c.attempts == 0)).values(data=func(row.data)))
+        return result.rowcount == 1
+
+
+class QueuedTask(object):
+    """
+    Task delivered to a worker.
+    """
+
+    def __init__(self, row, runner):
+        self.id = row.id
+        self.queue = row.queue
+        self.name = row.name
+        self.data = row.data
+        self.result = row.result
+        self.attempts = row.attempts
+        self.max_attempts = row.max_attempts
+        self.runner = runner
+
+    @property
+    def last_attempt(self):
+        return self.attempts >= self.max_attempts
+
+    @property
+    def exhausted(self):
+        # Workers died in all attempts
+        return self.attempts > self.max_attempts
+
+    def save_result(self, result):
+        """
+        Save result of the task work, so a redelivered task can skip the work and
+        only finish it (e.g. call result callbacks).
+        :param result: JSON serializable result
+        :return:
+        """
+        self.result = _to_json(result)
+        _update_own_task(self, result=self.result)
+
+
+def _update_own_task(task, **values):
+    """
+    Update a task still owned by the runner, it may be taken over after visibility timeout.
+    :param task:
+    :param values:
+    :return: True if updated
+    """
+    engine, table = _get_store()
+    with engine.begin() as conn:
+        result = conn.execute(table.update().where(and_(
+            table.c.id == task.id,
+            table.c.status == md.QueueTaskStatus.RUNNING,
+            table.c.runner == task.runner)).values(**values))
+        return result.rowcount == 1
+
+
+def claim(count, runner, queues=(DEFAULT_QUEUE,)):
+    """
+    Claim available tasks: pending tasks and running tasks whose visibility timed out.
+    Each task is claimed by a compare-and-set update, so it goes to one runner only.
+    :param count: max number of tasks
+    :param runner: runner id
+    :param queues:
+    :return: list of QueuedTask
+    """
+    engine, table = _get_store()
+    now = _utc_now()
+    with engine.connect() as conn:
+        rows = conn.execute(
+            select([table.c.id, table.c.status, table.c.available_date])
+            .where(and_(table.c.queue.in_(queues),
+                        table.c.status.in_((md.QueueTaskStatus.PENDING, md.QueueTaskStatus.RUNNING)),
+                        table.c.available_date <= now))
+            .order_by(table.c.available_date)
+            .limit(count * 2)).fetchall()
+
+    tasks = []
+    for row in rows:
+        if len(tasks) >= count:
+            break
+        with engine.begin() as conn:
+            result = conn.execute(table.update().where(and_(
+                table.c.id == row.id,
+                table.c.status == row.status,
+                table.c.available_date == row.available_date)).values(
+                status=md.QueueTaskStatus.RUNNING,
+                attempts=table.c.attempts + 1,
+                available_date=now + datetime.timedelta(seconds=VISIBILITY_TIMEOUT),
+                start_date=now,
+                runner=runner))
+            if result.rowcount != 1:
+                continue  # Claimed by another runner
+            task_row = conn.execute(table.select().where(table.c.id == row.id)).first()
+        if row.status == md.QueueTaskStatus.RUNNING:
+            LOG.warning('Task {} {} timed out in its last runner, delivered again.'.format(
+                task_row.id, task_row.name))
+        tasks.append(QueuedTask(task_row, runner=runner))
+    return tasks
+
+
+def renew(tasks):
+    """
+    Extend visibility timeout of running tasks.
+    :param tasks:
+    :return:
+    """
+    available_date = _utc_now() + datetime.timedelta(seconds=VISIBILITY_TIMEOUT)
+    for task in tasks:
+        try:
+            if not _update_own_task(task, available_date=available_date):
+                LOG.warning('Task {} {} was taken over by another runner.'.format(task.id, task.name))
+        except sa_exc.SQLAlchemyError as e:
+            LOG.error('Unable to renew task {}: {}'.format(task.id, e))
+
+
+def complete(task):
+    """
+    Mark a task succeeded.
+    :param task:
+    :return:
+    """
+    _update_own_task(task, status=md.QueueTaskStatus.SUCCEEDED, end_date=_utc_now(), error=None)
+
+
+def fail(task, error):
+    """
+    Retry a failed task with exponential backoff, or mark it failed after its last attempt.
+    :param task:
+    :param error:
+    :return:
+    """
+    error = str(error)[:2048]
+    if task.last_attempt:
+        LOG.error('Task {} {} failed after {} attempts: {}'.format(task.id, task.name, task.attempts, error))
+        _update_own_task(task, status=md.QueueTaskStatus.FAILED, end_date=_utc_now(), error=error)
+        return
+    delay = min(RETRY_BACKOFF * 2 ** (task.attempts - 1), RETRY_BACKOFF_MAX)
+    LOG.warning('Task {} {} failed in attempt {}, retry in {}s: {}'.format(
+        task.id, task.name, task.attempts, delay, error))
+    _update_own_task(task, status=md.QueueTaskStatus.PENDING, error=error,
+                     available_date=_utc_now() + datetime.timedelta(seconds=delay))
+
+
+def run_task(task):
+    """
+    Run a task by its handler, then mark it succeeded or failed.
+    :param task:
+    :return:
+    """
+    handler = _handlers.get(task.name)
+    try:
+        if handler is None:
+            raise ValueError('Task handler "{}" not found.'.format(task.name))
+        with app.app_context():
+            try:
+                handler(task)
+            finally:
+                db.session.remove()
+    except BaseException as e:
+        LOG.exception('Task {} {} failed.'.format(task.id, task.name))
+        fail(task, e)
+        return
+    complete(task)
+
+
+def purge(days=KEEP_DAYS):
+    """
+    Delete finished tasks older than days.
+    :param days:
+    :return: number of deleted tasks
+    """
+    engine, table = _get_store()
+    before = _utc_now() - datetime.timedelta(days=days)
+    with engine.begin() as conn:
+        result = conn.execute(table.delete().where(and_(
+            table.c.status.in_((md.QueueTaskStatus.SUCCEEDED, md.QueueTaskStatus.FAILED)),
+            table.c.end_date < before)))
+        return result.rowcount
+
+
+class Worker(object):
+    """
+    Worker running tasks of queues by a thread pool.
+    Run workers in separate processes (see queue_worker.py), add processes to scale.
+    """
+
+    def __init__(self, queues=(DEFAULT_QUEUE,), threads=None, poll_interval=None):
+        self.queues = tuple(queues)
+        self.threads = threads or WORKER_THREADS
+        self.poll_interval = poll_interval or POLL_INTERVAL
+        self.runner = task_mgr.get_runner_id()
+        self._running = {}
+        self._lock = threading.Lock()
+        self._stop_event = threading.Event()
+
+    def stop(self):
+        self._stop_event.set()
+
+    def _run(self, task):
+        try:
+            run_task(task)
+        finally:
+            with self._lock:
+                self._running.pop(task.id, None)
+
+    def _renew_loop(self):
+        while not self._stop_event.wait(VISIBILITY_TIMEOUT / 3):
+            with self._lock:
+                tasks = list(self._running.values())
+            if tasks:
+                renew(tasks)
+
+    def run(self):
+        """
+        Run until stop() is called, running tasks are finished before returning.
+        :return:
+        """
+        LOG.info('Task queue worker {} started, queues {}, {} threads.'.format(
+            self.runner, ','.join(self.queues), self.threads))
+        renew_thread = threading.Thread(target=self._renew_loop, name='task-queue-renew', daemon=True)
+        renew_thread.start()
+        last_purge = 0
+        with futures.ThreadPoolExecutor(max_workers=self.threads, thread_name_prefix='task-queue') as executor:
+            while not self._stop_event.is_set():
+                if time.monotonic() - last_purge >= PURGE_INTERVAL:
+                    last_purge = time.monotonic()
+                    try:
+                        purge()
+                    except sa_exc.SQLAlchemyError as e:
+                        LOG.error('Unable to purge old tasks: {}'.format(e))
+
+                with self._lock:
+                    free = self.threads - len(self._running)
+                tasks = []
+                if free > 0:
+                    try:
+                        tasks = claim(free, runner=self.runner, queues=self.queues)
+                    except sa_exc.SQLAlchemyError as e:
+                        LOG.error('Unable to claim tasks: {}'.format(e))
+                for task in tasks:
+                    with self._lock:
+                        self._running[task.id] = task
+                    executor.submit(self._run, task)
+                if not tasks:
+                    self._stop_event.wait(self.poll_interval)
+        LOG.info('Task queue worker {} stopped.'.format(self.runner))
+
+
+def get_stats():
+    """
+    Get number of tasks by queue and status.
+    :return:
+    """
+    engine, table = _get_store()
+    stats = {'backend': QUEUE_BACKEND, 'queues': {}}
+    try:
+        with engine.connect() as conn:
+            rows = conn.execute(select([table.c.queue, table.c.status, func.count(table.c.id)])
+                                .group_by(table.c.queue, table.c.status)).fetchall()
+    except sa_exc.SQLAlchemyError as e:
+        stats['error'] = str(e)
+        return stats
+    for queue, status, count in rows:
+        stats['queues'].setdefault(queue, {})[status] = count
+    return stats
@@ -9,7 +9,7 @@ from application.base import common, errors
 from application.base.context import create_admin_context
 from application.managers import base as base_mgr, config_mgr, task_mgr, user_mgr
 from application import models as md
-from application.utils import date_util
+from application.utils import date_util, retention_util
 
 LOG = app.logger
 
@@ -103,4 +103,4 @@ def clear_old_reports():
 
     expiration = app_config['report_expiration_days']
     timestamp = date_util.utc_future(days=-expiration)
-    md.query(md.Report, md.Report.start_date < timestamp).delete(synchronize_session=False)
+    retention_util.purge(md.Report, md.Report.start_date < timestamp, name='report')
@@ -4,12 +4,14 @@
 
 from functools import wraps
 
+from sqlalchemy import exists
+
 from application import app
 from application.base import errors
 from application.base.context import create_admin_context
 from application.managers import base as base_mgr, config_mgr, task_mgr, user_mgr
 from application import models as md
-from application.utils import date_util
+from application.utils import date_util, retention_util
 
 LOG = app.logger
 
@@ -200,5 +202,9 @@ def clear_old_supports():
     timestamp = date_util.utc_future(days=-expiration)
 
     # TODO: only clear CLOSED/COMPLETED supports
-    md.query(md.Support, md.Support.create_date < timestamp).delete(synchronize_session=False)
-    md.query(md.Ticket, md.Ticket.create_date < timestamp).delete(synchronize_session=False)
+    retention_util.purge(md.Support, md.Support.create_date < timestamp, name='support')
+    # Keep tickets still referenced by newer supports
+    retention_util.purge(md.Ticket, md.Ticket.create_date < timestamp,
+                         ~exists().where(md.Support.ticket_id == md.Ticket.id)
+                         .correlate(md.Ticket.__table__),
+                         name='ticket')
@@ -2,12 +2,22 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import atexit
+import datetime
 from functools import wraps
+import os
+import socket
+import threading
+import time
 
-from application import app, apscheduler
+from apscheduler import events as sched_events
+from sqlalchemy import and_, exc as sa_exc, func as sa_func, select
+
+from application import app, apscheduler, db
 from application.base import errors
 from application.managers import base as base_mgr, user_mgr
 from application import models as md
+from application.utils import date_util
 
 LOG = app.logger
 
@@ -18,6 +28,20 @@ CREATE_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
 UPDATE_ROLES = (md.UserRole.ADMIN,)
 DELETE_ROLES = (md.UserRole.ADMIN,)
 
+SCHEDULER_MODE = app.config['SCHEDULER_MODE']
+SCHEDULER_LEASE_BACKEND = app.config['SCHEDULER_LEASE_BACKEND']
+SCHEDULER_LEASE_TTL = app.config['SCHEDULER_LEASE_TTL']
+SCHEDULER_LEASE_RENEW_INTERVAL = app.config['SCHEDULER_LEASE_RENEW_INTERVAL']
+SCHEDULER_MISFIRE_GRACE_TIME = app.config['SCHEDULER_MISFIRE_GRACE_TIME']
+
+LEASE_ID = 'scheduler_leader'
+
+# Jobs registered via schedule()/add_job(): job id -> function
+_jobs = {}
+# Jobs skipped because this process was not the leader: job id -> scheduled date
+_skipped_runs = {}
+_jobs_lock = threading.Lock()
+
 
 def get_scheduler():
     """
@@ -27,24 +51,365 @@ def get_scheduler():
     return apscheduler
 
 
+def get_runner_id():
+    """
+    Get ID of this process, used to tell who runs jobs.
+    :return:
+    """
+    return '{}:{}'.format(socket.gethostname(), os.getpid())
+
+
+class DBLease(object):
+    """
+    Scheduler lease stored as a row in `lock` table.
+    The lock timestamp is used as a version, so renewing or taking over an
+    expired lease are atomic compare-and-set updates.
+    """
+
+    def __init__(self, ttl):
+        self.ttl = ttl
+        self.timestamp = None
+        self.valid_until = 0
+
+    def is_held(self):
+        return self.timestamp is not None and time.monotonic() < self.valid_until
+
+    def acquire(self):
+        """
+        Acquire or renew the lease.
+        :return: True if this process holds the lease.
+        """
+        table = md.Lock.__table__
+        # Second precision to be comparable with DB DateTime value
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        started = time.monotonic()
+        try:
+            with db.engine.begin() as conn:
+                if self.timestamp is not None:
+                    result = conn.execute(table.update()
+                                          .where(and_(table.c.id == LEASE_ID,
+                                                      table.c.timestamp == self.timestamp))
+                                          .values(timestamp=now))
+                    if result.rowcount != 1:
+                        LOG.warning('Scheduler lease lost by {}.'.format(get_runner_id()))
+                        self.timestamp = None
+                        return False
+                else:
+                    row = conn.execute(select([table.c.timestamp])
+                                       .where(table.c.id == LEASE_ID)).first()
+                    if row is None:
+                        conn.execute(table.insert().values(id=LEASE_ID, timestamp=now))
+                    elif row[0] is None or row[0] + datetime.timedelta(seconds=self.ttl) < now:
+                        # Lease expired, take it over
+                        result = conn.execute(table.update()
+                                              .where(and_(table.c.id == LEASE_ID,
+                                                          table.c.timestamp == row[0]))
+                                              .values(timestamp=now))
+                        if result.rowcount != 1:
+                            return False
+                    else:
+                        return False
+        except sa_exc.SQLAlchemyError as e:
+            # Another process inserted the lease first, or DB is unavailable.
+            # Keep the current lease until it expires locally.
+            LOG.debug('Scheduler lease acquire failed: {}'.format(e))
+            return self.is_held()
+
+        self.timestamp = now
+        # Consider the lease lost a renew interval before others can take it over
+        self.valid_until = started + self.ttl - SCHEDULER_LEASE_RENEW_INTERVAL
+        return True
+
+    def release(self):
+        if self.timestamp is None:
+            return
+        table = md.Lock.__table__
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.delete().where(and_(table.c.id == LEASE_ID,
+                                                       table.c.timestamp == self.timestamp)))
+        except sa_exc.SQLAlchemyError as e:
+            LOG.warning('Scheduler lease release failed: {}'.format(e))
+        self.timestamp = None
+
+
+class FileLease(object):
+    """
+    Scheduler lease as an exclusive lock of a local file, held until the process exits.
+    Only works when all processes run on the same host.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.file = None
+
+    def is_held(self):
+        return self.file is not None
+
+    def acquire(self):
+        if self.file is not None:
+            return True
+        import fcntl
+        f = open(self.path, 'a+')
+        try:
+            fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            f.close()
+            return False
+        f.seek(0)
+        f.truncate()
+        f.write(get_runner_id())
+        f.flush()
+        self.file = f
+        return True
+
+    def release(self):
+        if self.file is None:
+            return
+        import fcntl
+        fcntl.flock(self.file, fcntl.LOCK_UN)
+        self.file.close()
+        self.file = None
+
+
+if SCHEDULER_LEASE_BACKEND == 'file':
+    _lease = FileLease(app.config['SCHEDULER_LEASE_FILE'])
+else:
+    _lease = DBLease(ttl=SCHEDULER_LEASE_TTL)
+
+
+def is_scheduler_leader():
+    """
+    Check if this process should run scheduled jobs.
+    :return:
+    """
+    if SCHEDULER_MODE == 'all':
+        return True
+    if SCHEDULER_MODE == 'leader':
+        return _lease.is_held()
+    return False
+
+
+def renew_scheduler_lease():
+    """
+    Acquire or renew the scheduler lease periodically.
+    When this process becomes the leader, jobs missed during failover are run.
+    :return:
+    """
+    was_leader = _lease.is_held()
+    try:
+        is_leader = _lease.acquire()
+    finally:
+        db.session.remove()
+    if is_leader and not was_leader:
+        LOG.info('Scheduler lease acquired by {}.'.format(get_runner_id()))
+        _run_skipped_jobs()
+
+
 def schedule(trigger, **kwargs):
     """
     Schedule a background task.
     Usage:
 
-    @schedule('cron', hour=1, minute=1)
+    @schedule('cron', id='my_mgr.do_something', hour=1, minute=1)
     def do_something():
         <do something>
 
     :param trigger: 'cron', 'interval', ...
-    :param kwargs:
+    :param kwargs: 'id' is required, it identifies the job in leader lease and `job_run` records
     :return:
     """
     def wrapper(target_func):
-        apscheduler.add_job(target_func, trigger=trigger, **kwargs)
+        add_job(target_func, trigger=trigger, **kwargs)
+        return target_func
     return wrapper
 
 
+def add_job(func, trigger, id, **kwargs):
+    """
+    Add a job to scheduler.
+    Job is only run by the scheduler leader and its runs are recorded in `job_run` table.
+    :param func:
+    :param trigger:
+    :param id: job id
+    :param kwargs:
+    :return:
+    """
+    with _jobs_lock:
+        _jobs[id] = func
+
+    @wraps(func)
+    def _job_func():
+        _run_job(id, func)
+
+    return apscheduler.add_job(_job_func, trigger=trigger, id=id, **kwargs)
+
+
+def _run_job(job_id, func, scheduled_date=None):
+    """
+    Run a scheduled job if this process is the leader.
+    :param job_id:
+    :param func:
+    :param scheduled_date: scheduled time of a missed run
+    :return:
+    """
+    # Jobs are scheduled at minute precision, so all processes get the same value
+    scheduled_date = scheduled_date or datetime.datetime.utcnow().replace(second=0, microsecond=0)
+
+    if SCHEDULER_MODE == 'leader' and not _lease.is_held():
+        # Leader may be dead, try taking over the lease
+        renew_scheduler_lease()
+    if not is_scheduler_leader():
+        LOG.debug('Job {} skipped, not the scheduler leader.'.format(job_id))
+        with _jobs_lock:
+            _skipped_runs[job_id] = scheduled_date
+        return
+
+    run_id = _start_job_run(job_id, scheduled_date)
+    if run_id is None:
+        return
+
+    error = None
+    try:
+        func()
+    except BaseException as e:
+        LOG.exception('Job {} failed.'.format(job_id))
+        error = e
+    finally:
+        db.session.remove()
+    _finish_job_run(run_id, error=error)
+
+
+def _start_job_run(job_id, scheduled_date):
+    """
+    Record start of a job run.
+    :param job_id:
+    :param scheduled_date:
+    :return: run id, None if the job was already run for the scheduled time.
+    """
+    table = md.JobRun.__table__
+    try:
+        with db.engine.begin() as conn:
+            if SCHEDULER_MODE == 'leader':
+                # The previous leader may have run it before failover
+                done = conn.execute(select([table.c.id])
+                                    .where(and_(table.c.job_id == job_id,
+                                                table.c.scheduled_date == scheduled_date,
+                                                table.c.status != md.JobRunStatus.MISSED))).first()
+                if done:
+                    return None
+            result = conn.execute(table.insert().values(
+                job_id=job_id, status=md.JobRunStatus.RUNNING, scheduled_date=scheduled_date,
+                start_date=date_util.utc_now(), runner=get_runner_id()))
+            return result.inserted_primary_key[0]
+    except sa_exc.SQLAlchemyError as e:
+        # History is not critical, still run the job
+        LOG.error('Unable to record run of job {}: {}'.format(job_id, e))
+        return 0
+
+
+def _finish_job_run(run_id, error=None):
+    """
+    Record result of a job run.
+    :param run_id:
+    :param error:
+    :return:
+    """
+    if not run_id:
+        return
+    table = md.JobRun.__table__
+    values = {
+        'status': md.JobRunStatus.FAILED if error else md.JobRunStatus.SUCCEEDED,
+        'end_date': date_util.utc_now(),
+    }
+    if error:
+        values['error'] = str(error)[:2048]
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.update().where(table.c.id == run_id).values(**values))
+    except sa_exc.SQLAlchemyError as e:
+        LOG.error('Unable to record result of job run {}: {}'.format(run_id, e))
+
+
+def _run_skipped_jobs():
+    """
+    Run jobs which were skipped while this process was not the leader
+    and the previous leader did not run them (e.g. it was dead).
+    :return:
+    """
+    now = datetime.datetime.utcnow()
+    with _jobs_lock:
+        skipped = list(_skipped_runs.items())
+        _skipped_runs.clear()
+
+    for job_id, scheduled_date in skipped:
+        if (now - scheduled_date).total_seconds() > SCHEDULER_MISFIRE_GRACE_TIME:
+            continue
+        func = _jobs.get(job_id)
+        if func is None:
+            continue
+        LOG.info('Run missed job {} scheduled at {}.'.format(job_id, scheduled_date))
+        apscheduler.add_job(_run_job, trigger='date', args=(job_id, func, scheduled_date),
+                            id=job_id + '.missed', replace_existing=True)
+
+
+def _on_job_missed(event):
+    """
+    Record runs missed by scheduler (e.g. process was busy or down too long).
+    :param event:
+    :return:
+    """
+    if event.job_id not in _jobs or not is_scheduler_leader():
+        return
+    scheduled_date = event.scheduled_run_time
+    if scheduled_date.tzinfo is not None:
+        scheduled_date = scheduled_date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    table = md.JobRun.__table__
+    try:
+        with db.engine.begin() as conn:
+            conn.execute(table.insert().values(
+                job_id=event.job_id, status=md.JobRunStatus.MISSED, scheduled_date=scheduled_date,
+                start_date=date_util.utc_now(), runner=get_runner_id()))
+    except sa_exc.SQLAlchemyError as e:
+        LOG.error('Unable to record missed run of job {}: {}'.format(event.job_id, e))
+
+
+def get_scheduled_jobs(ctx):
+    """
+    Get scheduled jobs with next run time and the last run.
+    :param ctx:
+    :return:
+    """
+    if not user_mgr.check_user(ctx, roles=ADMIN_ROLES):
+        return
+
+    table = md.JobRun.__table__
+    last_ids = select([sa_func.max(table.c.id)]).group_by(table.c.job_id)
+    last_runs = md.query(md.JobRun, md.JobRun.id.in_(last_ids)).all()
+    last_runs = {run.job_id: run.to_dict() for run in last_runs}
+
+    jobs = []
+    for job in apscheduler.get_jobs():
+        jobs.append({
+            'id': job.id,
+            'name': job.name,
+            'trigger': str(job.trigger),
+            'next_run_time': job.next_run_time,
+            'last_run': last_runs.get(job.id),
+        })
+
+    ctx.response = {
+        'scheduler': {
+            'mode': SCHEDULER_MODE,
+            'lease_backend': SCHEDULER_LEASE_BACKEND,
+            'runner': get_runner_id(),
+            'is_leader': is_scheduler_leader(),
+        },
+        'data': jobs,
+    }
+    return jobs
+
+
 def get_task(ctx):
     """
     Get task.
@@ -124,3 +489,24 @@ def delete_task(ctx):
     :return:
     """
     ctx.set_error('Not Implemented Yet', status=500)
+
+
+@schedule(id='task_mgr.clear_old_job_runs', **app.config['JOB_CLEAR_OLD_JOB_RUNS'])
+def clear_old_job_runs():
+    """
+    Clear old job run records in DB.
+    :return:
+    """
+    table = md.JobRun.__table__
+    keep_days = app.config['SCHEDULER_JOB_RUNS_KEEP_DAYS']
+    with db.engine.begin() as conn:
+        conn.execute(table.delete().where(
+            table.c.start_date < date_util.datetime_add(date_util.utc_now(), days=-keep_days)))
+
+
+if SCHEDULER_MODE == 'leader':
+    apscheduler.add_job(renew_scheduler_lease, trigger='interval', id='task_mgr.renew_scheduler_lease',
+                        seconds=SCHEDULER_LEASE_RENEW_INTERVAL, next_run_time=datetime.datetime.utcnow(),
+                        timezone='UTC')
+    atexit.register(_lease.release)
+apscheduler.add_listener(_on_job_missed, sched_events.EVENT_JOB_MISSED)
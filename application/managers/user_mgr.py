@@ -29,11 +29,8 @@ def get_ldap_config(ctx):
     :param ctx:
     :return:
     """
-    ldap_config = md.query(md.Configuration,
-                           type=md.ConfigurationType.BACKEND,
-                           name='ldap_config',
-                           status=md.ConfigurationStatus.ENABLED,
-                           order_by=md.Configuration.version.desc()).first()
+    from application.managers import config_mgr  # config_mgr imports user_mgr
+    ldap_config = config_mgr.get_cached_config(md.ConfigurationType.BACKEND, 'ldap_config')
     if not ldap_config:
         e = ValueError('Config BACKEND/ldap_config not found in database.')
         LOG.error(e)
@@ -437,6 +434,7 @@ def update_user(ctx):
         ctx.set_error(error, status=500)
         return
 
+    md.User.invalidate_token_cache(user.id)
     return user
 
 
@@ -467,6 +465,8 @@ def delete_user(ctx):
         ctx.set_error(error, status=500)
         return
 
+    md.User.invalidate_token_cache(user.id)
+
 
 def login(ctx):
     """
@@ -3,13 +3,14 @@
 #
 
 from sqlalchemy import or_
+from sqlalchemy.orm import joinedload, selectinload
 from sqlalchemy.orm.attributes import flag_modified, flag_dirty
 
 from application import app, db
-from application.base.context import current_context
+from application.base.context import current_context, load_request_user
 from application.base import common, objects
 from application.models import base, types as mdtypes
-from application.utils import data_util, date_util, locale_util, str_util
+from application.utils import cache_util, data_util, date_util, hash_util, locale_util, str_util
 
 LOG = app.logger
 
@@ -136,6 +137,42 @@ class ModelMixin(object):
         query = query.join(join_class, condition)
         return query
 
+    @classmethod
+    def get_prefetch_options(cls, fields):
+        """
+        Get loader options to prefetch relationships for the fields in bulk.
+        Prefetch fields are declared in __prefetch_fields__ of model classes as
+        {<field>: <relationship path>}, e.g. {'order_products': 'order.order_product'}.
+        Many-to-one relationships are joined, one-to-many relationships are loaded
+        by a separate "SELECT ... IN" query for all objects of the page.
+        :param fields: fields and extra fields to be dumped.
+        :return: list of options for query.options()
+        """
+        prefetch_fields = getattr(cls, '__prefetch_fields__', None)
+        if not prefetch_fields or not fields:
+            return []
+
+        options = []
+        paths = set()
+        for field in fields:
+            path = prefetch_fields.get(field)
+            if not path or path in paths:
+                continue
+            paths.add(path)
+
+            option = None
+            mapper = cls.__mapper__
+            for rel_name in path.split('.'):
+                rel = mapper.relationships[rel_name]
+                attr = getattr(mapper.class_, rel_name)
+                if option is None:
+                    option = selectinload(attr) if rel.uselist else joinedload(attr)
+                else:
+                    option = option.selectinload(attr) if rel.uselist else option.joinedload(attr)
+                mapper = rel.mapper
+            options.append(option)
+        return options
+
 
 # class Session(db.Model):
 #     __tablename__ = 'session'
@@ -207,6 +244,11 @@ class History(db.Model, ModelMixin):
     __user_fields__ = ('id', 'type', 'action', 'target_user_id', 'request_user_id', 'task_id',
                        'status', 'start_date', 'end_date', 'contents', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'target_user': 'target_user',
+        'request_user': 'request_user',
+        'task': 'task',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -251,6 +293,9 @@ class OrderGroup(db.Model, ModelMixin):
     __user_fields__ = ('id', 'type', 'code', 'user_id', 'create_date', 'status',
                        'data', 'notes', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -282,6 +327,13 @@ class Order(db.Model, ModelMixin):
                        'end_date', 'promotion_id', 'discount_code', 'payment_type', 'currency', 'region_id',
                        'data', 'notes', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+        'order_group': 'order_group',
+        'promotion': 'promotion',
+        'region': 'region',
+        'order_products': 'order_product',
+    }
 
     # Fields may be stored in attribute self.data
     __data_fields__ = ('info', 'settings')
@@ -320,8 +372,8 @@ class Order(db.Model, ModelMixin):
 
     @property
     def order_products(self):
-        # Should we use md.iterate(condition) instead?
-        return OrderProduct.query.filter(OrderProduct.order_id == self.id).all()
+        # Use the backref relationship so it can be prefetched in bulk
+        return list(self.order_product)
 
     @property
     def utilization(self):
@@ -342,6 +394,11 @@ class OrderProduct(db.Model, ModelMixin):
     __user_fields__ = ('id', 'order_id', 'product_id', 'price', 'price_paid',
                        'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'order': 'order',
+        'product': 'product',
+        'order_group': 'order.order_group',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     order_id = db.Column(db.ForeignKey('order.id'), index=True)
@@ -359,9 +416,8 @@ class OrderProduct(db.Model, ModelMixin):
 
     @property
     def order_group(self):
-        return (db.session.query(OrderGroup)
-                .join(Order, OrderGroup.id == Order.group_id)
-                .filter(Order.id == self.order_id)).first()
+        order = self.order
+        return order.order_group if order else None
 
 
 class Billing(db.Model, ModelMixin):
@@ -371,6 +427,11 @@ class Billing(db.Model, ModelMixin):
                        'end_date', 'status', 'price', 'price_paid', 'currency',
                        'data', 'notes', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+        'order': 'order',
+        'order_group': 'order.order_group',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -396,9 +457,8 @@ class Billing(db.Model, ModelMixin):
 
     @property
     def order_group(self):
-        return (db.session.query(OrderGroup)
-                .join(Order, OrderGroup.id == Order.group_id)
-                .filter(Order.id == self.order_id)).first()
+        order = self.order
+        return order.order_group if order else None
 
 
 class Balance(db.Model, ModelMixin):
@@ -407,6 +467,9 @@ class Balance(db.Model, ModelMixin):
     __user_fields__ = ('id', 'user_id', 'type', 'create_date', 'end_date',
                        'status', 'balance', 'currency', 'data', 'notes', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     user_id = db.Column(db.ForeignKey('user.id'), index=True, unique=True)
@@ -432,6 +495,9 @@ class Product(db.Model, ModelMixin):
     __user_fields__ = ('id', 'type', 'code', 'name', 'description', 'create_date', 'end_date',
                        'info', 'status', 'region_id', 'pricing', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'region': 'region',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -478,6 +544,9 @@ class Promotion(db.Model, ModelMixin):
                        'target_product_ids', 'product_settings', 'user_settings',
                        'settings', 'discount_code', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'region': 'region',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -593,6 +662,9 @@ class User(db.Model, ModelMixin):
                        'group_id', 'group_role', 'full_name', 'workphone', 'cellphone', 'organization',
                        'address', 'city', 'country_code', 'id_number', 'language', 'extra')
     __admin_fields__ = __user_fields__ + ('data',)
+    __prefetch_fields__ = {
+        'group': 'group',
+    }
 
     __user_update_fields__ = ('full_name', 'address', 'cellphone', 'workphone', 'organization',
                               'city', 'country_code', 'id_number', 'language')
@@ -656,16 +728,66 @@ class User(db.Model, ModelMixin):
     @staticmethod
     def verify_token(token):
         try:
-            user_id = str_util.jwt_decode_token(token, algorithms=['HS256'])
-            return User.query.get(user_id)
+            if USER_TOKEN_CACHE_TTL:
+                key = hash_util.hash_as_hex(token.encode('utf-8'), method='sha256')
+                snapshot = _user_token_cache.get(key)
+                if snapshot is not None:
+                    return snapshot
+
+            content = str_util.jwt_decode_token_content(token, algorithms=['HS256'])
+            user = load_request_user(content['data'])
+            if user and USER_TOKEN_CACHE_TTL:
+                # Cached snapshot must not outlive the token
+                _user_token_cache.set(key, UserSnapshot(user), expire_at=content.get('exp'))
+            return user
         except BaseException as e:
             LOG.warning(e)
 
+    @staticmethod
+    def invalidate_token_cache(user_id):
+        """
+        Remove cached token verification results of a user in this process.
+        Call this when user role/status/language changed.
+        :param user_id:
+        :return:
+        """
+        _user_token_cache.remove_if(lambda k, v: v.id == user_id)
+
+    @staticmethod
+    def token_cache_stats():
+        """
+        Get statistics of the token verification cache.
+        :return:
+        """
+        return _user_token_cache.stats()
+
     @property
     def orders(self):
         return Order.query.filter(Order.user_id == self.id).all()
 
 
+class UserSnapshot(object):
+    """
+    Detached snapshot of user attributes used for request authentication.
+    """
+    __slots__ = ('id', 'user_name', 'role', 'status', 'language')
+
+    def __init__(self, user):
+        self.id = user.id
+        self.user_name = user.user_name
+        self.role = user.role
+        self.status = user.status
+        self.language = user.language
+
+    def __repr__(self):
+        return '<UserSnapshot {} name={}>'.format(self.id, self.user_name)
+
+
+USER_TOKEN_CACHE_TTL = app.config['API_USER_CACHE_TTL']
+_user_token_cache = cache_util.TTLCache(max_size=app.config['API_USER_CACHE_SIZE'],
+                                        ttl=USER_TOKEN_CACHE_TTL)
+
+
 class UserGroup(db.Model, ModelMixin):
     __tablename__ = 'user_group'
 
@@ -692,6 +814,9 @@ class Ticket(db.Model, ModelMixin):
     __user_fields__ = ('id', 'type', 'code', 'user_id', 'target_id', 'status', 'level', 'issue',
                        'create_date', 'end_date', 'title', 'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -719,6 +844,10 @@ class Support(db.Model, ModelMixin):
     __user_fields__ = ('id', 'type', 'code', 'user_id', 'target_id', 'status',
                        'issue', 'create_date', 'end_date', 'description', 'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+        'ticket': 'ticket',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -748,6 +877,14 @@ class Compute(db.Model, ModelMixin):
                        'create_date', 'end_date', 'status', 'region_id',
                        'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+        'order': 'order',
+        'region': 'region',
+        'order_group': 'order.order_group',
+        'order_products': 'order.order_product',
+        'products': 'order.order_product.product',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -792,21 +929,17 @@ class Compute(db.Model, ModelMixin):
 
     @property
     def order_group(self):
-        return (db.session.query(OrderGroup)
-                .join(Order, OrderGroup.id == Order.group_id)
-                .filter(Order.id == self.order_id)).first()
+        order = self.order
+        return order.order_group if order else None
 
     @property
     def order_products(self):
-        # Should we use md.iterate(condition) instead?
-        return OrderProduct.query.filter(OrderProduct.order_id == self.order_id).all()
+        order = self.order
+        return list(order.order_product) if order else []
 
     @property
     def products(self):
-        return (db.session.query(Product)
-                .join(OrderProduct, Product.id == OrderProduct.product_id)
-                .join(Order, OrderProduct.order_id == Order.id)
-                .filter(Order.id == self.order_id)).all()
+        return [op.product for op in self.order_products if op.product]
 
 
 class PublicIP(db.Model, ModelMixin):
@@ -815,6 +948,10 @@ class PublicIP(db.Model, ModelMixin):
     __user_fields__ = ('addr', 'type', 'version', 'status', 'create_date', 'start_date', 'end_date',
                        'mac_addr', 'user_id', 'compute_id', 'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+        'compute': 'compute',
+    }
 
     addr = db.Column(db.String(255), primary_key=True)
     type = db.Column(db.String(50), index=True)
@@ -843,6 +980,9 @@ class Task(db.Model, ModelMixin):
                        'target_time', 'target_date', 'status', 'create_date',
                        'start_date', 'end_date', 'description', 'data', 'extra')
     __admin_fields__ = __user_fields__
+    __prefetch_fields__ = {
+        'user': 'user',
+    }
 
     id = db.Column(db.Integer, primary_key=True, autoincrement=True)
     type = db.Column(db.String(50), index=True)
@@ -866,6 +1006,59 @@ class Task(db.Model, ModelMixin):
         return '<TaskJob {} user={}>'.format(self.id, self.user_id)
 
 
+class JobRun(db.Model, ModelMixin):
+    __tablename__ = 'job_run'
+    __table_args__ = (
+        db.Index('job_run_job_id_scheduled_date_idx', 'job_id', 'scheduled_date'),
+    )
+
+    __user_fields__ = ('id', 'job_id', 'status', 'scheduled_date', 'start_date', 'end_date',
+                       'runner', 'error')
+    __admin_fields__ = __user_fields__
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    job_id = db.Column(db.String(255), index=True)
+    status = db.Column(db.String(50), index=True)
+    scheduled_date = db.Column(db.DateTime)
+    start_date = db.Column(db.DateTime, index=True)
+    end_date = db.Column(db.DateTime)
+    runner = db.Column(db.String(255))
+    error = db.Column(db.String(2048))
+
+    def __repr__(self):
+        return '<JobRun {} job={}>'.format(self.id, self.job_id)
+
+
+class QueueTask(db.Model, ModelMixin):
+    __tablename__ = 'queue_task'
+    __table_args__ = (
+        db.Index('queue_task_queue_status_available_date_idx', 'queue', 'status', 'available_date'),
+    )
+
+    __user_fields__ = ('id', 'queue', 'name', 'status', 'attempts', 'max_attempts', 'create_date',
+                       'available_date', 'start_date', 'end_date', 'runner', 'error')
+    __admin_fields__ = __user_fields__
+
+    id = db.Column(db.Integer, primary_key=True, autoincrement=True)
+    queue = db.Column(db.String(50))
+    name = db.Column(db.String(255), index=True)
+    status = db.Column(db.String(50), index=True)
+    attempts = db.Column(db.Integer)
+    max_attempts = db.Column(db.Integer)
+    create_date = db.Column(db.DateTime, index=True)
+    # Task is not delivered before this time, for a running task it is the visibility timeout
+    available_date = db.Column(db.DateTime)
+    start_date = db.Column(db.DateTime)
+    end_date = db.Column(db.DateTime)
+    runner = db.Column(db.String(255))
+    error = db.Column(db.String(2048))
+    data = db.Column(DB_JSON_TYPE)
+    result = db.Column(DB_JSON_TYPE)
+
+    def __repr__(self):
+        return '<QueueTask {} name={}>'.format(self.id, self.name)
+
+
 MODEL_CLASS_MAP = {
     User.__tablename__: User,
     UserGroup.__tablename__: UserGroup,
@@ -886,6 +1079,8 @@ MODEL_CLASS_MAP = {
     Compute.__tablename__: Compute,
     PublicIP.__tablename__: PublicIP,
     Task.__tablename__: Task,
+    JobRun.__tablename__: JobRun,
+    QueueTask.__tablename__: QueueTask,
 }
 
 
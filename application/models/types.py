@@ -380,6 +380,28 @@ class TaskStatus(BaseType):
         return 'ENABLED', 'DISABLED', 'COMPLETED', 'CLOSED'
 
 
+class JobRunStatus(BaseType):
+    RUNNING = 'RUNNING'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+    MISSED = 'MISSED'
+
+    @staticmethod
+    def all():
+        return 'RUNNING', 'SUCCEEDED', 'FAILED', 'MISSED'
+
+
+class QueueTaskStatus(BaseType):
+    PENDING = 'PENDING'
+    RUNNING = 'RUNNING'
+    SUCCEEDED = 'SUCCEEDED'
+    FAILED = 'FAILED'
+
+    @staticmethod
+    def all():
+        return 'PENDING', 'RUNNING', 'SUCCEEDED', 'FAILED'
+
+
 class ReportType(BaseType):
     USER = 'USER'
     ORDER = 'ORDER'
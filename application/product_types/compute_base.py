@@ -7,7 +7,7 @@ import re
 from application import app
 from application.base import errors
 from application.base.context import create_admin_context
-from application.managers import base as base_mgr, task_mgr, user_mgr
+from application.managers import base as base_mgr, config_mgr, task_mgr, user_mgr
 from application import models as md
 from application.product_types import base, os_base
 from application.utils import data_util, date_util, mail_util, str_util
@@ -43,19 +43,19 @@ class OSComputeBase(os_base.OSBase):
         super().__init__()
 
         # Load config
-        compute_config = md.query(md.Configuration,
-                                  type=md.ConfigurationType.COMPUTE,
-                                  name='compute_config',
-                                  status=md.ConfigurationStatus.ENABLED,
-                                  order_by=md.Configuration.version.desc()).first()
+        compute_config = config_mgr.get_cached_config(md.ConfigurationType.COMPUTE, 'compute_config')
         if not compute_config:
             raise ValueError('Config COMPUTE/compute_config not found in database.')
         self.compute_config = compute_config.contents
+        config_mgr.on_config_changed(md.ConfigurationType.COMPUTE, 'compute_config',
+                                     self._set_compute_config)
 
         # Register some background tasks
-        scheduler = task_mgr.get_scheduler()
-        scheduler.add_job(self.run_bg_task_daily, id='compute.run_bg_task_daily',
-                          **app.config['JOB_SYNC_COMPUTES_DAILY'])
+        task_mgr.add_job(self.run_bg_task_daily, id='compute.run_bg_task_daily',
+                         **app.config['JOB_SYNC_COMPUTES_DAILY'])
+
+    def _set_compute_config(self, compute_config):
+        self.compute_config = compute_config.contents
 
     @property
     def supported_actions(self):
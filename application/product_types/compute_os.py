@@ -7,15 +7,32 @@ import functools
 import re
 import uuid
 
-from application import app
+from sqlalchemy import and_, or_, select
+
+from application import app, db
 from application.base import errors
 from application import models as md
 from application.product_types import compute_base
 from application.product_types.openstack import os_api as client, constant
-from application.utils import date_util, mail_util, str_util
+from application.utils import cache_util, date_util, mail_util, str_util
 
 LOG = app.logger
 DEBUG = app.config['DEBUG']
+STATUS_SYNC_INTERVAL = app.config['COMPUTE_STATUS_SYNC_INTERVAL']
+SYNC_MAX_WORKERS = app.config['COMPUTE_SYNC_MAX_WORKERS']
+SYNC_BATCH_SIZE = app.config['COMPUTE_SYNC_BATCH_SIZE']
+SYNC_STOP_EXPIRED = app.config['COMPUTE_SYNC_STOP_EXPIRED']
+SERVER_PAGE_SIZE = app.config['OS_PUSHDOWN_MAX_LIMIT']
+LONG_TASK_METHOD = app.config['OS_LONG_TASK_METHOD']
+
+REPORT_RECONCILE_COMPUTES = 'reconcile computes'
+RECONCILE_COUNTERS = ('computes', 'servers', 'orphans', 'missing', 'drifted', 'expired', 'fixed', 'errors')
+# Max items listed per kind in reconciliation report
+RECONCILE_REPORT_MAX_ITEMS = 100
+
+# Last time (seconds) each compute status was synchronized by this process
+_status_sync_times = cache_util.TTLCache(max_size=app.config['COMPUTE_STATUS_SYNC_CACHE_SIZE'],
+                                         ttl=STATUS_SYNC_INTERVAL)
 
 SUPPORTED_ACTIONS = ['start', 'stop', 'pause', 'unpause',
                      'lock', 'unlock', 'suspend', 'resume',
@@ -137,12 +154,8 @@ class OSCompute(compute_base.OSComputeBase):
             sync_computes_status = True
 
         if sync_computes_status:
-            all_computes = []
             item_ctx = ctx.copy(task='synchronize compute status', data={})
-            for compute in computes:
-                item_ctx.data['compute'] = compute
-                compute = self.do_load_compute(item_ctx) or compute
-                all_computes.append(compute)
+            all_computes = self.sync_computes_status(item_ctx, computes=computes)
 
         return all_computes
 
@@ -162,69 +175,195 @@ class OSCompute(compute_base.OSComputeBase):
         if compute.status != md.ComputeStatus.DISABLED:
             compute_need_update = False
             # Update status for compute (if backend resource is linked)
-            os_info = compute.data.get('os_info') or {}
-            if (compute.status == md.ComputeStatus.ENABLED
-                    and os_info.get('cluster') and os_info.get('server_id')):
+            if self._need_sync_compute_status(compute):
                 compute_need_update = self._sync_compute_status(ctx, compute=compute, save=False)
 
             # If compute is locked, try to unlock it if we can
-            if compute.status == md.ComputeStatus.LOCKED:
-                target_status = None
-                os_status = compute.data.get('os_status') or {}
-                last_action = os_status.get('last_action') or ''
-                last_action_time = os_status.get('last_action_time')
-                last_error = os_status.get('last_error')
-
-                # If last action failed then unlock the compute
-                if last_error and last_action:
+            if self._check_compute_lock(compute):
+                compute_need_update = True
+
+            if compute_need_update:
+                md.save(compute)
+
+        return compute
+
+    def sync_computes_status(self, ctx, computes):
+        """
+        Synchronize status of multiple computes with the backend.
+        Servers are listed by one call per cluster, then the checks of do_load_compute()
+        are applied in memory and all changes are saved in one commit.
+        :param ctx:
+        :param computes:
+        :return:
+        """
+        now = date_util.utc_now_as_sec()
+        changed_computes = []
+        compute_groups = {}
+        for compute in computes:
+            if compute.status == md.ComputeStatus.DISABLED:
+                continue
+            if self._need_sync_compute_status(compute, now=now):
+                cluster = compute.data['os_info']['cluster']
+                compute_groups.setdefault((cluster, compute.user_id), []).append(compute)
+            elif self._check_compute_lock(compute):
+                changed_computes.append(compute)
+
+        for (cluster, user_id), group in compute_groups.items():
+            servers = None
+            os_client = self._get_user_os_client(ctx, cluster=cluster, user_id=user_id)
+            if os_client:
+                # Client is scoped to the user project, so only servers of the user are listed
+                err, server_list = os_client.get_servers(detailed=True, search_opts={'all_tenants': False})
+                if err:
+                    LOG.error('Failed to list servers of cluster {}: {}'.format(cluster, err))
+                else:
+                    servers = {server['id']: server for server in server_list}
+
+            for compute in group:
+                compute_need_update = False
+                if servers is not None:
+                    server = servers.get(compute.data['os_info']['server_id'])
+                    compute_need_update = self._update_compute_status(compute, server=server, sync_time=now)
+                if self._check_compute_lock(compute):
+                    compute_need_update = True
+                if compute_need_update:
+                    changed_computes.append(compute)
+
+        if changed_computes:
+            error = md.save(changed_computes)
+            if error:
+                LOG.error('Failed to save status of {} computes: {}'.format(len(changed_computes), error))
+        return computes
+
+    def _need_sync_compute_status(self, compute, now=None):
+        """
+        Check if compute status needs synchronizing with the backend.
+        :param compute:
+        :param now: current time in seconds
+        :return:
+        """
+        os_info = compute.data.get('os_info') or {}
+        if (compute.status != md.ComputeStatus.ENABLED
+                or not os_info.get('cluster') or not os_info.get('server_id')):
+            return False
+        last_sync_time = _status_sync_times.get(compute.id)
+        if not last_sync_time:
+            return True
+        now = now or date_util.utc_now_as_sec()
+        return now - last_sync_time >= STATUS_SYNC_INTERVAL
+
+    def _check_compute_lock(self, compute):
+        """
+        Unlock compute if the last action failed or timed out.
+        :param compute:
+        :return: True if compute is updated
+        """
+        if compute.status != md.ComputeStatus.LOCKED:
+            return False
+
+        target_status = None
+        os_status = compute.data.get('os_status') or {}
+        last_action = os_status.get('last_action') or ''
+        last_action_time = os_status.get('last_action_time')
+        last_error = os_status.get('last_error')
+
+        # If last action failed then unlock the compute
+        if last_error and last_action:
+            if last_action == ACTION_CREATE_COMPUTE:
+                target_status = md.ComputeStatus.FAILED
+            else:
+                target_status = md.ComputeStatus.ENABLED
+                compute.backend_status = constant.VM_STATUS_UNKNOWN
+        else:  # Check for action timed out, if it did, then unlock the compute
+            timeout = ACTION_TIMEOUT.get(last_action)
+            if timeout and last_action_time:
+                action_time = date_util.utc_from_timestamp(last_action_time)
+                if date_util.utc_now() > date_util.datetime_add(action_time, seconds=timeout):
                     if last_action == ACTION_CREATE_COMPUTE:
                         target_status = md.ComputeStatus.FAILED
                     else:
                         target_status = md.ComputeStatus.ENABLED
                         compute.backend_status = constant.VM_STATUS_UNKNOWN
-                else:  # Check for action timed out, if it did, then unlock the compute
-                    timeout = ACTION_TIMEOUT.get(last_action)
-                    if timeout and last_action_time:
-                        action_time = date_util.utc_from_timestamp(last_action_time)
-                        if date_util.utc_now() > date_util.datetime_add(action_time, seconds=timeout):
-                            if last_action == ACTION_CREATE_COMPUTE:
-                                target_status = md.ComputeStatus.FAILED
-                            else:
-                                target_status = md.ComputeStatus.ENABLED
-                                compute.backend_status = constant.VM_STATUS_UNKNOWN
-
-                if target_status is not None:
-                    compute.status = target_status
-                    compute_need_update = True
 
-                # TODO khanhct If compute is locked, try to unlock it if we can
-                # output = info.get('output')
-                # if output:
-                #     server_id = output['id']
-                #     api = self._get_os_api(ctx=ctx, compute=compute)
-                #     locked, locked_reason = api.get_locked_state(server_id=server_id)
-                #     if locked:
-                #         ret = api.unlock_server(server_id=server_id)
-                #         if ret:
-                #             # TODO Update compute status to database
-                #             pass
-                #         else:
-                #             # TODO update locked reason
-                #             pass
-
-            if compute_need_update:
-                md.save(compute)
-
-        return compute
+        if target_status is None:
+            return False
+        compute.status = target_status
+
+        # TODO khanhct If compute is locked, try to unlock it if we can
+        # output = info.get('output')
+        # if output:
+        #     server_id = output['id']
+        #     api = self._get_os_api(ctx=ctx, compute=compute)
+        #     locked, locked_reason = api.get_locked_state(server_id=server_id)
+        #     if locked:
+        #         ret = api.unlock_server(server_id=server_id)
+        #         if ret:
+        #             # TODO Update compute status to database
+        #             pass
+        #         else:
+        #             # TODO update locked reason
+        #             pass
+        return True
 
     def _sync_compute_status(self, ctx, compute, save=False):
         """
         Update VM status.
         :param compute:
+        :return: True if compute status changed
+        """
+        os_info = compute.data['os_info']
+        os_client = self._get_user_os_client(ctx, cluster=os_info['cluster'], user_id=compute.user_id)
+        if not os_client:
+            return False
+
+        err, server = os_client.get_server(server_id=os_info['server_id'])
+        if err:
+            LOG.error('Failed to get server {}: {}'.format(os_info['server_id'], err))
+            return False
+
+        changed = self._update_compute_status(compute, server=server)
+        if changed and save:
+            md.save(compute)
+        return changed
+
+    def _update_compute_status(self, compute, server, sync_time=None):
+        """
+        Update compute status from its backend server.
+        :param compute:
+        :param server: server data, None if the server is not found
+        :param sync_time:
+        :return: True if compute is updated
+        """
+        # Sync time is kept in memory, so unchanged computes are not written on every sync
+        _status_sync_times.set(compute.id, sync_time or date_util.utc_now_as_sec())
+        backend_status = server['status'] if server else constant.VM_STATUS_UNKNOWN
+        if compute.backend_status == backend_status:
+            return False
+        compute.backend_status = backend_status
+        return True
+
+    def _get_user_os_client(self, ctx, cluster, user_id):
+        """
+        Get OS client of the compute owner, errors are logged only.
+        :param ctx:
+        :param cluster:
+        :param user_id:
         :return:
         """
-        # TODO
-        return False
+        user_ctx = ctx.copy()
+        for user in (ctx.target_user, ctx.request_user):
+            if user and user.id == user_id:
+                user_ctx.target_user = user
+                break
+        else:
+            user_ctx.target_user = md.load_user(user_id)
+
+        os_client = self.get_os_client(user_ctx, cluster=cluster)
+        if user_ctx.failed:
+            LOG.error('Failed to get OS client of user {} for cluster {}: {}'.format(
+                user_id, cluster, user_ctx.error))
+            return None
+        return os_client
 
     def _sync_compute_config(self, ctx, compute, save=False):
         """
@@ -510,12 +649,12 @@ class OSCompute(compute_base.OSComputeBase):
 
         compute_info['network_ports'] = network_ports
 
-    def do_post_create_compute(self, ctx, compute, method='thread', on_result=None):
+    def do_post_create_compute(self, ctx, compute, method=None, on_result=None):
         """
         Override method from super class.
         :param ctx:
         :param compute:
-        :param method:
+        :param method: default is OS_LONG_TASK_METHOD, as creating the stack takes minutes
         :param on_result:
         :return:
         """
@@ -588,7 +727,7 @@ class OSCompute(compute_base.OSComputeBase):
 
         return self._execute_client_func(ctx, compute=compute,
                                          func=functools.partial(os_client.create_compute, info=info),
-                                         method=method,
+                                         method=method or LONG_TASK_METHOD,
                                          on_result=on_result or self.on_create_compute_result)
 
     def _execute_client_func(self, ctx, compute, func, method, on_result):
@@ -598,16 +737,32 @@ class OSCompute(compute_base.OSComputeBase):
         compute_id = compute.id
 
         def _on_result(ctx, result):
-            compute = md.load(md.Compute, id=compute_id)
-            # Check the compute
-            if not compute:
-                error = 'Compute not found in callback {}.'.format(ctx.task)
-                LOG.error(error)
-                self.finish_action_log(ctx, error=error, save=True)
-            else:
-                on_result(ctx=ctx, compute=compute, result=result)
+            self._on_compute_result(ctx, result=result, compute_id=compute_id, on_result=on_result)
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, compute_id=compute_id))
+
+    def on_task_result(self, ctx, result, name, compute_id=None, **kwargs):
+        """
+        Override method from super class.
+        :param ctx:
+        :param result:
+        :param name:
+        :param compute_id:
+        :param kwargs:
+        :return:
+        """
+        self._on_compute_result(ctx, result=result, compute_id=compute_id, on_result=getattr(self, name))
+
+    def _on_compute_result(self, ctx, result, compute_id, on_result):
+        compute = md.load(md.Compute, id=compute_id)
+        # Check the compute
+        if not compute:
+            error = 'Compute not found in callback {}.'.format(ctx.task)
+            LOG.error(error)
+            self.finish_action_log(ctx, error=error, save=True)
+        else:
+            on_result(ctx=ctx, compute=compute, result=result)
 
     def _find_target_cluster(self, ctx, compute):
         """
@@ -908,6 +1063,194 @@ class OSCompute(compute_base.OSComputeBase):
             self.unlock_compute(ctx, compute=compute, purpose=task,
                                 target_status=target_status, error=os_error, backend_status=backend_status)
 
+    #######################################################
+    # COMPUTE RECONCILIATION
+    #######################################################
+
+    def do_run_bg_task_daily(self, ctx):
+        """
+        Reconcile computes with backend servers of all clusters.
+        Clusters are reconciled in parallel, the summary is saved as a report.
+        :param ctx:
+        :return:
+        """
+        start_date = date_util.utc_now()
+        clusters = [cl['cluster'] for cl in self.backend_config['clusters']]
+        results = {}
+        if clusters:
+            with futures.ThreadPoolExecutor(max_workers=min(SYNC_MAX_WORKERS, len(clusters)),
+                                            thread_name_prefix='compute-sync') as executor:
+                future_map = {executor.submit(self._reconcile_cluster_in_app, ctx, cluster): cluster
+                              for cluster in clusters}
+                for future in futures.as_completed(future_map):
+                    cluster = future_map[future]
+                    try:
+                        results[cluster] = future.result()
+                    except Exception as e:
+                        LOG.error('Failed to reconcile computes of cluster {}: {}'.format(cluster, e))
+                        results[cluster] = {'error': str(e)}
+
+        total = {}
+        for result in results.values():
+            for key in RECONCILE_COUNTERS:
+                total[key] = total.get(key, 0) + (result.get(key) or 0)
+        failed = any(result.get('error') for result in results.values())
+
+        report = md.Report(type=md.ReportType.COMPUTE,
+                           name=REPORT_RECONCILE_COMPUTES,
+                           status=md.ReportStatus.FAILED if failed else md.ReportStatus.SUCCEEDED,
+                           start_date=start_date,
+                           end_date=date_util.utc_now(),
+                           contents={'total': total, 'clusters': results})
+        error = md.save_new(report)
+        if error:
+            ctx.set_error(error, status=500)
+            return
+        LOG.info('Reconciled computes of {} clusters: {}'.format(len(clusters), total))
+        ctx.response = report.to_dict()
+        return ctx.response
+
+    def _reconcile_cluster_in_app(self, ctx, cluster):
+        # Worker threads need their own app context and DB session
+        with app.app_context():
+            try:
+                return self.reconcile_cluster(ctx.copy(data={}), cluster=cluster)
+            finally:
+                db.session.remove()
+
+    def reconcile_cluster(self, ctx, cluster):
+        """
+        Reconcile computes of a cluster with its backend servers.
+        Servers are listed once, compute rows are streamed from DB and compared with them:
+            - orphans: servers not linked to any compute, reported only
+            - missing: enabled computes whose server is not found, backend status is set UNKNOWN
+            - drifted: enabled computes whose backend status differs from the server status
+            - expired: enabled computes with an expired order and an active server,
+                       stopped if COMPUTE_SYNC_STOP_EXPIRED is set
+        Fixes are saved in batches of COMPUTE_SYNC_BATCH_SIZE.
+        :param ctx:
+        :param cluster:
+        :return: dict of result
+        """
+        result = {key: 0 for key in RECONCILE_COUNTERS}
+        result.update({'orphan_servers': [], 'missing_computes': [], 'expired_computes': []})
+
+        os_client = self.get_admin_os_client(ctx, cluster=cluster)
+        if ctx.failed:
+            result['error'] = str(ctx.error)
+            return result
+        err, servers = self._list_cluster_servers(os_client)
+        if err:
+            LOG.error('Failed to list servers of cluster {}: {}'.format(cluster, err))
+            result['error'] = str(err)
+            return result
+        result['servers'] = len(servers)
+
+        now = date_util.utc_now()
+        linked_server_ids = set()
+        updates = []
+        expired_computes = []
+        for row in self._iter_cluster_computes(cluster):
+            os_info = (row.data or {}).get('os_info') or {}
+            server_id = os_info.get('server_id')
+            if os_info.get('cluster') != cluster or not server_id:
+                continue
+            result['computes'] += 1
+            linked_server_ids.add(server_id)
+            if row.status != md.ComputeStatus.ENABLED:
+                continue
+
+            server = servers.get(server_id)
+            if server is None:
+                result['missing'] += 1
+                _add_report_item(result['missing_computes'], row.id)
+                if row.backend_status != constant.VM_STATUS_UNKNOWN:
+                    updates.append({'id': row.id, 'backend_status': constant.VM_STATUS_UNKNOWN})
+                continue
+
+            if row.backend_status != server['status']:
+                result['drifted'] += 1
+                updates.append({'id': row.id, 'backend_status': server['status']})
+
+            end_date = row.order_end_date or row.end_date
+            if end_date and end_date < now and server['status'] == constant.VM_STATUS_ACTIVE:
+                result['expired'] += 1
+                _add_report_item(result['expired_computes'], row.id)
+                if SYNC_STOP_EXPIRED:
+                    expired_computes.append((row.id, server_id))
+
+        # Servers of other product types (e.g. databases, LB amphorae) are orphans here,
+        # so they are never deleted automatically
+        for server_id, server in servers.items():
+            if server_id not in linked_server_ids:
+                result['orphans'] += 1
+                _add_report_item(result['orphan_servers'], {'id': server_id, 'name': server.get('name')})
+
+        for compute_id, server_id in expired_computes:
+            err, _ = os_client.perform_server_action(action='stop', server_id=server_id)
+            if err:
+                LOG.error('Failed to stop server {} of expired compute {}: {}'.format(server_id, compute_id, err))
+                result['errors'] += 1
+                continue
+            updates.append({'id': compute_id, 'backend_status': constant.VM_STATUS_SHUTOFF})
+
+        self._apply_compute_updates(updates, result=result)
+        return result
+
+    def _list_cluster_servers(self, os_client):
+        """
+        List all servers of a cluster page by page.
+        :param os_client: admin client of the cluster
+        :return: (error, dict of server id -> server)
+        """
+        servers = {}
+        marker = None
+        while True:
+            err, page = os_client.get_servers(detailed=True, search_opts={'all_tenants': True},
+                                              marker=marker, limit=SERVER_PAGE_SIZE)
+            if err:
+                return err, None
+            for server in page:
+                servers[server['id']] = server
+            if len(page) < SERVER_PAGE_SIZE:
+                return None, servers
+            marker = page[-1]['id']
+
+    def _iter_cluster_computes(self, cluster):
+        """
+        Stream compute rows which may belong to a cluster by a server-side cursor.
+        Rows are read by a separate connection, not loaded into the session.
+        :param cluster:
+        :return:
+        """
+        compute = md.Compute.__table__
+        order = md.Order.__table__
+        query = select([compute.c.id, compute.c.status, compute.c.backend_status, compute.c.end_date,
+                        compute.c.data, order.c.end_date.label('order_end_date')]) \
+            .select_from(compute.outerjoin(order, compute.c.order_id == order.c.id)) \
+            .where(and_(compute.c.status != md.ComputeStatus.DELETED,
+                        or_(compute.c.backend_id.like('{}/%'.format(cluster)),
+                            compute.c.backend_id.is_(None))))
+        with db.engine.connect() as conn:
+            for row in conn.execution_options(stream_results=True).execute(query):
+                yield row
+
+    def _apply_compute_updates(self, updates, result):
+        """
+        Save backend status of computes in batches, one commit per batch.
+        :param updates: list of dicts of id and updated columns
+        :param result:
+        :return:
+        """
+        for i in range(0, len(updates), SYNC_BATCH_SIZE):
+            batch = updates[i:i + SYNC_BATCH_SIZE]
+            db.session.bulk_update_mappings(md.Compute, batch)
+            error = md.save()
+            if error:
+                result['errors'] += len(batch)
+            else:
+                result['fixed'] += len(batch)
+
     #######################################################
     # COMPUTE STATS
     #######################################################
@@ -1887,4 +2230,9 @@ class OSCompute(compute_base.OSComputeBase):
         target_status = md.ComputeStatus.ENABLED
 
         self.unlock_compute(ctx, compute=compute, purpose=task,
-                            target_status=target_status, error=error)
\ No newline at end of file
+                            target_status=target_status, error=error)
+
+
+def _add_report_item(items, item):
+    if len(items) < RECONCILE_REPORT_MAX_ITEMS:
+        items.append(item)
@@ -323,7 +323,8 @@ class OSDatabase(os_base.OSBase):
             # Finish history log for the action (if there is)
             self.finish_action_log(ctx, error=result[0])
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, db_obj=db_obj))
 
     def on_create_db_cluster_result(self, ctx, db_obj, result):
         """
@@ -195,7 +195,8 @@ class OSKeypair(os_base.OSBase):
             # Finish history log for the action (if there is)
             self.finish_action_log(ctx, error=result[0])
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, keypair_obj=keypair_obj))
 
     def on_create_keypair_result(self, ctx, keypair_obj, result):
         """
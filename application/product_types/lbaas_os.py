@@ -206,7 +206,8 @@ class OSLbaas(os_base.OSBase):
             # Finish history log for the action (if there is)
             self.finish_action_log(ctx, error=result[0])
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, lb_obj=lb_obj))
 
     def on_create_lb_result(self, ctx, lb_obj, result):
         """
@@ -189,7 +189,8 @@ class OSMagnum(os_base.OSBase):
             # Finish history log for the action (if there is)
             self.finish_action_log(ctx, error=result[0])
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, magnum_obj=magnum_obj))
 
     def on_create_magnum_cluster_result(self, ctx, magnum_obj, result):
         """
@@ -183,7 +183,8 @@ class OSNetwork(os_base.OSBase):
             # Finish history log for the action (if there is)
             self.finish_action_log(ctx, error=result[0])
 
-        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result)
+        self.execute_client_func(ctx, func=func, method=method, on_result=_on_result,
+                                 callback=self.make_task_callback(on_result, net_obj=net_obj))
 
     def do_create_network(self, ctx, network, method='thread', on_result=None):
         """
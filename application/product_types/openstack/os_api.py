@@ -4,7 +4,8 @@
 from foxcloud import client as fox_client
 from application import app
 from application.product_types.openstack import (os_base, os_api_identity, os_api_compute,
-                                                 os_api_network, os_api_image, os_api_volume)
+                                                 os_api_network, os_api_image, os_api_volume,
+                                                 os_client_pool)
 
 LOG = app.logger
 
@@ -26,6 +27,9 @@ def init_clusters(clusters_config):
     global CLUSTERS
     CLUSTERS = clusters
 
+    # Cluster endpoints/credentials may change
+    os_client_pool.clear()
+
 
 def iter_clusters():
     """
@@ -115,8 +119,8 @@ def get_os_client(cluster, os_config, engine='console', services='shade'):
     :param services:
     :return:
     """
-    return OpenstackAPI(cluster=cluster, os_config=os_config,
-                        engine=engine, services=services)
+    return os_client_pool.get_client(OpenstackAPI, cluster=cluster, os_config=os_config,
+                                     engine=engine, services=services)
 
 
 def get_admin_os_client(cluster, os_config=None, engine='console', services='shade'):
@@ -135,8 +139,8 @@ def get_admin_os_client(cluster, os_config=None, engine='console', services='sha
             'region_name': os_info['region_name'],
             'auth': os_info['auth'],
         }
-    return OpenstackAPI(cluster=cluster, os_config=os_config,
-                        engine=engine, services=services)
+    return os_client_pool.get_client(OpenstackAPI, cluster=cluster, os_config=os_config,
+                                     engine=engine, services=services)
 
 
 class OpenstackAPI(os_base.OSBaseMixin,
@@ -13,6 +13,10 @@ from application.utils import data_util
 
 LOG = app.logger
 
+# Sort keys of Nova server list having the same names in parsed server data
+SERVER_SORT_KEYS = ('created_at', 'updated_at', 'launched_at', 'terminated_at',
+                    'key_name', 'availability_zone')
+
 
 class OSComputeMixin(object):
 
@@ -205,11 +209,23 @@ class OSComputeMixin(object):
         @param listing:
         @return:
         """
+        paging = None
+        if marker is None and limit is None and not sort_keys:
+            paging, listing = self.pushdown_paging(listing, sort_keys=SERVER_SORT_KEYS)
+            if paging:
+                limit = paging['limit']
+                sort_keys = paging['sort_keys']
+                sort_dirs = paging['sort_dirs']
         try:
             data = self.client.shade.get_servers(detailed=detailed, search_opts=search_opts,
                                                  marker=marker, limit=limit, sort_keys=sort_keys,
                                                  sort_dirs=sort_dirs)
-            return data.parse(**listing)
+            if not paging:
+                return data.parse(**listing)
+            err, servers = data.parse()
+            if err:
+                return self.fail(err)
+            return self.parse(servers, **listing)
         except fox_exc.FoxCloudException as e:
             LOG.error("Error [get_servers()]: %s.", e.orig_message)
             return self.fail(e)
@@ -2,24 +2,119 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+from concurrent import futures
+import heapq
+import inspect
+import threading
+
 import munch
 
 from foxcloud import client as fox_client
 
+from application import app
+from application.product_types.openstack import os_simulator
+from application.utils import perf_util
+
+DEFAULT_SORT_BY = (('created_at', 'asc'), ('updated_at', 'asc'))
+# Use partial sort when the requested page end is less than this ratio of all items
+PARTIAL_SORT_RATIO = 0.25
+# Max items returned by one backend list call (Nova osapi_max_limit)
+PUSHDOWN_MAX_LIMIT = app.config['OS_PUSHDOWN_MAX_LIMIT']
+
+OS_SIMULATOR_ENABLED = app.config['OS_SIMULATOR_ENABLED']
+
+FAN_OUT_MAX_WORKERS = app.config['OS_FAN_OUT_MAX_WORKERS']
+FAN_OUT_CALL_TIMEOUT = app.config['OS_FAN_OUT_CALL_TIMEOUT']
+
+_fan_out_executor = None
+_fan_out_lock = threading.Lock()
+
+
+def _get_fan_out_executor():
+    """
+    Get the shared thread pool for fan-out calls, create it on first use.
+    :return:
+    """
+    global _fan_out_executor
+    if _fan_out_executor is None:
+        with _fan_out_lock:
+            if _fan_out_executor is None:
+                _fan_out_executor = futures.ThreadPoolExecutor(max_workers=FAN_OUT_MAX_WORKERS,
+                                                               thread_name_prefix='os-fan-out')
+    return _fan_out_executor
+
+
+def fan_out(func, items, timeout=None):
+    """
+    Call func(item) for all items concurrently using a bounded thread pool.
+    Function should return a tuple (error, data) like API methods.
+    :param func:
+    :param items: list of unique items
+    :param timeout: timeout in seconds of each call, default is OS_FAN_OUT_CALL_TIMEOUT
+    :return: (error, {item: data}), error is the first failure
+    """
+    items = list(items)
+    if not items:
+        return None, {}
+    if len(items) == 1:
+        err, data = func(items[0])
+        return err, ({items[0]: data} if not err else None)
+
+    timeout = timeout or FAN_OUT_CALL_TIMEOUT
+    executor = _get_fan_out_executor()
+    func = perf_util.bind_metrics(func)
+    future_map = {executor.submit(func, item): item for item in items}
+    # Calls are run in batches of pool size, so allow each batch its own timeout
+    batches = (len(items) + FAN_OUT_MAX_WORKERS - 1) // FAN_OUT_MAX_WORKERS
+    done, not_done = futures.wait(future_map, timeout=timeout * batches,
+                                  return_when=futures.FIRST_EXCEPTION)
+    result = {}
+    error = None
+    for future in done:
+        try:
+            err, data = future.result()
+        except BaseException as e:
+            err, data = e, None
+        if err:
+            error = error or err
+            continue
+        result[future_map[future]] = data
 
-DEFAULT_SORT_BY = (('updated_at', 'asc'), ('created_at', 'asc'))
+    if not_done:
+        for future in not_done:
+            future.cancel()
+        error = error or futures.TimeoutError(
+            'Timed out waiting for {} of {} OpenStack calls.'.format(len(not_done), len(items)))
+    return (error, None) if error else (None, result)
 
 
 class OSBaseMixin(object):
 
+    def __init_subclass__(cls, **kwargs):
+        super().__init_subclass__(**kwargs)
+        # Public API methods are timed as OpenStack calls in request metrics
+        for name in dir(cls):
+            if name.startswith('_') or hasattr(OSBaseMixin, name):
+                continue
+            func = getattr(cls, name)
+            if inspect.isfunction(func) and not getattr(func, 'timed_call', None):
+                setattr(cls, name, perf_util.timed_call('os', func))
+
     def __init__(self, cluster, os_config=None, engine='console', services=None, **kwargs):
         self.cluster = cluster
         self.os_config = os_config
+        self.engine = engine
+        self.services = services
         params = {
             'os_auth': os_config['auth'],
             **kwargs
         }
-        self.client = fox_client.Client(version='1', engine=engine, services=services, **params)
+        with perf_util.timer('os'):
+            if engine == os_simulator.ENGINE or OS_SIMULATOR_ENABLED:
+                self.client = os_simulator.Client(cluster, version='1', engine=engine, services=services,
+                                                  **params)
+            else:
+                self.client = fox_client.Client(version='1', engine=engine, services=services, **params)
 
     def ok(self, data):
         return None, data
@@ -29,12 +124,13 @@ class OSBaseMixin(object):
 
     def parse(self, obj, fields=None, extra_fields=None, extra_field_getter=None, **paging):
         if isinstance(obj, list):
-            objects = [self.to_dict(o) for o in obj]
+            # Paginate on raw objects, so only items of the page are converted to dict
             if 'page_size' in paging:
-                page_data = self.paginate(objects, **paging)
+                page_data = self.paginate(obj, **paging)
                 objects = page_data['data']
             else:
                 page_data = None
+                objects = obj
 
             objects_ = []
             for o in objects:
@@ -98,31 +194,29 @@ class OSBaseMixin(object):
     def paginate(self, objects, page, page_size, sort_by=None, **kw):
         """
         Paginate data.
-        :param objects:
+        :param objects: list of dicts or objects
         :param page:
         :param page_size:
-        :param sort_by:
+        :param sort_by: list of (attr, direction), the first one is the primary key.
+                        Pass an empty list if objects are already sorted.
         :return:
         """
-        # Python sorted is stable sort, so we can call it multiple times
-        # to sort by multiple fields. Performance may be an issue.
-        # See: https://stackoverflow.com/questions/5212870/sorting-a-python-list-by-two-fields
-
         if page_size is None:
             return objects
 
         if sort_by is None:
             sort_by = DEFAULT_SORT_BY
 
-        for sort in sort_by:
-            reverse = sort[1] == 'desc'
-            objects = sorted(objects, key=lambda x: x.get(sort[0], 0), reverse=reverse)
-
         count = len(objects)
         page = page or 1
         start = min((page - 1) * page_size, count)
         end = min(start + page_size, count)
-        data = objects[start:end] if start < end else []
+        if start < end:
+            if sort_by:
+                objects = self._sort_objects(objects, sort_by, limit=end)
+            data = objects[start:end]
+        else:
+            data = []
         return {
             'data': data,
             'has_more': end < count,
@@ -130,6 +224,57 @@ class OSBaseMixin(object):
             'prev_page': page - 1 if page > 1 else None,
         }
 
+    def _sort_objects(self, objects, sort_by, limit=None):
+        """
+        Sort objects by a composite key in one pass.
+        Only the first `limit` items are sorted when the page is at the top of the list.
+        :param objects:
+        :param sort_by:
+        :param limit:
+        :return:
+        """
+        directions = {d for _, d in sort_by}
+        if len(directions) == 1:
+            attrs = [attr for attr, _ in sort_by]
+            key = lambda x: tuple(_sort_value(x, attr) for attr in attrs)
+            reverse = 'desc' in directions
+        else:
+            key = lambda x: _MixedSortKey(x, sort_by)
+            reverse = False
+
+        if limit is not None and limit < len(objects) * PARTIAL_SORT_RATIO:
+            # Same result as sorted(...)[:limit]
+            select = heapq.nlargest if reverse else heapq.nsmallest
+            return select(limit, objects, key=key)
+        return sorted(objects, key=key, reverse=reverse)
+
+    def pushdown_paging(self, listing, sort_keys):
+        """
+        Move sorting and page limit of listing to the backend list call.
+        The backend returns sorted items just enough for the requested page, then
+        the page is sliced locally without sorting again.
+        :param listing:
+        :param sort_keys: sort keys supported by the backend API
+        :return: (backend params or None if not supported, local listing)
+        """
+        page_size = listing.get('page_size')
+        if not page_size:
+            return None, listing
+        sort_by = listing.get('sort_by')
+        if sort_by is None:
+            sort_by = DEFAULT_SORT_BY
+        if not sort_by or any(attr not in sort_keys for attr, _ in sort_by):
+            return None, listing
+
+        # One more item to know if there are more pages
+        limit = (listing.get('page') or 1) * page_size + 1
+        params = {
+            'limit': limit if limit <= PUSHDOWN_MAX_LIMIT else None,
+            'sort_keys': [attr for attr, _ in sort_by],
+            'sort_dirs': [direction for _, direction in sort_by],
+        }
+        return params, dict(listing, sort_by=[])
+
     def filter_fields(self, objects, fields):
         """
         Filter fields for objects.
@@ -153,3 +298,36 @@ class OSBaseMixin(object):
                 result.append(obj_data)
 
         return result
+
+
+def _sort_value(obj, attr):
+    """
+    Get sort value of dict or object, None values come first.
+    :param obj:
+    :param attr:
+    :return:
+    """
+    value = obj.get(attr) if isinstance(obj, dict) else getattr(obj, attr, None)
+    return (0, 0) if value is None else (1, value)
+
+
+class _MixedSortKey(object):
+    """
+    Sort key for sorting by multiple attributes with different directions.
+    """
+    __slots__ = ('values', 'sort_by')
+
+    def __init__(self, obj, sort_by):
+        self.values = [_sort_value(obj, attr) for attr, _ in sort_by]
+        self.sort_by = sort_by
+
+    def __lt__(self, other):
+        for i, (_, direction) in enumerate(self.sort_by):
+            a, b = self.values[i], other.values[i]
+            if a == b:
+                continue
+            return b < a if direction == 'desc' else a < b
+        return False
+
+    def __eq__(self, other):
+        return self.values == other.values
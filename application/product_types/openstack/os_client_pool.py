@@ -0,0 +1,153 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import hashlib
+import json
+import threading
+import time
+
+from application import app
+from application.utils import cache_util
+
+LOG = app.logger
+
+POOL_MAX_SIZE = app.config['OS_CLIENT_POOL_MAX_SIZE']
+POOL_TTL = app.config['OS_CLIENT_POOL_TTL']
+POOL_ENGINES = app.config['OS_CLIENT_POOL_ENGINES']
+# Client is dropped from pool this time before its token expires
+TOKEN_EXPIRY_MARGIN = 60
+
+_pool = cache_util.TTLCache(max_size=POOL_MAX_SIZE, ttl=POOL_TTL)
+_creating_locks = {}
+_lock = threading.Lock()
+_stats = {
+    'created': 0,
+    'reused': 0,
+    'not_pooled': 0,
+}
+
+
+def get_client(api_class, cluster, os_config, engine='console', services=None):
+    """
+    Get an OpenStack API client from pool, create a new one if not found.
+    Clients are shared by (api class, cluster, os user, project, services, engine),
+    so Keystone authentication and HTTP sessions are reused between requests.
+    :param api_class: OpenstackAPI, LbaasAPI, DatabaseAPI, MagnumAPI, ...
+    :param cluster:
+    :param os_config:
+    :param engine:
+    :param services:
+    :return:
+    """
+    if not POOL_MAX_SIZE or engine not in POOL_ENGINES:
+        _incr_stat('not_pooled')
+        return api_class(cluster=cluster, os_config=os_config, engine=engine, services=services)
+
+    key = _make_key(api_class, cluster, os_config, engine, services)
+    client = _pool.get(key)
+    if client is not None:
+        _incr_stat('reused')
+        return client
+
+    # Only one thread creates client for a key, other threads wait and reuse it
+    with _lock:
+        key_lock = _creating_locks.setdefault(key, threading.Lock())
+    with key_lock:
+        client = _pool.get(key)
+        if client is not None:
+            _incr_stat('reused')
+            return client
+        try:
+            client = api_class(cluster=cluster, os_config=os_config, engine=engine, services=services)
+            _pool.set(key, client, expire_at=_get_token_expiry(client))
+            _incr_stat('created')
+        finally:
+            with _lock:
+                _creating_locks.pop(key, None)
+    return client
+
+
+def invalidate(cluster=None, username=None):
+    """
+    Remove clients from pool.
+    :param cluster: remove clients of the cluster only
+    :param username: remove clients of the OS user only
+    :return: number of removed clients
+    """
+    def _match(key, client):
+        if cluster is not None and key[1] != cluster:
+            return False
+        if username is not None and key[2] != username:
+            return False
+        return True
+    return _pool.remove_if(_match)
+
+
+def clear():
+    """
+    Remove all clients from pool.
+    :return:
+    """
+    _pool.clear()
+
+
+def get_stats():
+    """
+    Get pool statistics.
+    :return:
+    """
+    stats = _pool.stats()
+    with _lock:
+        stats.update(_stats)
+    stats['engines'] = list(POOL_ENGINES)
+    return stats
+
+
+def _incr_stat(name):
+    with _lock:
+        _stats[name] += 1
+
+
+def _make_key(api_class, cluster, os_config, engine, services):
+    """
+    Make pool key for client.
+    Credentials are part of the key as a hash, so a password change results in a new client.
+    :param api_class:
+    :param cluster:
+    :param os_config:
+    :param engine:
+    :param services:
+    :return:
+    """
+    auth = os_config.get('auth') or {}
+    if isinstance(services, (list, tuple)):
+        services = ','.join(sorted(services))
+    fingerprint = json.dumps(os_config, sort_keys=True, default=str)
+    fingerprint = hashlib.sha256(fingerprint.encode('utf-8')).hexdigest()
+    return (api_class.__name__, cluster, auth.get('username'), auth.get('project_name'),
+            services, engine, fingerprint)
+
+
+def _get_token_expiry(client):
+    """
+    Get expiry time (seconds since epoch) of the Keystone token used by the client.
+    :param client:
+    :return: None if unknown, then the pool TTL is applied.
+    """
+    try:
+        session = getattr(client.client, 'session', None)
+        # Only read the token already issued, get_auth_ref() would authenticate again.
+        # Before the first call there is no token yet and the pool TTL is applied.
+        auth_ref = getattr(session.auth, 'auth_ref', None) if session is not None else None
+        expires = getattr(auth_ref, 'expires', None)
+        if isinstance(expires, datetime.datetime):
+            if expires.tzinfo is not None:
+                expires = expires.timestamp()
+            else:
+                expires = (expires - datetime.datetime(1970, 1, 1)).total_seconds()
+            return expires - TOKEN_EXPIRY_MARGIN
+    except Exception as e:
+        LOG.debug('Unable to get token expiry of OS client: {}'.format(e))
+    return None
@@ -4,7 +4,7 @@
 from foxcloud import exceptions as fox_exc
 
 from application import app
-from application.product_types.openstack import os_base
+from application.product_types.openstack import os_base, os_client_pool
 
 LOG = app.logger
 
@@ -18,7 +18,8 @@ def get_database_client(cluster, os_config, engine='console', services='trove'):
     :param services:
     :return:
     """
-    return DatabaseAPI(cluster=cluster, os_config=os_config, engine=engine, services=services)
+    return os_client_pool.get_client(DatabaseAPI, cluster=cluster, os_config=os_config,
+                                     engine=engine, services=services)
 
 
 class DatabaseAPI(os_base.OSBaseMixin):
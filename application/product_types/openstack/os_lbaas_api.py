@@ -1,14 +1,23 @@
 #
 # Copyright (c) 2020 FTI-CAS
 #
+import functools
+
 from foxcloud import exceptions as fox_exc
 from foxcloud import client as fox_client
 
 from application import app
-from application.product_types.openstack import os_base
+from application.product_types.openstack import os_base, os_client_pool
 
 LOG = app.logger
 
+LB_EXTRA_FIELD_MODE = app.config['LBAAS_EXTRA_FIELD_MODE']
+# Extra field: (list function, get function, id param of get function)
+LB_CHILD_FIELDS = {
+    'listeners': ('get_listeners', 'get_listener', 'listener_id'),
+    'pools': ('get_pools', 'get_pool', 'pool_id'),
+}
+
 
 def get_lbaas_client(cluster, os_config, engine='console', services='lbaas'):
     """
@@ -19,7 +28,8 @@ def get_lbaas_client(cluster, os_config, engine='console', services='lbaas'):
     :param services:
     :return:
     """
-    return LbaasAPI(cluster=cluster, os_config=os_config, engine=engine, services=services)
+    return os_client_pool.get_client(LbaasAPI, cluster=cluster, os_config=os_config,
+                                     engine=engine, services=services)
 
 
 class LbaasAPI(os_base.OSBaseMixin):
@@ -32,7 +42,7 @@ class LbaasAPI(os_base.OSBaseMixin):
         """
         try:
             data = self.client.lbaas.get_lbs(**filters)
-            return data.parse(extra_field_getter=self._get_extra_field, **listing)
+            return self._parse_lbs(data, listing)
         except fox_exc.FoxCloudException as e:
             LOG.error("Error [get_lbs()]: %s.", e)
             return self.fail(e)
@@ -46,33 +56,102 @@ class LbaasAPI(os_base.OSBaseMixin):
         """
         try:
             data = self.client.lbaas.get_lb(lb_id=lb_id)
-            return data.parse(extra_field_getter=self._get_extra_field, **listing)
+            return self._parse_lbs(data, listing)
         except fox_exc.FoxCloudException as e:
             LOG.error("Error [get_lb(%s)]: %s.", lb_id, e)
             return self.fail(e)
 
-    def _get_extra_field(self, obj, field):
-        if field == 'listeners':
-            listeners = []
-            for listener in obj['listeners'] or []:
-                result = self.client.lbaas.get_listener(listener_id=listener.get('id'))
-                err, data = result.parse()
+    def _parse_lbs(self, data, listing):
+        """
+        Parse lb data, expand extra fields for all lbs of the page at once.
+        :param data:
+        :param listing:
+        :return:
+        """
+        listing = dict(listing or {})
+        fields = listing.pop('fields', None)
+        extra_fields = listing.pop('extra_fields', None)
+        if not extra_fields:
+            return data.parse(fields=fields, **listing)
+        err, result = data.parse(**listing)
+        if err:
+            return self.fail(err)
+
+        paged = isinstance(result, dict) and 'has_more' in result and isinstance(result.get('data'), list)
+        lbs = result['data'] if paged else result
+        lbs = lbs if isinstance(lbs, list) else [lbs]
+
+        err = self._expand_extra_fields(lbs, extra_fields)
+        if err:
+            return self.fail(err)
+
+        if fields:
+            lbs = self.filter_fields(lbs, fields + extra_fields)
+        if paged:
+            result['data'] = lbs
+            return self.ok(result)
+        return self.ok(lbs if isinstance(result, list) else lbs[0])
+
+    def _expand_extra_fields(self, lbs, extra_fields):
+        """
+        Fill extra fields (listeners, pools) of lbs.
+        Child objects of all lbs are fetched concurrently and each object is fetched once.
+        :param lbs:
+        :param extra_fields:
+        :return: error if any
+        """
+        for field in extra_fields:
+            if field not in LB_CHILD_FIELDS:
+                return 'Unknown extra field "%s".' % field
+
+            if LB_EXTRA_FIELD_MODE == 'batch':
+                lb_ids = {lb['id'] for lb in lbs if lb.get(field)}
+                err, children = os_base.fan_out(
+                    functools.partial(self._list_lb_children, field), lb_ids)
                 if err:
-                    return self.fail(err)
-                listeners.append(data)
-            return None, listeners
-
-        if field == 'pools':
-            pools = []
-            for pool in obj['pools'] or []:
-                result = self.client.lbaas.get_pool(pool_id=pool['id'])
-                err, data = result.parse()
+                    return err
+                child_map = {}
+                for items in children.values():
+                    child_map.update((item['id'], item) for item in items)
+            else:
+                child_ids = {child['id'] for lb in lbs for child in (lb.get(field) or [])}
+                err, child_map = os_base.fan_out(
+                    functools.partial(self._get_lb_child, field), child_ids)
                 if err:
-                    return self.fail(err)
-                pools.append(data)
-            return None, pools
+                    return err
+
+            for lb in lbs:
+                lb[field] = [child_map[child['id']] for child in (lb.get(field) or [])
+                             if child['id'] in child_map]
+        return None
+
+    def _list_lb_children(self, field, lb_id):
+        """
+        List child objects of a lb by one call.
+        :param field:
+        :param lb_id:
+        :return:
+        """
+        list_func = getattr(self.client.lbaas, LB_CHILD_FIELDS[field][0])
+        try:
+            return list_func(loadbalancer_id=lb_id).parse()
+        except fox_exc.FoxCloudException as e:
+            LOG.error("Error [list lb %s(%s)]: %s.", field, lb_id, e)
+            return self.fail(e)
 
-        return self.fail('Unknown extra field "%s".' % field)
+    def _get_lb_child(self, field, child_id):
+        """
+        Get a child object of a lb.
+        :param field:
+        :param child_id:
+        :return:
+        """
+        list_func, get_func, id_param = LB_CHILD_FIELDS[field]
+        try:
+            return getattr(self.client.lbaas, get_func)(**{id_param: child_id}).parse()
+        except fox_exc.FoxCloudException as e:
+            LOG.error("Error [get lb %s(%s)]: %s.", field, child_id, e)
+            return self.fail(e)
 
     def create_lb(self, name, description, subnet_id=None, wait=False, **kwargs):
         """
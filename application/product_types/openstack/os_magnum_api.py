@@ -5,7 +5,7 @@ from foxcloud import exceptions as fox_exc
 from foxcloud import client as fox_client
 
 from application import app
-from application.product_types.openstack import os_base
+from application.product_types.openstack import os_base, os_client_pool
 
 LOG = app.logger
 
@@ -19,7 +19,8 @@ def get_magnum_client(cluster, os_config, engine='console', services='lbaas'):
     :param services:
     :return:
     """
-    return MagnumAPI(cluster=cluster, os_config=os_config, engine=engine, services=services)
+    return os_client_pool.get_client(MagnumAPI, cluster=cluster, os_config=os_config,
+                                     engine=engine, services=services)
 
 
 class MagnumAPI(os_base.OSBaseMixin):
@@ -0,0 +1,429 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import random
+import re
+import threading
+import time
+import uuid
+
+import munch
+from foxcloud import exceptions as fox_exc
+
+from application import app
+from application.product_types.openstack import constant
+
+LOG = app.logger
+
+# Engine name of simulator clients
+ENGINE = 'sim'
+
+OS_SIMULATOR = app.config['OS_SIMULATOR']
+
+# Kinds of resources having other names in some calls
+KIND_ALIASES = {
+    'sec_group_rule': 'sg_rule',
+    'health_monitor': 'monitor',
+    'server_sec_group': 'sec_group',
+}
+
+# Fields of generated resources by kind, besides id, name, status and dates
+KIND_FIELDS = {
+    'server': lambda rnd, i: {
+        'status': rnd.choice((constant.VM_STATUS_ACTIVE,) * 8 + (constant.VM_STATUS_SHUTOFF,
+                                                                 constant.VM_STATUS_ERROR)),
+        'locked': False,
+        'locked_reason': None,
+        'flavor': {'id': 'm1.small'},
+        'image': {'id': 'ubuntu-20.04'},
+        'addresses': {},
+    },
+    'volume': lambda rnd, i: {
+        'status': 'available',
+        'size': rnd.choice((20, 50, 100)),
+    },
+    'lb': lambda rnd, i: {
+        'provisioning_status': 'ACTIVE',
+        'operating_status': 'ONLINE',
+        'vip_address': '10.0.{}.{}'.format(i // 250, i % 250 + 1),
+    },
+}
+
+# Resource managers of services, e.g. shade.server_groups.get(id=...)
+SUB_MANAGERS = {
+    'server_groups': 'server_group',
+}
+
+# Names of list call parameters that are not filters
+LIST_PARAMS = ('detailed', 'limit', 'marker', 'sort_keys', 'sort_dirs', 'search_opts', 'filters')
+
+_ID_KWARG = re.compile(r'(^|_)(id|name_or_id)$')
+
+
+class SimulatedError(fox_exc.FoxCloudException):
+    """
+    Error injected by the simulator.
+    """
+
+    def __init__(self, message):
+        Exception.__init__(self, message)
+        self.message = message
+        self.orig_message = message
+
+
+class SimResult(object):
+    """
+    Result of a simulated call, parsed like foxcloud results.
+    """
+
+    def __init__(self, data):
+        self.data = data
+
+    def parse(self, **listing):
+        from application.product_types.openstack import os_base
+        # Parse without a client, like API methods parse objects
+        parser = object.__new__(os_base.OSBaseMixin)
+        return parser.parse(self.data, **listing)
+
+
+class SimCloud(object):
+    """
+    In-memory resources of a simulated cluster.
+    Resources of a kind are generated on first use, by sizes of `dataset` config.
+    """
+
+    def __init__(self, cluster, config):
+        self.cluster = cluster
+        self.config = config
+        self.rnd = random.Random('{}:{}'.format(config.get('seed', 1), cluster))
+        self._resources = {}
+        self._lock = threading.RLock()
+        max_concurrency = config.get('max_concurrency') or 0
+        self._semaphore = threading.BoundedSemaphore(max_concurrency) if max_concurrency else None
+        self.stats = {}
+
+    def _new_resource(self, kind, index, **fields):
+        now = datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        resource = munch.Munch({
+            'id': str(uuid.UUID(int=self.rnd.getrandbits(128))),
+            'name': '{}-{}'.format(kind, index),
+            'status': 'ACTIVE',
+            'created_at': now,
+            'updated_at': now,
+        })
+        make_fields = KIND_FIELDS.get(kind)
+        if make_fields:
+            resource.update(make_fields(self.rnd, index))
+        resource.update(fields)
+        return resource
+
+    def resources(self, kind):
+        items = self._resources.get(kind)
+        if items is None:
+            with self._lock:
+                items = self._resources.get(kind)
+                if items is None:
+                    count = (self.config.get('dataset') or {}).get(kind) or 0
+                    items = {}
+                    for i in range(count):
+                        resource = self._new_resource(kind, i)
+                        items[resource.id] = resource
+                    self._resources[kind] = items
+        return items
+
+    #
+    # Calls
+    #
+    def list(self, kind, kwargs):
+        filters = dict(kwargs.get('filters') or {})
+        filters.update(kwargs.get('search_opts') or {})
+        filters.update({k: v for k, v in kwargs.items() if k not in LIST_PARAMS})
+        with self._lock:
+            items = [r for r in self.resources(kind).values()
+                     if all(r.get(k, v) == v for k, v in filters.items())]
+
+        sort_keys = kwargs.get('sort_keys') or []
+        sort_dirs = kwargs.get('sort_dirs') or []
+        for i in reversed(range(len(sort_keys))):
+            reverse = i < len(sort_dirs) and sort_dirs[i] == 'desc'
+            items.sort(key=lambda r: str(r.get(sort_keys[i]) or ''), reverse=reverse)
+        marker = kwargs.get('marker')
+        if marker:
+            ids = [r.id for r in items]
+            items = items[ids.index(marker) + 1:] if marker in ids else []
+        limit = kwargs.get('limit')
+        if limit:
+            items = items[:limit]
+        return items
+
+    def get(self, kind, id):
+        with self._lock:
+            resource = self.resources(kind).get(id)
+            if resource is None:
+                # Lookup by name as some calls take name or id
+                resource = next((r for r in self.resources(kind).values() if r.name == id), None)
+        if resource is None:
+            raise SimulatedError('{} {} not found.'.format(kind, id))
+        return resource
+
+    def create(self, kind, kwargs):
+        fields = dict(kwargs.get('info') or {})
+        fields.update({k: v for k, v in kwargs.items() if k != 'info'})
+        with self._lock:
+            items = self.resources(kind)
+            resource = self._new_resource(kind, len(items), **fields)
+            items[resource.id] = resource
+        return resource
+
+    def update(self, kind, id, kwargs):
+        with self._lock:
+            resource = self.get(kind, id)
+            resource.update({k: v for k, v in kwargs.items() if not _ID_KWARG.search(k)})
+            resource.updated_at = datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z'
+        return resource
+
+    def delete(self, kind, id):
+        with self._lock:
+            resource = self.get(kind, id)
+            del self.resources(kind)[resource.id]
+        return resource
+
+    def quotas(self, verb, kind, id, kwargs):
+        # Quotas of a project, created with the default value on first get
+        with self._lock:
+            items = self.resources(kind)
+            quotas = items.get(id)
+            if verb == 'delete':
+                items.pop(id, None)
+                return munch.Munch(id=id)
+            if quotas is None:
+                quotas = items[id] = munch.Munch(id=id, **(self.config.get('quotas') or {}))
+            if verb in ('update', 'set'):
+                quotas.update({k: v for k, v in kwargs.items() if not _ID_KWARG.search(k)})
+            return quotas
+
+    def perform_server_action(self, kwargs):
+        action = kwargs.get('action')
+        updates = {
+            'lock': {'locked': True, 'locked_reason': kwargs.get('reason')},
+            'unlock': {'locked': False, 'locked_reason': None},
+            'stop': {'status': constant.VM_STATUS_SHUTOFF},
+            'start': {'status': constant.VM_STATUS_ACTIVE},
+            'reboot': {'status': constant.VM_STATUS_ACTIVE},
+        }.get(action) or {}
+        return self.update('server', kwargs.get('server_id'), updates)
+
+    def call(self, service, method, args, kwargs):
+        """
+        Simulate a call: wait for the call latency, inject errors, then apply it to resources.
+        :param service:
+        :param method:
+        :param args:
+        :param kwargs:
+        :return:
+        """
+        name = '{}.{}'.format(service, method)
+        latency = _get_call_config(self.config, 'latency', name, method) or 0
+        jitter = _get_call_config(self.config, 'latency_jitter', name, method) or 0
+        error_rate = _get_call_config(self.config, 'error_rate', name, method) or 0
+
+        started = time.monotonic()
+        if self._semaphore:
+            self._semaphore.acquire()
+        failed = True
+        try:
+            if latency or jitter:
+                time.sleep(max(self.rnd.gauss(latency, jitter) if jitter else latency, 0))
+            if error_rate and self.rnd.random() < error_rate:
+                raise SimulatedError('Simulated error of {}.'.format(name))
+            result = self._dispatch(method, args, kwargs)
+            failed = False
+            return result
+        finally:
+            if self._semaphore:
+                self._semaphore.release()
+            self._add_stat(name, time.monotonic() - started, failed=failed)
+
+    def _dispatch(self, method, args, kwargs):
+        handler = getattr(self, method, None)
+        if method in ('perform_server_action',) and handler:
+            return handler(kwargs)
+
+        verb, _, kind = method.partition('_')
+        kind = KIND_ALIASES.get(kind, kind)
+        if kind.endswith('quotas'):
+            return self.quotas(verb, kind, _get_id(kind, args, kwargs), kwargs)
+        if verb in ('get', 'list') and kind.endswith('s'):
+            singular = KIND_ALIASES.get(kind[:-1], kind[:-1])
+            if (singular + '_id') not in kwargs:
+                return self.list(singular, kwargs)
+        if verb == 'get':
+            return self.get(kind, _get_id(kind, args, kwargs))
+        if verb in ('create', 'add'):
+            return self.create(kind, kwargs)
+        if verb in ('update', 'set'):
+            id = _get_id(kind, args, kwargs)
+            if id is None:
+                return self.create(kind, kwargs)
+            return self.update(kind, id, kwargs)
+        if verb in ('delete', 'remove'):
+            id = _get_id(kind, args, kwargs)
+            try:
+                return self.delete(kind, id)
+            except SimulatedError:
+                # Deleting missing resources succeeds like most OpenStack clients
+                return munch.Munch(id=id)
+        # Other actions succeed without changes
+        return munch.Munch(kwargs)
+
+    def _add_stat(self, name, duration, failed=False):
+        with self._lock:
+            stat = self.stats.get(name)
+            if stat is None:
+                stat = self.stats[name] = {'calls': 0, 'errors': 0, 'time': 0.0}
+            stat['calls'] += 1
+            stat['time'] += duration
+            if failed:
+                stat['errors'] += 1
+
+
+def _get_call_config(config, key, name, method):
+    # Per call value, e.g. {'shade.get_servers': 0.2} or {'get_servers': 0.2}, otherwise the default
+    calls = config.get('calls') or {}
+    for call_key in (name, method):
+        value = (calls.get(call_key) or {}).get(key)
+        if value is not None:
+            return value
+    return config.get(key)
+
+
+def _get_id(kind, args, kwargs):
+    id = kwargs.get(kind + '_id')
+    if id is None:
+        id = next((v for k, v in kwargs.items() if _ID_KWARG.search(k)), None)
+    if id is None and args:
+        id = args[0]
+    if isinstance(id, dict):
+        id = id.get('id')
+    return id
+
+
+class SimService(object):
+    """
+    OpenStack service of a simulator client.
+    """
+
+    def __init__(self, cloud, name):
+        self._cloud = cloud
+        self._name = name
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        # Sub-managers like shade.server_groups, or the inner client like shade.shade
+        if attr in SUB_MANAGERS:
+            return SimManager(self._cloud, self._name, SUB_MANAGERS[attr])
+        if attr == self._name:
+            return self
+
+        def _call(*args, **kwargs):
+            return SimResult(self._cloud.call(self._name, attr, args, kwargs))
+        _call.__name__ = attr
+        return _call
+
+
+class SimManager(object):
+    """
+    Resource manager of a service, e.g. shade.server_groups.get(id=...).
+    """
+
+    def __init__(self, cloud, service, kind):
+        self._cloud = cloud
+        self._service = service
+        self._kind = kind
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        method = 'get_{}s'.format(self._kind) if attr == 'list' else '{}_{}'.format(attr, self._kind)
+
+        def _call(*args, **kwargs):
+            # Managers return objects, not results
+            return self._cloud.call(self._service, method, args, kwargs)
+        return _call
+
+
+class Client(object):
+    """
+    Simulator client with the interface of foxcloud Client.
+    """
+    session = None
+
+    def __init__(self, cluster, version='1', engine=ENGINE, services=None, **kwargs):
+        self.cluster = cluster
+        self.engine = engine
+        self.services = services
+        self._cloud = get_cloud(cluster)
+
+    def __getattr__(self, attr):
+        if attr.startswith('__'):
+            raise AttributeError(attr)
+        return SimService(self._cloud, attr)
+
+
+# Simulated clusters: cluster name -> SimCloud
+_clouds = {}
+_clouds_lock = threading.Lock()
+
+def get_cloud(cluster):
+    """
+    Get simulated cluster, create it on first use.
+    :param cluster:
+    :return:
+    """
+    cloud = _clouds.get(cluster)
+    if cloud is None:
+        with _clouds_lock:
+            cloud = _clouds.get(cluster)
+            if cloud is None:
+                cloud = _clouds[cluster] = SimCloud(cluster, OS_SIMULATOR)
+    return cloud
+
+
+def configure(**config):
+    """
+    Change simulator config, e.g. latency for a load test. Existing clusters are reset.
+    Usage:
+        os_simulator.configure(latency=0.1, calls={'get_servers': {'latency': 0.5}},
+                               dataset={'server': 1000})
+    :param config:
+    :return:
+    """
+    OS_SIMULATOR.update(config)
+    reset()
+
+
+def reset():
+    """
+    Remove all simulated clusters and their resources.
+    :return:
+    """
+    with _clouds_lock:
+        _clouds.clear()
+
+
+def get_stats():
+    """
+    Get call statistics of simulated clusters.
+    :return:
+    """
+    with _clouds_lock:
+        clouds = list(_clouds.values())
+    stats = {}
+    for cloud in clouds:
+        # Stats are added by calls in other threads
+        with cloud._lock:
+            stats[cloud.cluster] = {name: dict(stat) for name, stat in cloud.stats.items()}
+    return stats
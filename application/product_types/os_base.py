@@ -3,17 +3,27 @@
 #
 
 from concurrent import futures
+import functools
+import importlib
+import json
+
+from sqlalchemy import exc as sa_exc
 
 from application import app, thread_executor, process_executor
-from application.base import errors
-from application.managers import base as base_mgr, user_mgr
+from application.base import context, errors
+from application.managers import base as base_mgr, config_mgr, queue_mgr, user_mgr
 from application import models as md
 from application.product_types import base
-from application.product_types.openstack import os_api
+from application.product_types.openstack import os_api, os_base as os_base_api, os_client_pool
 from application.utils import data_util, date_util, mail_util, str_util
 
 LOG = app.logger
 
+# Name of queued tasks calling OpenStack client functions (method 'mq')
+CLIENT_FUNC_TASK = 'os_client_func'
+# Keys of context data not stored in queued tasks
+TASK_DATA_EXCLUDED_KEYS = ('password', 'os_user_info', 'callback', 'call_method')
+
 ADMIN_ROLES = (md.UserRole.ADMIN, md.UserRole.ADMIN_SALE, md.UserRole.ADMIN_IT)
 GET_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
 LIST_ROLES = (md.UserRole.USER,) + ADMIN_ROLES
@@ -35,15 +45,19 @@ class OSBase(base.ProductType):
             self.init_backend_config()
 
     def init_backend_config(self):
-        backend_config = md.query(md.Configuration,
-                                  type=md.ConfigurationType.BACKEND,
-                                  name='os_config',
-                                  status=md.ConfigurationStatus.ENABLED,
-                                  order_by=md.Configuration.version.desc()).first()
+        backend_config = config_mgr.get_cached_config(md.ConfigurationType.BACKEND, 'os_config')
         if not backend_config:
             raise ValueError('Config BACKEND/os_config not found in database.')
-        self._backend_config = backend_config.contents
-        os_api.init_clusters(self._backend_config)
+        OSBase._set_backend_config(backend_config)
+        # Reload clusters when a new version of config is enabled
+        config_mgr.on_config_changed(md.ConfigurationType.BACKEND, 'os_config',
+                                     OSBase._set_backend_config)
+
+    @staticmethod
+    def _set_backend_config(backend_config):
+        # Shared by all Openstack product types
+        OSBase._backend_config = backend_config.contents
+        os_api.init_clusters(backend_config.contents)
 
     @property
     def backend_config(self):
@@ -350,25 +364,42 @@ class OSBase(base.ProductType):
         except Exception as e:
             ctx.set_error(errors.USER_OS_PROJECT_NOT_FOUND, cause=e, status=404)
 
-    def execute_client_func(self, ctx, func, on_result, method='sync'):
+    def execute_client_func(self, ctx, func, on_result, method='sync', callback=None):
         """
         Execute client func.
         :param ctx:
         :param func:
         :param on_result:
         :param method: accepted values: 'sync', 'thread', 'process', 'mq'
+        :param callback: callback of method 'mq' made by make_task_callback(),
+                         the task is run by thread if it is not given
         """
         data = ctx.data
         ctx.response = None
         method = data.get('call_method') or method
         on_result = data.get('callback') or on_result
 
+        if method == 'mq':
+            task_data = self._make_client_func_task(ctx, func=func, callback=callback)
+            if task_data is not None:
+                try:
+                    task_id = queue_mgr.enqueue(CLIENT_FUNC_TASK, task_data)
+                except sa_exc.SQLAlchemyError as e:
+                    LOG.error(e)
+                    ctx.set_error(errors.DB_COMMIT_FAILED, cause=e, status=500)
+                    return
+                # History log of the action is saved after this returns, the task needs its id
+                # to finish the log
+                if not ctx.log_args.get('log_id'):
+                    ctx.log_callbacks.append(functools.partial(_set_task_log_id, task_id))
+                ctx.status = 202  # Accepted but not finished yet
+                return
+            LOG.warning('Task "{}" can not be queued, run it by thread.'.format(ctx.task))
+            method = 'thread'
+
         if method == 'sync':
             func_result = func()
             return on_result(ctx, result=func_result)
-        elif method == 'mq':
-            # TODO: need support
-            ctx.status = 202  # Accepted but not finished yet
         else:
             request_user_id = ctx.request_user.id if ctx.request_user else None
             target_user_id = ctx.target_user.id if ctx.target_user else None
@@ -401,6 +432,82 @@ class OSBase(base.ProductType):
             future_obj.add_done_callback(_executor_callback)
             ctx.status = 202  # Accepted but not finished yet
 
+    def make_task_callback(self, on_result, **kwargs):
+        """
+        Make callback of a queued task. Functions can not be stored, so the result
+        is passed to on_task_result() of this product type with on_result name.
+        :param on_result: a method of this product type
+        :param kwargs: JSON serializable arguments of on_result
+        :return: None if on_result is not a method of this product type
+        """
+        if getattr(on_result, '__self__', None) is not self:
+            return None
+        return {
+            'product_type': _get_class_path(type(self)),
+            'name': on_result.__name__,
+            'kwargs': kwargs,
+        }
+
+    def on_task_result(self, ctx, result, name, **kwargs):
+        """
+        Called with result of a queued task in queue workers.
+        Subclass should override this method if its result handlers need other arguments.
+        :param ctx:
+        :param result:
+        :param name: name of result handler
+        :param kwargs:
+        :return:
+        """
+        getattr(self, name)(ctx=ctx, result=result, **kwargs)
+        # Finish history log for the action (if there is)
+        self.finish_action_log(ctx, error=result[0])
+
+    def _make_client_func_task(self, ctx, func, callback):
+        """
+        Make data of a queued task calling a client method.
+        :param ctx:
+        :param func: functools.partial of an API client method
+        :param callback:
+        :return: None if the task can not be stored
+        """
+        if callback is None or not isinstance(func, functools.partial):
+            return None
+        client = getattr(func.func, '__self__', None)
+        if not isinstance(client, os_base_api.OSBaseMixin):
+            return None
+
+        call = {
+            'func': func.func.__name__,
+            'args': list(func.args),
+            'kwargs': func.keywords,
+        }
+        try:
+            json.dumps([call, callback])
+        except (TypeError, ValueError):
+            return None
+
+        # Call args (e.g. VM passwords, os_cloud_config of stacks) and os_config hold credentials,
+        # they are encrypted, not only signed like JWT tokens
+        task_data = {
+            'call': str_util.encrypt_data(call),
+            'callback': callback,
+        }
+        task_data['client'] = {
+            'api_class': _get_class_path(type(client)),
+            'cluster': client.cluster,
+            'os_config': str_util.encrypt_data(client.os_config),
+            'engine': client.engine,
+            'services': client.services,
+        }
+        task_data['context'] = {
+            'task': ctx.task,
+            'request_user_id': ctx.request_user.id if ctx.request_user else None,
+            'target_user_id': ctx.target_user.id if ctx.target_user else None,
+            'data': _filter_task_data(ctx.data),
+            'log_args': _filter_task_data(ctx.log_args),
+        }
+        return task_data
+
     def start_action_log(self, ctx):
         """
         Setup a action log.
@@ -441,3 +548,104 @@ class OSBase(base.ProductType):
             return repr(error)
 
         return str(error)
+
+
+def _get_class_path(cls):
+    return '{}:{}'.format(cls.__module__, cls.__qualname__)
+
+
+def _load_class_path(path):
+    module_name, class_name = path.split(':')
+    return getattr(importlib.import_module(module_name), class_name)
+
+
+def _filter_task_data(data):
+    """
+    Get JSON serializable items of context data to store in queued tasks.
+    :param data:
+    :return:
+    """
+    result = {}
+    for k, v in (data or {}).items():
+        if k in TASK_DATA_EXCLUDED_KEYS:
+            continue
+        try:
+            json.dumps(v)
+        except (TypeError, ValueError):
+            continue
+        result[k] = v
+    return result
+
+
+def _set_task_log_id(task_id, log_id):
+    """
+    Set history log id of a queued task calling a client method.
+    :param task_id:
+    :param log_id:
+    :return:
+    """
+    def _update(data):
+        data['context']['log_args']['log_id'] = log_id
+        return data
+
+    if not queue_mgr.update_pending_task_data(task_id, _update):
+        LOG.warning('Task {} started before its history log {} was saved, '
+                    'the log is not finished by the task.'.format(task_id, log_id))
+
+
+def _run_client_func_task(task):
+    """
+    Run a queued task of execute_client_func(): call the client method, save its result,
+    then pass the result to the product type callback.
+    A redelivered task with a saved result only calls the callback again.
+    :param task: queue_mgr.QueuedTask
+    :return:
+    """
+    from application import product_types
+
+    data = task.data
+    ctx_data = data['context']
+    request_user_id = ctx_data['request_user_id']
+    target_user_id = ctx_data['target_user_id']
+    ctx = context.Context(task=ctx_data['task'],
+                          request_user=md.load(md.User, id=request_user_id) if request_user_id else None,
+                          target_user=md.load(md.User, id=target_user_id) if target_user_id else None,
+                          data=ctx_data['data'])
+    ctx.log_args = ctx_data['log_args']
+
+    if task.result is not None:
+        result = tuple(task.result)
+    else:
+        if task.exhausted:
+            result = '{}. Cause task not finished in {} attempts.'.format(errors.BACKEND_ERROR,
+                                                                          task.max_attempts), None
+        else:
+            try:
+                client_info = data['client']
+                client = os_client_pool.get_client(_load_class_path(client_info['api_class']),
+                                                   cluster=client_info['cluster'],
+                                                   os_config=str_util.decrypt_data(client_info['os_config']),
+                                                   engine=client_info['engine'],
+                                                   services=client_info['services'])
+                call = str_util.decrypt_data(data['call'])
+                result = getattr(client, call['func'])(*call['args'], **call['kwargs'])
+                result = result if isinstance(result, tuple) else (None, result)
+            except Exception as e:
+                # Retried by the queue, the callback gets the error after the last attempt
+                if not task.last_attempt:
+                    raise
+                result = '{}. Cause {}.'.format(errors.BACKEND_ERROR, str(e)), None
+        task.save_result(result)
+
+    callback = data['callback']
+    callback_class = _load_class_path(callback['product_type'])
+    prod_type = next((pt for pt in product_types.PRODUCT_TYPES.values() if type(pt) is callback_class), None)
+    if prod_type is None:
+        raise ValueError('Product type {} not found.'.format(callback['product_type']))
+    try:
+        prod_type.on_task_result(ctx, result=result, name=callback['name'], **callback['kwargs'])
+    finally:
+        ctx.close_db_session()
+
+
+queue_mgr.register_handler(CLIENT_FUNC_TASK, _run_client_func_task)
@@ -0,0 +1,3 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
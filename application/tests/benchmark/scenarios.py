@@ -0,0 +1,286 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import math
+import random
+import threading
+import time
+
+import application
+from application import app, db
+from application.base import context
+from application.managers import history_mgr, net_mgr
+from application import models as md
+from application.tests.benchmark import seed
+
+API_PREFIX = '/api/v1'
+LIST_PAGE_SIZE = 20
+# Pages of list calls are picked randomly from the first ones
+LIST_MAX_PAGE = 50
+PRICE_PRODUCT_COUNT = 3
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+class ScenarioError(Exception):
+    pass
+
+
+def percentile(values, percent):
+    """
+    Get percentile of sorted values by nearest rank.
+    :param values:
+    :param percent:
+    :return:
+    """
+    if not values:
+        return None
+    rank = max(int(math.ceil(len(values) * percent / 100.0)), 1)
+    return values[rank - 1]
+
+
+class Benchmark(object):
+    """
+    Benchmark scenarios of API hot paths against the app in process.
+    HTTP scenarios go through the whole request stack by Flask test client.
+    """
+
+    def __init__(self, rnd=None):
+        self.rnd = rnd or random.Random(1)
+        self.admin_token = application.admin.gen_token(expires_in=3600)
+        self.user_names = [name for name, in db.session.query(md.User.user_name).filter(
+            md.User.user_name.like(seed.USER_NAME_PREFIX + '%')).limit(1000)]
+        self.user_ids = [id for id, in db.session.query(md.User.id).filter(
+            md.User.user_name.like(seed.USER_NAME_PREFIX + '%')).limit(1000)]
+        # Plain values, as sessions are removed between calls
+        self.products = db.session.query(md.Product.id, md.Product.region_id).filter(
+            md.Product.status == 'ENABLED',
+            md.Product.region_id == md.RegionId.VN_HN,
+            md.Product.name != 'custom').limit(PRICE_PRODUCT_COUNT).all()
+        if not self.user_names or not self.products:
+            raise ScenarioError('DB is not seeded.')
+        self._local = threading.local()
+
+    @property
+    def client(self):
+        # Test client per thread
+        client = getattr(self._local, 'client', None)
+        if client is None:
+            client = self._local.client = app.test_client()
+        return client
+
+    def _request(self, method, path, token=None, **kwargs):
+        headers = {'Authorization': 'Bearer ' + token} if token else {}
+        resp = self.client.open(API_PREFIX + path, method=method, headers=headers, **kwargs)
+        if resp.status_code >= 400:
+            raise ScenarioError('{} {}: {} {}'.format(method, path, resp.status_code,
+                                                      resp.get_data(as_text=True)[:200]))
+        return resp
+
+    #
+    # Scenarios
+    #
+    def login(self):
+        self._request('POST', '/auth', json={
+            'user_name': self.rnd.choice(self.user_names),
+            'password': seed.USER_PASSWORD,
+        })
+
+    def _list(self, path):
+        self._request('GET', path, token=self.admin_token, query_string={
+            'page': self.rnd.randint(1, LIST_MAX_PAGE),
+            'page_size': LIST_PAGE_SIZE,
+        })
+
+    def list_users(self):
+        self._list('/users')
+
+    def list_orders(self):
+        self._list('/orders')
+
+    def list_histories(self):
+        self._list('/histories')
+
+    def create_order(self):
+        product_id, region_id = self.products[0]
+        self._request('POST', '/user/{}/orders'.format(self.rnd.choice(self.user_ids)),
+                      token=self.admin_token, json={
+                          'region_id': region_id,
+                          'currency': 'VND',
+                          'duration': '1 month',
+                          'products': [{'product_id': product_id}],
+                      })
+
+    def get_products_price(self):
+        self._request('POST', '/product_price', json={
+            'products': [{'product_id': product_id} for product_id, _ in self.products],
+            'duration': self.rnd.choice(('1 month', '3 months', '12 months')),
+            'currency': 'VND',
+        })
+
+    def find_unused_ip(self):
+        with app.test_request_context():
+            ctx = context.create_admin_context(task='find unused ip', data={})
+            ctx.data['ip_config'] = net_mgr.get_ip_config(ctx, config_name=seed.IP_CONFIG_NAME)
+            if ctx.succeed:
+                net_mgr.find_unused_ip(ctx)
+            if ctx.failed:
+                raise ScenarioError('find_unused_ip: {}'.format(ctx.error))
+
+    SCENARIOS = ('login', 'list_users', 'list_orders', 'list_histories',
+                 'create_order', 'get_products_price', 'find_unused_ip')
+
+    def run(self, name, iterations, warmup=5, concurrency=1):
+        """
+        Run a scenario.
+        :param name:
+        :param iterations: number of measured calls
+        :param warmup: number of calls before measuring
+        :param concurrency: number of threads making calls
+        :return: dict of result, times are in milliseconds
+        """
+        func = getattr(self, name)
+        for _ in range(warmup):
+            func()
+
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+        counter = iter(range(iterations))
+
+        def _worker():
+            while True:
+                with lock:
+                    if next(counter, None) is None:
+                        return
+                started = time.perf_counter()
+                try:
+                    func()
+                    error = None
+                except Exception as e:
+                    error = str(e)
+                finally:
+                    db.session.remove()
+                elapsed = (time.perf_counter() - started) * 1000
+                with lock:
+                    latencies.append(elapsed)
+                    if error:
+                        errors.append(error)
+
+        started = time.perf_counter()
+        if concurrency <= 1:
+            _worker()
+        else:
+            threads = [threading.Thread(target=_worker) for _ in range(concurrency)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+        total = time.perf_counter() - started
+
+        latencies.sort()
+        return {
+            'iterations': len(latencies),
+            'concurrency': concurrency,
+            'errors': len(errors),
+            'first_error': errors[0] if errors else None,
+            'throughput': len(latencies) / total if total else None,
+            'mean_ms': sum(latencies) / len(latencies) if latencies else None,
+            'p50_ms': percentile(latencies, 50),
+            'p90_ms': percentile(latencies, 90),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1] if latencies else None,
+        }
+
+
+def _get_max_id(model_class):
+    return db.session.query(db.func.max(model_class.id)).scalar() or 0
+
+
+def _wait_history_writer(timeout=30):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        stats = history_mgr.get_writer_stats()
+        if stats['written'] + stats['failed'] >= stats['queued']:
+            return
+        time.sleep(history_mgr.history_writer.flush_interval)
+
+
+def run_all(names=None, iterations=200, warmup=5, concurrency=1):
+    """
+    Run scenarios, rows created by them are deleted at the end.
+    :param names: scenario names, default all
+    :param iterations:
+    :param warmup:
+    :param concurrency:
+    :return: dict of scenario name -> result
+    """
+    names = names or Benchmark.SCENARIOS
+    results = {}
+    with app.app_context():
+        max_order_id = _get_max_id(md.Order)
+        max_history_id = _get_max_id(md.History)
+        bench = Benchmark()
+        try:
+            for name in names:
+                result = bench.run(name, iterations=iterations, warmup=warmup, concurrency=concurrency)
+                results[name] = result
+                p('{:<20} {:>8.1f}/s  p50 {:>8.2f}ms  p99 {:>8.2f}ms  errors {}'.format(
+                    name, result['throughput'], result['p50_ms'], result['p99_ms'], result['errors']))
+                if result['first_error']:
+                    p('    ' + result['first_error'])
+        finally:
+            _wait_history_writer()
+            db.session.remove()
+            db.session.query(md.OrderProduct).filter(md.OrderProduct.order_id > max_order_id) \
+                .delete(synchronize_session=False)
+            db.session.query(md.Order).filter(md.Order.id > max_order_id).delete(synchronize_session=False)
+            db.session.query(md.History).filter(md.History.id > max_history_id).delete(synchronize_session=False)
+            db.session.commit()
+    return results
+
+
+def compare(results, baseline, max_regression=0.2):
+    """
+    Compare results with results of a previous run.
+    :param results:
+    :param baseline:
+    :param max_regression: ratio of p50/p99 increase or throughput decrease considered a regression
+    :return: list of regression messages
+    """
+    regressions = []
+    for name, result in results.items():
+        base = baseline.get(name)
+        if not base:
+            continue
+        for key in ('p50_ms', 'p99_ms'):
+            if base.get(key) and result.get(key) and result[key] > base[key] * (1 + max_regression):
+                regressions.append('{} {}: {:.2f} -> {:.2f}'.format(name, key, base[key], result[key]))
+        if (base.get('throughput') and result.get('throughput') and
+                result['throughput'] * (1 + max_regression) < base['throughput']):
+            regressions.append('{} throughput: {:.1f} -> {:.1f}'.format(
+                name, base['throughput'], result['throughput']))
+    return regressions
+
+
+def make_report(results, dataset, **meta):
+    """
+    Make machine-readable report of a run.
+    :param results:
+    :param dataset: dataset sizes
+    :param meta: other run info, e.g. commit
+    :return:
+    """
+    return {
+        'meta': {
+            'time': datetime.datetime.utcnow().isoformat(timespec='seconds') + 'Z',
+            'db': db.engine.dialect.name,
+            'dataset': dataset,
+            **meta,
+        },
+        'results': results,
+    }
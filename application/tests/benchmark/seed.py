@@ -0,0 +1,264 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import ipaddress
+import random
+import time
+
+from werkzeug.security import generate_password_hash
+
+from application import app, db
+from application.dao import init_data
+from application import models as md
+
+LOG = app.logger
+
+# Seeded users are named bench.user.<index>, all with this password
+USER_NAME_PREFIX = 'bench.user.'
+USER_PASSWORD = 'Bench@123'
+
+IP_CONFIG_NAME = 'bench_ip_config'
+IP_POOL_CONFIG = {
+    'version': 4,
+    'pools': [
+        {'name': 'bench_pool1', 'cidr': '10.100.0.0/16'},
+    ],
+}
+# Ratio of pool IPs already assigned
+IP_USED_RATIO = 0.9
+
+INSERT_BATCH_SIZE = 5000
+
+# Seeded data is spread over this period before now
+DATA_PERIOD = datetime.timedelta(days=365)
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+def _count(model_class, *conditions):
+    return db.session.query(db.func.count(model_class.id)).filter(*conditions).scalar()
+
+
+def _bulk_insert(model_class, rows):
+    """
+    Insert rows in batches by Core insert, much faster than ORM objects.
+    :param model_class:
+    :param rows: iterable of dicts
+    :return: number of inserted rows
+    """
+    table = model_class.__table__
+    total = 0
+    batch = []
+    for row in rows:
+        batch.append(row)
+        if len(batch) >= INSERT_BATCH_SIZE:
+            db.session.execute(table.insert(), batch)
+            db.session.commit()
+            total += len(batch)
+            batch = []
+    if batch:
+        db.session.execute(table.insert(), batch)
+        db.session.commit()
+        total += len(batch)
+    return total
+
+
+def _random_date(rnd, now):
+    return now - datetime.timedelta(seconds=rnd.randint(0, int(DATA_PERIOD.total_seconds())))
+
+
+def seed_base_data():
+    """
+    Create configs, regions, products and promotions of dao/init_data if missing.
+    :return:
+    """
+    if db.session.query(md.Product).first() is not None:
+        return
+    init_data.create(config=init_data.CONFIG, regions=init_data.REGIONS,
+                     products=init_data.PRODUCTS, promotions=init_data.PROMOTIONS)
+    p('Created base data of init_data.')
+
+
+def seed_users(count, rnd):
+    """
+    Create bench users up to count.
+    :param count:
+    :param rnd:
+    :return:
+    """
+    existing = _count(md.User, md.User.user_name.like(USER_NAME_PREFIX + '%'))
+    if existing >= count:
+        return
+    # Hashing is slow by design, one hash for all users
+    password_hash = generate_password_hash(USER_PASSWORD)
+    now = datetime.datetime.utcnow()
+    template = init_data.USERS[0]
+
+    def _rows():
+        for i in range(existing, count):
+            yield {
+                'user_name': '{}{}'.format(USER_NAME_PREFIX, i),
+                'email': 'bench.user.{}@bench.foxcloud.vn'.format(i),
+                'role': md.UserRole.USER,
+                'status': md.UserStatus.ENABLED,
+                'password_hash': password_hash,
+                'full_name': 'Bench User {}'.format(i),
+                'language': 'vi',
+                'create_date': _random_date(rnd, now),
+                'data': {'os_info': dict(template['data']['os_info'])},
+            }
+    p('Created {} users.'.format(_bulk_insert(md.User, _rows())))
+
+
+def _get_user_ids():
+    return [id for id, in db.session.query(md.User.id).filter(
+        md.User.user_name.like(USER_NAME_PREFIX + '%'))]
+
+
+def seed_orders(count, rnd):
+    """
+    Create orders of bench users up to count, each order has one product.
+    :param count:
+    :param rnd:
+    :return:
+    """
+    user_ids = _get_user_ids()
+    existing = _count(md.Order, md.Order.user_id.in_(db.session.query(md.User.id).filter(
+        md.User.user_name.like(USER_NAME_PREFIX + '%'))))
+    if existing >= count or not user_ids:
+        return
+    products = db.session.query(md.Product.id, md.Product.region_id, md.Product.type).all()
+    statuses = [md.OrderStatus.COMPLETED] * 6 + [md.OrderStatus.CANCELLED, md.OrderStatus.FAILED,
+                                                 md.OrderStatus.APPROVED, md.OrderStatus.PENDING]
+    now = datetime.datetime.utcnow()
+    max_id = db.session.query(db.func.max(md.Order.id)).scalar() or 0
+
+    order_rows = []
+    product_rows = []
+    for i in range(count - existing):
+        order_id = max_id + i + 1
+        product_id, region_id, product_type = rnd.choice(products)
+        create_date = _random_date(rnd, now)
+        months = rnd.choice((1, 3, 6, 12))
+        price = rnd.choice((100000, 250000, 500000, 1200000)) * months
+        order_rows.append({
+            'id': order_id,
+            'type': md.OrderType.BUY,
+            'product_type': product_type,
+            'code': 'DH%06d' % order_id,
+            'user_id': rnd.choice(user_ids),
+            'price': price,
+            'price_paid': price,
+            'amount': 1,
+            'duration': '{} months'.format(months),
+            'status': rnd.choice(statuses),
+            'create_date': create_date,
+            'start_date': create_date,
+            'end_date': create_date + datetime.timedelta(days=30 * months),
+            'currency': 'VND',
+            'region_id': region_id,
+            'data': {'settings': {'auto_create_compute': True}},
+        })
+        product_rows.append({
+            'order_id': order_id,
+            'product_id': product_id,
+            'price': price,
+            'price_paid': price,
+        })
+    _bulk_insert(md.Order, order_rows)
+    _bulk_insert(md.OrderProduct, product_rows)
+    p('Created {} orders.'.format(len(order_rows)))
+
+
+def seed_histories(count, rnd):
+    """
+    Create history logs of bench users up to count.
+    :param count:
+    :param rnd:
+    :return:
+    """
+    existing = _count(md.History, md.History.type == md.HistoryType.USER)
+    if existing >= count:
+        return
+    user_ids = _get_user_ids()
+    if not user_ids:
+        return
+    actions = (md.HistoryAction.LOGIN, md.HistoryAction.LOGOUT, md.HistoryAction.UPDATE_USER,
+               md.HistoryAction.CREATE_ORDER, md.HistoryAction.UPDATE_ORDER)
+    now = datetime.datetime.utcnow()
+
+    def _rows():
+        for i in range(count - existing):
+            user_id = rnd.choice(user_ids)
+            start_date = _random_date(rnd, now)
+            yield {
+                'type': md.HistoryType.USER,
+                'action': rnd.choice(actions),
+                'target_user_id': user_id,
+                'request_user_id': user_id,
+                'status': md.HistoryStatus.SUCCEEDED,
+                'start_date': start_date,
+                'end_date': start_date + datetime.timedelta(milliseconds=rnd.randint(5, 2000)),
+                'contents': {'request': {'path': '/api/v1/user', 'method': 'PUT'}, 'code': 200},
+            }
+    p('Created {} history logs.'.format(_bulk_insert(md.History, _rows())))
+
+
+def seed_ips():
+    """
+    Create NETWORK_IP config and assigned public IPs.
+    :return:
+    """
+    config = db.session.query(md.Configuration).filter_by(
+        type=md.ConfigurationType.NETWORK_IP, name=IP_CONFIG_NAME).first()
+    if config is None:
+        init_data.create(config=[{
+            'type': md.ConfigurationType.NETWORK_IP,
+            'name': IP_CONFIG_NAME,
+            'version': 10000,
+            'status': 'ENABLED',
+            'contents': IP_POOL_CONFIG,
+        }])
+
+    if db.session.query(md.PublicIP).first() is not None:
+        return
+    net = ipaddress.IPv4Network(IP_POOL_CONFIG['pools'][0]['cidr'])
+    now = datetime.datetime.utcnow()
+    count = int(net.num_addresses * IP_USED_RATIO)
+    rows = ({
+        'addr': str(net[i]),
+        'version': 4,
+        'status': md.IPStatus.ASSIGNED,
+        'create_date': now - datetime.timedelta(seconds=count - i),
+        'start_date': now,
+    } for i in range(count))
+    p('Created {} public IPs.'.format(_bulk_insert(md.PublicIP, rows)))
+
+
+def seed(users=10000, orders=100000, histories=1000000, random_seed=1):
+    """
+    Seed DB with benchmark data, existing seeded data is kept.
+    :param users:
+    :param orders:
+    :param histories:
+    :param random_seed:
+    :return: dataset sizes
+    """
+    started = time.monotonic()
+    rnd = random.Random(random_seed)
+    seed_base_data()
+    seed_users(users, rnd)
+    seed_orders(orders, rnd)
+    seed_histories(histories, rnd)
+    seed_ips()
+    p('Seeding done in {:.1f}s.'.format(time.monotonic() - started))
+    return {
+        'users': _count(md.User),
+        'orders': _count(md.Order),
+        'histories': _count(md.History),
+        'public_ips': db.session.query(db.func.count(md.PublicIP.addr)).scalar(),
+    }
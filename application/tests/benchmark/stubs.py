@@ -0,0 +1,73 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from contextlib import contextmanager
+import threading
+from unittest import mock
+
+from application.product_types.openstack import os_base, os_client_pool
+
+
+class StubResult(object):
+    """
+    Result of a stub call, parsed like foxcloud results.
+    """
+
+    def __init__(self, data=None):
+        self.data = data
+
+    def parse(self, **kwargs):
+        return None, self.data
+
+
+class StubService(object):
+    """
+    OpenStack service of the stub client, all calls succeed with empty data.
+    """
+
+    def __init__(self, client, name):
+        self._client = client
+        self._name = name
+
+    def __getattr__(self, attr):
+        def _call(*args, **kwargs):
+            self._client.add_call('{}.{}'.format(self._name, attr))
+            return StubResult([] if attr.startswith(('get_', 'list_')) and attr.endswith('s') else {})
+        return _call
+
+
+class StubClient(object):
+    """
+    Replacement of foxcloud Client, so benchmarks never call a real cloud.
+    """
+    calls = {}
+    _lock = threading.Lock()
+
+    def __init__(self, version='1', engine='console', services=None, **kwargs):
+        self.engine = engine
+        self.services = services
+        self.session = None
+
+    def __getattr__(self, attr):
+        return StubService(self, attr)
+
+    @classmethod
+    def add_call(cls, name):
+        with cls._lock:
+            cls.calls[name] = cls.calls.get(name, 0) + 1
+
+
+@contextmanager
+def stub_os_client():
+    """
+    Use StubClient for OpenStack API clients in the block.
+    :return:
+    """
+    os_client_pool.clear()
+    StubClient.calls = {}
+    with mock.patch.object(os_base.fox_client, 'Client', StubClient):
+        try:
+            yield StubClient
+        finally:
+            os_client_pool.clear()
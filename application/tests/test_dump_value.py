@@ -0,0 +1,57 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import timeit
+
+from application import app, db
+from application import models as md
+from application.utils import data_util, date_util
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+def make_rows(count=1000):
+    now = date_util.utc_now()
+    orders = [md.Order(id=i, type=md.OrderType.BUY, product_type=md.ProductType.COMPUTE,
+                       code='ORD-{}'.format(i), name='order {}'.format(i), user_id=1, group_id=i,
+                       price=100000, price_paid=100000, amount=1, duration='1 month',
+                       status=md.OrderStatus.COMPLETED, create_date=now, start_date=now, end_date=now,
+                       currency='VND', region_id='VN_HN',
+                       data={'info': {'cpu': 2, 'mem': 4}, 'settings': {'os': 'ubuntu'}},
+                       notes='', extra={})
+              for i in range(count)]
+    computes = [md.Compute(id=i, type=md.ComputeType.VM, name='vm-{}'.format(i), version=1,
+                           user_id=1, order_id=i, backend_id='server-{}'.format(i),
+                           backend_status='ACTIVE', public_ip='10.0.0.1', description='',
+                           create_date=now, end_date=now, status=md.ComputeStatus.ENABLED,
+                           region_id='VN_HN', data={'os_info': {'cluster': 'cas-hn-1'}}, extra={})
+                for i in range(count)]
+    histories = [md.History(id=i, type=md.HistoryType.USER, action=md.HistoryAction.CREATE_ORDER,
+                            target_user_id=1, request_user_id=1, status=md.HistoryStatus.SUCCEEDED,
+                            start_date=now, end_date=now,
+                            contents={'order_id': i, 'products': [{'id': 1, 'amount': 1}]}, extra={})
+                 for i in range(count)]
+    return {'Order': orders, 'Compute': computes, 'History': histories}
+
+
+def dump_rows(rows, compiled):
+    return [data_util.dump_value(row, compiled=compiled) for row in rows]
+
+
+def do_test(count=1000, repeat=5):
+    for name, rows in make_rows(count).items():
+        # Both paths must produce the same result
+        assert dump_rows(rows, compiled=True) == dump_rows(rows, compiled=False)
+
+        recursive = min(timeit.repeat(lambda: dump_rows(rows, compiled=False), number=1, repeat=repeat))
+        compiled = min(timeit.repeat(lambda: dump_rows(rows, compiled=True), number=1, repeat=repeat))
+        p('{}: {} rows, recursive {:.2f} ms, compiled {:.2f} ms, speedup x{:.1f}'.format(
+            name, count, recursive * 1000, compiled * 1000, recursive / compiled))
+    p('Dump plan cache:', data_util.get_dump_plan.cache_info())
+
+
+if __name__ == '__main__':
+    do_test()
@@ -0,0 +1,69 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import time
+
+import application
+from application import app, db
+from application.api.v1 import base as api_base
+from application.base import context
+from application.managers import history_mgr
+from application import models as md
+from application.utils import date_util
+
+TEST_TASK = 'test history writer'
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+def _noop(ctx):
+    ctx.response = {}
+
+
+def run_logged_calls(count):
+    """
+    Call exec_manager_func_with_log count times.
+    :param count:
+    :return: calls per second
+    """
+    started = time.monotonic()
+    for i in range(count):
+        ctx = context.create_admin_context(task=TEST_TASK, data={'index': i})
+        api_base.exec_manager_func_with_log(_noop, ctx, action=md.HistoryAction.LOGIN)
+    return count / (time.monotonic() - started)
+
+
+def do_test(count=500):
+    with app.test_request_context():
+        writer = history_mgr.history_writer
+        test_started = date_util.utc_now()
+
+        history_mgr.HISTORY_WRITER_MODE = 'sync'
+        sync_rate = run_logged_calls(count)
+
+        history_mgr.HISTORY_WRITER_MODE = 'async'
+        written = writer.stats['written']
+        async_rate = run_logged_calls(count)
+        # Wait for the writer to flush
+        deadline = time.monotonic() + 10
+        while writer.stats['written'] + writer.stats['failed'] < written + count:
+            assert time.monotonic() < deadline, 'History writer did not flush in time'
+            time.sleep(writer.flush_interval)
+        assert writer.stats['failed'] == 0
+
+        p('exec_manager_func_with_log: sync {:.0f} calls/s, async {:.0f} calls/s'
+          .format(sync_rate, async_rate))
+        p('History writer: {}'.format(writer.get_stats()))
+
+        # Clean up test logs
+        md.query(md.History, md.History.start_date >= test_started,
+                 action=md.HistoryAction.LOGIN,
+                 request_user_id=application.admin.id).delete(synchronize_session=False)
+        db.session.commit()
+
+
+if __name__ == '__main__':
+    do_test()
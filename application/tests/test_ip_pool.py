@@ -0,0 +1,98 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import ipaddress
+import random
+import timeit
+
+from application import app
+from application.utils import ip_pool_util
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+POOL_CONFIG = {
+    'version': 4,
+    'pools': [
+        {'name': 'pool1', 'cidr': '10.0.0.0/16'},
+        {'name': 'pool2', 'cidr': ['10.2.0.0/24', '10.3.0.0/24']},
+    ],
+}
+
+
+def naive_find_free(used, count):
+    """
+    Find free IPs by iterating pool addresses like the old implementation.
+    """
+    result = []
+    for pool in POOL_CONFIG['pools']:
+        cidr_list = pool['cidr']
+        if isinstance(cidr_list, str):
+            cidr_list = [cidr_list]
+        for cidr in cidr_list:
+            for ip in ipaddress.IPv4Network(cidr):
+                if str(ip) not in used:
+                    result.append(str(ip))
+                    if len(result) >= count:
+                        return result
+    return result
+
+
+def do_test(used_ratio=0.9, repeat=5):
+    index = ip_pool_util.IPPoolIndex(POOL_CONFIG)
+    assert index.total == 65536 + 512
+
+    # Pool lookup
+    assert index.get_pool('10.0.255.255')['name'] == 'pool1'
+    assert index.get_pool('10.3.0.1')['name'] == 'pool2'
+    assert index.get_pool('10.1.0.1') is None
+    assert index.get_pool('9.255.255.255') is None
+
+    # Mark most of /16 as used, in the order IPs are usually assigned
+    net = ipaddress.IPv4Network('10.0.0.0/16')
+    used_count = int(net.num_addresses * used_ratio)
+    used = set()
+    for i in range(used_count):
+        used.add(str(net[i]))
+        index.set_used(net[i])
+    # Some released IPs
+    for i in random.sample(range(used_count), 100):
+        used.discard(str(net[i]))
+        index.set_used(net[i], used=False)
+    assert index.stats()['used'] == len(used)
+
+    expected = naive_find_free(used, 5)
+    index.cursor = (0, 0)
+    assert index.find_free(5) == expected
+    assert index.find_free(5) != expected  # cursor moved forward
+
+    # Wrap around all ranges
+    full = ip_pool_util.IPPoolIndex({'version': 4, 'pools': [{'cidr': '10.0.0.0/30'}]})
+    full.set_cursor('10.0.0.2')
+    assert full.find_free(4) == ['10.0.0.2', '10.0.0.3', '10.0.0.0', '10.0.0.1']
+    for i in range(4):
+        full.set_used(ipaddress.IPv4Address('10.0.0.0') + i)
+    assert full.find_free(1) == []
+
+    def indexed():
+        index.cursor = (0, 0)
+        index.find_free(5)
+
+    def lookup():
+        for ip in ('10.0.1.1', '10.3.0.7', '10.1.0.1'):
+            index.get_pool(ip)
+
+    naive = min(timeit.repeat(lambda: naive_find_free(used, 5), number=1, repeat=repeat))
+    fast = min(timeit.repeat(indexed, number=1, repeat=repeat))
+    p('Find 5 free IPs in /16 pool ({:.0%} used): naive {:.2f}ms, indexed {:.3f}ms, speedup x{:.0f}'.format(
+        used_ratio, naive * 1000, fast * 1000, naive / fast))
+    t = min(timeit.repeat(lookup, number=1000, repeat=repeat)) / 3000
+    p('Pool lookup: {:.2f}us per IP'.format(t * 1e6))
+    p('Index:', index.stats())
+
+
+if __name__ == '__main__':
+    do_test()
@@ -0,0 +1,90 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from datetime import datetime, timedelta
+import json
+import time
+
+from flask import json as flask_json
+
+from application import app
+from application.base import common
+from application.utils import json_util
+
+ROW_COUNT = 1000
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+class StrftimeJSONEncoder(flask_json.JSONEncoder):
+    """
+    The app encoder before the backends, for comparing.
+    """
+    def default(self, obj):
+        if isinstance(obj, datetime):
+            return obj.strftime(common.DATE_TIME_FORMAT)
+        return super().default(obj)
+
+
+def make_rows(count):
+    """
+    Make rows like the ones of history list.
+    :param count:
+    :return:
+    """
+    now = datetime.utcnow().replace(microsecond=0)
+    return [{
+        'id': i,
+        'type': 'api',
+        'action': 'ORDER_CREATE',
+        'status': 'COMPLETED',
+        'user_id': i % 50,
+        'target_type': 'order',
+        'target_id': i,
+        'target_name': 'Order {}'.format(i),
+        'target_date': None,
+        'start_date': now - timedelta(minutes=i % 60),
+        'end_date': now,
+        'contents': {'request': {'path': '/api/v1/orders', 'method': 'POST'}, 'code': 200},
+        'tags': ['order', 'compute'],
+    } for i in range(count)]
+
+
+def run_encoder(cls, data, count=20):
+    """
+    Encode data count times.
+    :param cls:
+    :param data:
+    :param count:
+    :return: milliseconds per encoding
+    """
+    started = time.monotonic()
+    for _ in range(count):
+        json.dumps(data, cls=cls)
+    return (time.monotonic() - started) / count * 1000
+
+
+def do_test():
+    with app.test_request_context():
+        data = {'data': make_rows(ROW_COUNT), 'has_more': False, 'next_page': None}
+        expected = json.loads(json.dumps(data, cls=StrftimeJSONEncoder))
+
+        p('JSON encoding of {} rows:'.format(ROW_COUNT))
+        p('  strftime encoder: {:.2f} ms'.format(run_encoder(StrftimeJSONEncoder, data)))
+        for name in json_util.BACKENDS:
+            if name == json_util.OrjsonBackend.name and json_util.orjson is None:
+                p('  {} backend: not installed'.format(name))
+                continue
+            json_util.set_backend(name)
+            assert json.loads(json.dumps(data, cls=common.AppJSONEncoder)) == expected
+            p('  {} backend: {:.2f} ms'.format(name, run_encoder(common.AppJSONEncoder, data)))
+        json_util.set_backend()
+
+        p('JSON encoder: {}'.format(json_util.get_stats()))
+
+
+if __name__ == '__main__':
+    do_test()
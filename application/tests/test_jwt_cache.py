@@ -0,0 +1,45 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import timeit
+
+from application import app
+from application.utils import str_util
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+def do_test(count=10000, repeat=5):
+    tokens = [str_util.jwt_encode_token(i, expires_in=600) for i in range(100)]
+    blob = str_util.jwt_encode_token({'cn': 'u1', 'password': '123'})
+
+    # Cached result must be the same as the verified one
+    for i, token in enumerate(tokens):
+        assert str_util.jwt_decode_token(token, use_cache=False) == i
+        assert str_util.jwt_decode_token(token) == i
+        assert str_util.jwt_decode_token(token) == i
+    assert str_util.jwt_decode_token(blob) == str_util.jwt_decode_token(blob, use_cache=False)
+
+    # A token must not be accepted for another key
+    try:
+        str_util.jwt_decode_token(tokens[0], key='another key')
+        assert False, 'token accepted for another key'
+    except Exception:
+        pass
+
+    def decode(use_cache):
+        for i in range(count):
+            str_util.jwt_decode_token(tokens[i % len(tokens)], use_cache=use_cache)
+
+    uncached = min(timeit.repeat(lambda: decode(False), number=1, repeat=repeat))
+    cached = min(timeit.repeat(lambda: decode(True), number=1, repeat=repeat))
+    p('JWT decode: uncached {:.0f} tokens/s, cached {:.0f} tokens/s, speedup x{:.1f}'.format(
+        count / uncached, count / cached, uncached / cached))
+    p('Cache:', str_util.jwt_decode_cache_stats())
+
+
+if __name__ == '__main__':
+    do_test()
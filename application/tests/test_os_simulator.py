@@ -0,0 +1,97 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import time
+
+from application import app
+from application.product_types.openstack import os_api, os_base, os_client_pool, os_simulator
+
+CLUSTER = 'sim-cluster'
+OS_CONFIG = {
+    'region_name': 'RegionOne',
+    'auth': {'username': 'admin', 'project_id': 'admin-project'},
+}
+CALL_LATENCY = 0.05
+SERVER_COUNT = 64
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+def get_client():
+    return os_api.get_os_client(cluster=CLUSTER, os_config=OS_CONFIG, engine=os_simulator.ENGINE)
+
+
+def test_client_reuse(count=100):
+    """
+    Get clients like requests do, they should be created once and reused from pool.
+    :param count:
+    :return:
+    """
+    os_client_pool.clear()
+    started = time.monotonic()
+    clients = {id(get_client()) for _ in range(count)}
+    p('Got {} clients in {:.2f} ms, {} created'.format(count, (time.monotonic() - started) * 1000,
+                                                      len(clients)))
+    p('  pool: {}'.format(os_client_pool.get_stats()))
+
+
+def test_fan_out():
+    """
+    Get servers one by one, then concurrently by fan_out.
+    :return:
+    """
+    client = get_client()
+    err, servers = client.get_servers(limit=SERVER_COUNT)
+    assert not err, err
+    server_ids = [s['id'] for s in servers]
+
+    started = time.monotonic()
+    for server_id in server_ids:
+        err, _ = client.get_server(server_id)
+        assert not err, err
+    sequential = time.monotonic() - started
+
+    started = time.monotonic()
+    err, result = os_base.fan_out(client.get_server, server_ids)
+    concurrent = time.monotonic() - started
+    assert not err, err
+    assert len(result) == len(server_ids)
+
+    p('Get {} servers with {:.0f} ms latency:'.format(len(server_ids), CALL_LATENCY * 1000))
+    p('  sequential: {:.2f} s'.format(sequential))
+    p('  fan_out ({} workers): {:.2f} s, speedup {:.1f}x'.format(
+        os_base.FAN_OUT_MAX_WORKERS, concurrent, sequential / concurrent))
+
+
+def test_errors(count=200, error_rate=0.1):
+    """
+    Check injected errors are returned like cloud errors.
+    :param count:
+    :param error_rate:
+    :return:
+    """
+    os_simulator.configure(latency=0, latency_jitter=0,
+                           calls={'shade.get_server': {'error_rate': error_rate}})
+    client = get_client()
+    _, servers = client.get_servers(limit=1)
+    failed = sum(1 for _ in range(count) if client.get_server(servers[0]['id'])[0])
+    p('Injected errors: {} of {} calls, rate {}'.format(failed, count, error_rate))
+
+
+def do_test():
+    with app.app_context():
+        os_simulator.configure(latency=CALL_LATENCY, latency_jitter=0, error_rate=0, calls={},
+                               dataset={'server': SERVER_COUNT})
+        test_client_reuse()
+        test_fan_out()
+        test_errors()
+        p('Simulator calls: {}'.format(os_simulator.get_stats()))
+        os_simulator.reset()
+        os_client_pool.clear()
+
+
+if __name__ == '__main__':
+    do_test()
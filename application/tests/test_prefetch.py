@@ -0,0 +1,67 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from sqlalchemy import event
+
+from application import app, db
+from application.base import context
+from application.managers import base as base_mgr
+from application import models as md
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+class QueryCounter(object):
+    """
+    Count SQL statements executed on the engine.
+    """
+    def __init__(self):
+        self.count = 0
+
+    def _on_execute(self, conn, cursor, statement, parameters, ctx, executemany):
+        self.count += 1
+
+    def __enter__(self):
+        event.listen(db.engine, 'before_cursor_execute', self._on_execute)
+        return self
+
+    def __exit__(self, *a):
+        event.remove(db.engine, 'before_cursor_execute', self._on_execute)
+
+
+def dump_page(model_class, extra_fields, page_size):
+    ctx = context.create_admin_context(task='test prefetch', data={
+        'page': 1,
+        'page_size': page_size,
+        'extra_fields': extra_fields,
+    })
+    db.session.expire_all()
+    with QueryCounter() as counter:
+        base_mgr.dump_objects(ctx, model_class=model_class)
+    assert ctx.succeed, ctx.error
+    return len(ctx.response['data']), counter.count
+
+
+def do_test():
+    with app.test_request_context():
+        cases = [
+            (md.Order, ['order_products', 'order_group'], 2),
+            (md.Compute, ['order_group', 'order_products'], 2),
+            (md.History, ['request_user', 'target_user'], 1),
+        ]
+        for model_class, extra_fields, max_queries in cases:
+            count_small, queries_small = dump_page(model_class, extra_fields, page_size=10)
+            count_big, queries_big = dump_page(model_class, extra_fields, page_size=1000)
+            p('{}: {} items -> {} queries, {} items -> {} queries'.format(
+                model_class.__name__, count_small, queries_small, count_big, queries_big))
+            # Number of queries must not depend on number of items
+            assert queries_small == queries_big
+            # COUNT query of paginate() + page query + one query per one-to-many level
+            assert queries_big <= max_queries + 1
+
+
+if __name__ == '__main__':
+    do_test()
@@ -0,0 +1,131 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import functools
+import threading
+import time
+import types
+
+from application import app
+from application import models as md
+from application import product_types
+from application.base import context
+from application.managers import queue_mgr
+from application.product_types.openstack import os_api, os_simulator
+
+TASK_COUNT = 200
+TEST_QUEUE = 'test'
+TEST_TASK = 'test_task'
+SIM_CLUSTER = 'sim-cluster'
+SIM_OS_CONFIG = {
+    'region_name': 'RegionOne',
+    'auth': {'username': 'admin', 'password': 'secret', 'project_id': 'admin-project'},
+}
+
+
+def p(*a, **kw):
+    print(*a, **kw)
+
+
+class TaskCounter(object):
+    """
+    Handler of test tasks, a task fails in its first attempt if asked.
+    """
+
+    def __init__(self, count):
+        self.count = count
+        self.done = set()
+        self.runs = 0
+        self.lock = threading.Lock()
+        self.finished = threading.Event()
+
+    def __call__(self, task):
+        with self.lock:
+            self.runs += 1
+        if task.data.get('fail_once') and task.attempts == 1:
+            raise ValueError('Failed in first attempt.')
+        with self.lock:
+            self.done.add(task.data['index'])
+            if len(self.done) >= self.count:
+                self.finished.set()
+
+
+def test_throughput():
+    """
+    Run test tasks by a worker, some of them fail once and are retried.
+    :return:
+    """
+    counter = TaskCounter(TASK_COUNT)
+    queue_mgr.register_handler(TEST_TASK, counter)
+
+    started = time.monotonic()
+    for i in range(TASK_COUNT):
+        queue_mgr.enqueue(TEST_TASK, {'index': i, 'fail_once': i % 50 == 0}, queue=TEST_QUEUE, delay=0)
+    p('Enqueued {} tasks in {:.2f} s'.format(TASK_COUNT, time.monotonic() - started))
+
+    # Retry backoff is shortened, so failed tasks are retried quickly
+    queue_mgr.RETRY_BACKOFF = 0.1
+    worker = queue_mgr.Worker(queues=(TEST_QUEUE,), threads=8, poll_interval=0.05)
+    thread = threading.Thread(target=worker.run)
+    started = time.monotonic()
+    thread.start()
+    finished = counter.finished.wait(60)
+    elapsed = time.monotonic() - started
+    worker.stop()
+    thread.join()
+
+    assert finished, 'Only {} of {} tasks done.'.format(len(counter.done), TASK_COUNT)
+    p('Ran {} tasks ({} runs with retries) in {:.2f} s, {:.1f} tasks/s'.format(
+        TASK_COUNT, counter.runs, elapsed, TASK_COUNT / elapsed))
+
+
+def test_client_func_task():
+    """
+    Run an OpenStack client call by method 'mq' end-to-end: the call is queued by
+    execute_client_func(), run by a worker against the simulator, then its result
+    is passed to the product type callback.
+    :return:
+    """
+    os_simulator.configure(latency=0, latency_jitter=0, error_rate=0)
+    client = os_api.get_os_client(cluster=SIM_CLUSTER, os_config=SIM_OS_CONFIG, engine=os_simulator.ENGINE)
+    prod_type = product_types.PRODUCT_TYPES[md.ProductType.KEY_PAIR]
+
+    results = []
+    finished = threading.Event()
+
+    def on_test_result(self, ctx, result):
+        results.append(result)
+        finished.set()
+
+    # Callbacks are found by name on the product type, as on_*_result methods are
+    prod_type.on_test_result = types.MethodType(on_test_result, prod_type)
+    ctx = context.Context(task='test client func task', data={})
+    prod_type.execute_client_func(ctx, func=functools.partial(client.get_servers, limit=5),
+                                  on_result=prod_type.on_test_result, method='mq',
+                                  callback=prod_type.make_task_callback(prod_type.on_test_result))
+    assert not ctx.failed and ctx.status == 202, ctx.error
+
+    worker = queue_mgr.Worker(threads=1, poll_interval=0.05)
+    thread = threading.Thread(target=worker.run)
+    thread.start()
+    done = finished.wait(queue_mgr.START_DELAY + 30)
+    worker.stop()
+    thread.join()
+    del prod_type.on_test_result
+
+    assert done, 'Client func task not finished.'
+    err, servers = results[0]
+    assert not err, err
+    assert len(servers) == 5, servers
+    p('Client func task got {} servers from simulator'.format(len(servers)))
+
+
+def do_test():
+    with app.app_context():
+        test_throughput()
+        test_client_func_task()
+        p('Task queue: {}'.format(queue_mgr.get_stats()))
+
+if __name__ == '__main__':
+    do_test()
@@ -0,0 +1,124 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from collections import OrderedDict
+import threading
+import time
+
+from application import app
+
+LOG = app.logger
+
+
+class TTLCache(object):
+    """
+    A thread-safe in-process cache with limited size (LRU eviction) and
+    time-to-live of items.
+    """
+    def __init__(self, max_size=1000, ttl=60):
+        """
+        Create cache.
+        :param max_size: max number of items, least recently used items are evicted first
+        :param ttl: default time-to-live of items in seconds
+        """
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._items = OrderedDict()  # key -> (expire_at, value)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        """
+        Get item value from cache.
+        :param key:
+        :param default: value to return if item not found or expired
+        :return:
+        """
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                self.misses += 1
+                return default
+            expire_at, value = item
+            if expire_at is not None and expire_at <= time.time():
+                del self._items[key]
+                self.misses += 1
+                return default
+            self._items.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def set(self, key, value, ttl=None, expire_at=None):
+        """
+        Put item to cache.
+        :param key:
+        :param value:
+        :param ttl: time-to-live in seconds, default is self.ttl
+        :param expire_at: timestamp (seconds since epoch) the item expires,
+            item will expire at the earlier of expire_at and ttl.
+        :return:
+        """
+        ttl = self.ttl if ttl is None else ttl
+        item_expire_at = time.time() + ttl if ttl is not None else None
+        if expire_at is not None:
+            item_expire_at = min(item_expire_at, expire_at) if item_expire_at is not None else expire_at
+
+        with self._lock:
+            self._items[key] = (item_expire_at, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_size:
+                self._items.popitem(last=False)
+                self.evictions += 1
+
+    def pop(self, key, default=None):
+        """
+        Remove item from cache.
+        :param key:
+        :param default:
+        :return:
+        """
+        with self._lock:
+            item = self._items.pop(key, None)
+        return item[1] if item is not None else default
+
+    def remove_if(self, func):
+        """
+        Remove all items satisfying a condition.
+        :param func: function(key, value) returns True to remove the item
+        :return: number of items removed
+        """
+        with self._lock:
+            keys = [k for k, (_, v) in self._items.items() if func(k, v)]
+            for k in keys:
+                del self._items[k]
+        return len(keys)
+
+    def clear(self):
+        """
+        Clear all items.
+        :return:
+        """
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self):
+        return len(self._items)
+
+    def stats(self):
+        """
+        Get cache statistics.
+        :return:
+        """
+        total = self.hits + self.misses
+        return {
+            'size': len(self._items),
+            'max_size': self.max_size,
+            'ttl': self.ttl,
+            'hits': self.hits,
+            'misses': self.misses,
+            'evictions': self.evictions,
+            'hit_ratio': (self.hits / total) if total else None,
+        }
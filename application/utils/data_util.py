@@ -6,12 +6,17 @@ import inspect
 import re
 from marshmallow import ValidationError, validate
 
-from functools import wraps
+from functools import lru_cache, wraps
+
+from sqlalchemy import inspect as sa_inspect, types as sa_types
 
 from application import app, db
 
 LOG = app.logger
 
+# Max number of cached dump plans (model class, fields, extra fields, is_admin)
+DUMP_PLAN_CACHE_SIZE = 512
+
 
 def merge_dicts(source, *args, create_new=True, deep=False):
     """
@@ -85,13 +90,14 @@ def no_null_item_list(list):
     return [v for v in list if v is not None]
 
 
-def dump_value(value, fields=None, extra_fields=None, is_admin=False):
+def dump_value(value, fields=None, extra_fields=None, is_admin=False, compiled=True):
     """
     Dump object contents.
     :param value:
     :param fields:
     :param extra_fields:
     :param is_admin:
+    :param compiled: use compiled dump plans for model objects (see dump_model())
     :return:
     """
     if not value:
@@ -101,6 +107,9 @@ def dump_value(value, fields=None, extra_fields=None, is_admin=False):
     dump_types = (db_model, dict, list, tuple)
     if isinstance(value, dump_types):
         if isinstance(value, db_model):
+            if compiled:
+                return dump_model(value, fields=fields, extra_fields=extra_fields, is_admin=is_admin)
+
             dump_data = {}
             if fields is None:
                 fields = value.__class__.__admin_fields__ if is_admin else value.__class__.__user_fields__
@@ -110,13 +119,15 @@ def dump_value(value, fields=None, extra_fields=None, is_admin=False):
             for attr in fields:
                 attr_value = value.get_attr(attr, None)
                 ex_fields = extra_fields
-                dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin)
+                dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin,
+                                             compiled=compiled)
 
             for attr in extra_fields:
                 if hasattr(value, attr):
                     attr_value = value.get_attr(attr)
                     ex_fields = [f for f in extra_fields if f != attr]
-                    dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin)
+                    dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin,
+                                                 compiled=compiled)
 
         elif isinstance(value, dict):
             dump_data = {}
@@ -126,18 +137,21 @@ def dump_value(value, fields=None, extra_fields=None, is_admin=False):
             for key, item in value.items():
                 if fields is None or key in fields:
                     ex_fields = extra_fields
-                    dump_data[key] = dump_value(item, extra_fields=ex_fields, is_admin=is_admin)
+                    dump_data[key] = dump_value(item, extra_fields=ex_fields, is_admin=is_admin,
+                                                compiled=compiled)
 
             for attr in extra_fields:
                 if attr in value:
                     ex_fields = [f for f in extra_fields if f != attr]
-                    dump_data[attr] = dump_value(value[attr], extra_fields=ex_fields, is_admin=is_admin)
+                    dump_data[attr] = dump_value(value[attr], extra_fields=ex_fields, is_admin=is_admin,
+                                                 compiled=compiled)
 
         else:  # list/tuple
             dump_data = []
             for item in value:
                 ex_fields = extra_fields
-                dump_data.append(dump_value(item, extra_fields=ex_fields, is_admin=is_admin))
+                dump_data.append(dump_value(item, extra_fields=ex_fields, is_admin=is_admin,
+                                            compiled=compiled))
 
     else:
         dump_data = value
@@ -145,6 +159,87 @@ def dump_value(value, fields=None, extra_fields=None, is_admin=False):
     return dump_data
 
 
+# Kinds of attributes in a dump plan
+_DUMP_SCALAR = 0    # column with plain value, read directly from instance state
+_DUMP_JSON = 1      # JSON column, need to copy its contents
+_DUMP_OTHER = 2     # relationship, property, ...
+_DUMP_EXTRA = 3     # extra field, may not exist in the object
+_MISSING = object()
+
+
+def dump_model(obj, fields=None, extra_fields=None, is_admin=False):
+    """
+    Dump model object using a compiled dump plan.
+    Result is the same as dump_value() but the plan for the model class and fields
+    is built once and cached, column values are read from the instance state.
+    :param obj:
+    :param fields:
+    :param extra_fields:
+    :param is_admin:
+    :return:
+    """
+    plan = get_dump_plan(obj.__class__,
+                         tuple(fields) if fields is not None else None,
+                         tuple(extra_fields) if extra_fields else (),
+                         is_admin)
+    state = obj.__dict__
+    dump_data = {}
+    for attr, kind, ex_fields in plan:
+        if kind == _DUMP_SCALAR:
+            attr_value = state.get(attr, _MISSING)
+            if attr_value is _MISSING:
+                # Expired or deferred attribute, let SQLAlchemy load it
+                attr_value = getattr(obj, attr, None)
+            dump_data[attr] = attr_value
+        elif kind == _DUMP_JSON:
+            attr_value = state.get(attr, _MISSING)
+            if attr_value is _MISSING:
+                attr_value = getattr(obj, attr, None)
+            dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin)
+        elif kind == _DUMP_OTHER:
+            attr_value = obj.get_attr(attr, None)
+            dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin)
+        else:
+            try:
+                attr_value = obj.get_attr(attr)
+            except AttributeError:
+                continue
+            dump_data[attr] = dump_value(attr_value, extra_fields=ex_fields, is_admin=is_admin)
+    return dump_data
+
+
+@lru_cache(maxsize=DUMP_PLAN_CACHE_SIZE)
+def get_dump_plan(model_class, fields, extra_fields, is_admin):
+    """
+    Build dump plan for a model class.
+    :param model_class:
+    :param fields: tuple of fields or None for default fields
+    :param extra_fields: tuple of extra fields
+    :param is_admin:
+    :return: tuple of (attr, kind, extra fields for dumping the attr value)
+    """
+    if fields is None:
+        fields = model_class.__admin_fields__ if is_admin else model_class.__user_fields__
+
+    columns = {}
+    mapper = sa_inspect(model_class)
+    for column_attr in mapper.column_attrs:
+        column_types = [col.type for col in column_attr.columns]
+        is_json = any(isinstance(t, (sa_types.JSON, sa_types.PickleType)) for t in column_types)
+        columns[column_attr.key] = _DUMP_JSON if is_json else _DUMP_SCALAR
+
+    plan = []
+    ex_fields = list(extra_fields)
+    for attr in fields:
+        plan.append((attr, columns.get(attr, _DUMP_OTHER), ex_fields))
+
+    for attr in extra_fields:
+        ex_fields = [f for f in extra_fields if f != attr]
+        plan.append((attr, _DUMP_EXTRA, ex_fields))
+
+    return tuple(plan)
+
+
 def assign_model_object(model_object, data):
     """
     Copy data from a dict to model object.
@@ -0,0 +1,214 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import bisect
+import ipaddress
+import re
+import threading
+
+from application import app
+
+LOG = app.logger
+
+# Max addresses indexed per CIDR (bitmap of 2^24 addresses takes 2MB)
+MAX_RANGE_SIZE = 1 << 24
+
+_NOT_FULL_BYTE = re.compile(b'[^\xff]')
+
+
+class IPRange(object):
+    """
+    A range of IP addresses as integers with a bitmap of used addresses.
+    """
+    __slots__ = ('start', 'end', 'size', 'pool', 'bitmap', 'used_count')
+
+    def __init__(self, start, end, pool):
+        self.start = start
+        self.end = end  # inclusive
+        self.size = end - start + 1
+        self.pool = pool
+        self.bitmap = bytearray((self.size + 7) // 8)
+        # Bits after the last address are marked as used
+        for offset in range(self.size, len(self.bitmap) * 8):
+            self.bitmap[offset >> 3] |= 1 << (offset & 7)
+        self.used_count = 0
+
+    def is_used(self, offset):
+        return bool(self.bitmap[offset >> 3] & (1 << (offset & 7)))
+
+    def set_used(self, offset, used):
+        mask = 1 << (offset & 7)
+        byte = self.bitmap[offset >> 3]
+        if used and not byte & mask:
+            self.bitmap[offset >> 3] = byte | mask
+            self.used_count += 1
+        elif not used and byte & mask:
+            self.bitmap[offset >> 3] = byte & ~mask
+            self.used_count -= 1
+
+    def find_free(self, offset=0):
+        """
+        Find the first free address offset from the offset.
+        :param offset:
+        :return: None if not found.
+        """
+        if offset >= self.size or self.used_count >= self.size:
+            return None
+        bitmap = self.bitmap
+        byte_index = offset >> 3
+        # Check remaining bits of the first byte
+        byte = bitmap[byte_index]
+        for bit in range(offset & 7, 8):
+            if not byte & (1 << bit):
+                return (byte_index << 3) + bit
+        # Skip full bytes in C speed
+        m = _NOT_FULL_BYTE.search(bitmap, byte_index + 1)
+        if not m:
+            return None
+        byte_index = m.start()
+        byte = bitmap[byte_index]
+        for bit in range(8):
+            if not byte & (1 << bit):
+                found = (byte_index << 3) + bit
+                return found if found < self.size else None
+        return None
+
+
+class IPPoolIndex(object):
+    """
+    Index of IP pools in NETWORK_IP config.
+    Lookup pool of an IP is O(log n) by bisect on range starts,
+    finding free IPs skips full bitmap bytes.
+    """
+
+    def __init__(self, ip_config_contents):
+        self.version = int(ip_config_contents['version'])
+        self.addr_class = getattr(ipaddress, 'IPv{}Address'.format(self.version))
+        net_class = getattr(ipaddress, 'IPv{}Network'.format(self.version))
+
+        ranges = []
+        for pool in ip_config_contents['pools']:
+            cidr_list = pool['cidr']
+            if isinstance(cidr_list, str):
+                cidr_list = [cidr_list]
+            for cidr in cidr_list:
+                net = net_class(cidr)
+                start = int(net[0])
+                size = net.num_addresses
+                if size > MAX_RANGE_SIZE:
+                    LOG.warning('IP pool {} is too large, only first {} addresses are indexed.'
+                                .format(cidr, MAX_RANGE_SIZE))
+                    size = MAX_RANGE_SIZE
+                ranges.append(IPRange(start, start + size - 1, pool))
+
+        ranges.sort(key=lambda r: r.start)
+        self.ranges = ranges
+        self.starts = [r.start for r in ranges]
+        self.total = sum(r.size for r in ranges)
+        # Position to start searching for next free IPs: (range index, offset)
+        self.cursor = (0, 0)
+        self.lock = threading.RLock()
+
+    def _to_int(self, ip):
+        if isinstance(ip, int):
+            return ip
+        if not isinstance(ip, self.addr_class):
+            ip = self.addr_class(str(ip))
+        return int(ip)
+
+    def _locate(self, ip):
+        """
+        Find range and offset of IP.
+        :param ip:
+        :return: (range index, offset) or (None, None) if IP is out of pools.
+        """
+        value = self._to_int(ip)
+        index = bisect.bisect_right(self.starts, value) - 1
+        if index < 0 or value > self.ranges[index].end:
+            return None, None
+        return index, value - self.ranges[index].start
+
+    def get_pool(self, ip):
+        """
+        Get pool config contains the IP.
+        :param ip:
+        :return: None if IP is out of pools.
+        """
+        index, _ = self._locate(ip)
+        return self.ranges[index].pool if index is not None else None
+
+    def is_used(self, ip):
+        index, offset = self._locate(ip)
+        if index is None:
+            return None
+        return self.ranges[index].is_used(offset)
+
+    def set_used(self, ip, used=True):
+        """
+        Mark an IP as used/unused.
+        :param ip:
+        :param used:
+        :return: False if IP is out of pools.
+        """
+        with self.lock:
+            index, offset = self._locate(ip)
+            if index is None:
+                return False
+            self.ranges[index].set_used(offset, used)
+            return True
+
+    def set_cursor(self, ip):
+        """
+        Set position to search for free IPs, e.g. next to the last created IP.
+        :param ip:
+        :return:
+        """
+        with self.lock:
+            index, offset = self._locate(ip)
+            if index is not None:
+                self.cursor = (index, offset)
+
+    def find_free(self, count=1, exclude=None):
+        """
+        Find free IPs from the cursor, wrapping around all pools.
+        IPs are not marked as used, call set_used() when they are assigned.
+        :param count:
+        :param exclude: set of IP strings to skip
+        :return: list of IP strings
+        """
+        result = []
+        with self.lock:
+            num_ranges = len(self.ranges)
+            if not num_ranges:
+                return result
+            start_index, start_offset = self.cursor
+            for i in range(num_ranges + 1):
+                index = (start_index + i) % num_ranges
+                r = self.ranges[index]
+                # Search the first range twice: from cursor to end, then from start to cursor
+                offset = start_offset if i == 0 else 0
+                limit = start_offset if i == num_ranges else r.size
+                while len(result) < count:
+                    offset = r.find_free(offset)
+                    if offset is None or offset >= limit:
+                        break
+                    addr = str(self.addr_class(r.start + offset))
+                    if not exclude or addr not in exclude:
+                        result.append(addr)
+                    offset += 1
+                if len(result) >= count:
+                    self.cursor = (index, offset)
+                    break
+        return result
+
+    def stats(self):
+        with self.lock:
+            used = sum(r.used_count for r in self.ranges)
+        return {
+            'version': self.version,
+            'ranges': len(self.ranges),
+            'total': self.total,
+            'used': used,
+            'free': self.total - used,
+        }
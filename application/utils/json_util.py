@@ -0,0 +1,135 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+from functools import lru_cache
+import json
+import threading
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+from application import app
+
+LOG = app.logger
+
+# Format of datetime values in JSON output, same as common.DATE_TIME_FORMAT
+DATE_TIME_FORMAT = '%Y-%m-%dT%H:%M:%SZ'
+
+
+@lru_cache(maxsize=app.config['JSON_DATETIME_CACHE_SIZE'])
+def _format_naive_datetime(value):
+    # isoformat() is much faster than strftime() and gives the same result
+    return value.isoformat(timespec='seconds') + 'Z'
+
+
+def format_datetime(value):
+    """
+    Format datetime for JSON output. Naive values are cached as list items
+    usually share timestamps (e.g. dates of the same day).
+    :param value:
+    :return:
+    """
+    # Aware values are not cached: equal instants in different zones are equal keys
+    if value.tzinfo is None and value.year >= 1000:
+        return _format_naive_datetime(value)
+    return value.strftime(DATE_TIME_FORMAT)
+
+
+class JSONBackend(object):
+    """
+    JSON encoder backend using the standard json module.
+    """
+    name = 'json'
+
+    def encode(self, encoder, obj):
+        """
+        Encode object to JSON string.
+        :param encoder: json.JSONEncoder object with encoding options
+        :param obj:
+        :return:
+        """
+        return json.JSONEncoder.encode(encoder, obj)
+
+
+class OrjsonBackend(JSONBackend):
+    """
+    JSON encoder backend using orjson if it is installed.
+    Datetime values are passed to encoder `default` to keep the app format.
+    """
+    name = 'orjson'
+
+    def encode(self, encoder, obj):
+        # Pretty printing is only for debugging, leave it to the standard encoder
+        if encoder.indent is not None:
+            return super().encode(encoder, obj)
+
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        if encoder.sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        try:
+            return orjson.dumps(obj, default=encoder.default, option=option).decode('utf-8')
+        except TypeError:
+            # Values orjson does not support, e.g. integers out of 64-bit range
+            return super().encode(encoder, obj)
+
+
+BACKENDS = {
+    JSONBackend.name: JSONBackend,
+    OrjsonBackend.name: OrjsonBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Get JSON encoder backend configured by JSON_ENCODER_BACKEND.
+    With 'auto', the fastest installed backend is used.
+    :return:
+    """
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = app.config['JSON_ENCODER_BACKEND']
+                if name == 'auto':
+                    name = OrjsonBackend.name if orjson is not None else JSONBackend.name
+                elif name == OrjsonBackend.name and orjson is None:
+                    LOG.warning('JSON encoder backend orjson is not installed, using json.')
+                    name = JSONBackend.name
+                _backend = BACKENDS[name]()
+    return _backend
+
+
+def set_backend(name=None):
+    """
+    Set JSON encoder backend, e.g. for benchmarks.
+    :param name: backend name, None to use the configured backend
+    :return:
+    """
+    global _backend
+
+    with _backend_lock:
+        _backend = BACKENDS[name]() if name else None
+
+
+def get_stats():
+    """
+    Get JSON encoder backend and datetime cache info.
+    :return:
+    """
+    info = _format_naive_datetime.cache_info()
+    return {
+        'backend': get_backend().name,
+        'datetime_cache': {
+            'hits': info.hits,
+            'misses': info.misses,
+            'size': info.currsize,
+            'max_size': info.maxsize,
+        },
+    }
@@ -0,0 +1,390 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import hashlib
+import math
+import re
+import threading
+import time
+
+from sqlalchemy import and_, exc as sa_exc, text
+
+from application import app, db
+from application import models as md
+from application.utils import perf_util
+
+LOG = app.logger
+
+# Poll interval of the table backend starts from this and doubles up to check_interval
+TABLE_POLL_MIN_INTERVAL = 0.05
+
+# Parts of lock ids that are removed to group metrics, e.g. user ids, IP addresses
+_METRIC_KEY_PATTERN = re.compile(r'[0-9][0-9a-fA-F.:]*')
+
+
+class TableLockBackend(object):
+    """
+    Lock by a row in `lock` table. Contended locks are polled.
+    It works on all databases (e.g. SQLite in tests).
+    """
+    name = 'table'
+
+    def _try_acquire(self, id, timeout):
+        table = md.Lock.__table__
+        # Second precision to be comparable with DB DateTime value
+        now = datetime.datetime.utcnow().replace(microsecond=0)
+        if timeout is not None:
+            # Stale lock recovery: remove the lock if it is held longer than timeout
+            with db.engine.begin() as conn:
+                result = conn.execute(table.delete().where(and_(
+                    table.c.id == id,
+                    table.c.timestamp < now - datetime.timedelta(seconds=timeout))))
+                if result.rowcount:
+                    LOG.warning('Stale lock {} removed.'.format(id))
+        try:
+            with db.engine.begin() as conn:
+                conn.execute(table.insert().values(id=id, timestamp=now))
+        except sa_exc.IntegrityError:
+            return None
+        return now
+
+    def acquire(self, id, timeout=None, wait_timeout=0, check_interval=1):
+        """
+        Acquire lock.
+        :param id:
+        :param timeout: consider the lock stale after this time in seconds
+        :param wait_timeout: max time in seconds to wait for the lock
+        :param check_interval: max interval in seconds to check the lock when waiting
+        :return: lock token or None if failed.
+        """
+        deadline = time.monotonic() + (wait_timeout or 0)
+        interval = TABLE_POLL_MIN_INTERVAL
+        while True:
+            token = self._try_acquire(id, timeout=timeout)
+            if token is not None:
+                return token
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                return None
+            time.sleep(min(interval, remaining))
+            interval = min(interval * 2, check_interval or 1)
+
+    def release(self, id, token):
+        """
+        Release lock.
+        :param id:
+        :param token:
+        :return: True if succeeded.
+        """
+        table = md.Lock.__table__
+        with db.engine.begin() as conn:
+            result = conn.execute(table.delete().where(and_(table.c.id == id,
+                                                            table.c.timestamp == token)))
+        if result.rowcount != 1:
+            LOG.warning('Lock {} was removed by others before released.'.format(id))
+        return True
+
+
+class AdvisoryLockBackend(object):
+    """
+    Base class of database advisory locks.
+    A lock is bound to a dedicated DB connection, waiting for the lock blocks
+    in DB without polling. If the holder dies, DB drops its connection together
+    with the lock, so locks never stay stale.
+    """
+    name = None
+
+    def _do_acquire(self, conn, id, wait_timeout):
+        raise NotImplementedError()
+
+    def _do_release(self, conn, id):
+        raise NotImplementedError()
+
+    def acquire(self, id, timeout=None, wait_timeout=0, check_interval=None):
+        """
+        Acquire lock.
+        :param id:
+        :param timeout: not used, lock is released by DB when the holder connection is lost
+        :param wait_timeout: max time in seconds to wait for the lock
+        :param check_interval: not used
+        :return: DB connection holding the lock or None if failed.
+        """
+        conn = db.engine.connect()
+        try:
+            if self._do_acquire(conn, id, wait_timeout=wait_timeout or 0):
+                return conn
+        except sa_exc.SQLAlchemyError as e:
+            LOG.debug('Lock {} acquire failed: {}'.format(id, e))
+        conn.close()
+        return None
+
+    def release(self, id, token):
+        """
+        Release lock.
+        :param id:
+        :param token: DB connection holding the lock
+        :return: True if succeeded.
+        """
+        conn = token
+        try:
+            released = self._do_release(conn, id)
+        except sa_exc.SQLAlchemyError as e:
+            LOG.error('Lock {} release failed: {}'.format(id, e))
+            released = False
+
+        if released:
+            conn.close()
+            return True
+
+        # Drop the connection instead of returning it to the pool, so DB frees the lock
+        LOG.warning('Lock {} not released, closing its DB connection.'.format(id))
+        conn.invalidate()
+        conn.close()
+        return False
+
+
+class MySQLLockBackend(AdvisoryLockBackend):
+    """
+    Lock by MySQL GET_LOCK()/RELEASE_LOCK().
+    """
+    name = 'mysql'
+
+    # Max length of lock name in MySQL
+    MAX_NAME_LENGTH = 64
+
+    def _lock_name(self, id):
+        name = 'cas:' + id
+        if len(name) > self.MAX_NAME_LENGTH:
+            name = 'cas:' + hashlib.sha1(id.encode('utf-8')).hexdigest()
+        return name
+
+    def _do_acquire(self, conn, id, wait_timeout):
+        result = conn.execute(text('SELECT GET_LOCK(:name, :timeout)'),
+                              name=self._lock_name(id),
+                              timeout=int(math.ceil(wait_timeout))).scalar()
+        return result == 1
+
+    def _do_release(self, conn, id):
+        result = conn.execute(text('SELECT RELEASE_LOCK(:name)'),
+                              name=self._lock_name(id)).scalar()
+        return result == 1
+
+
+class PostgresLockBackend(AdvisoryLockBackend):
+    """
+    Lock by PostgreSQL pg_advisory_lock()/pg_advisory_unlock().
+    """
+    name = 'postgresql'
+
+    def _lock_key(self, id):
+        digest = hashlib.sha1(id.encode('utf-8')).digest()
+        return int.from_bytes(digest[:8], 'big', signed=True)
+
+    def _do_acquire(self, conn, id, wait_timeout):
+        key = self._lock_key(id)
+        if wait_timeout <= 0:
+            return bool(conn.execute(text('SELECT pg_try_advisory_lock(:key)'), key=key).scalar())
+
+        # Session lock is kept after the transaction, lock_timeout is reset with it
+        try:
+            with conn.begin():
+                conn.execute(text("SET LOCAL lock_timeout = '{}ms'".format(int(wait_timeout * 1000))))
+                conn.execute(text('SELECT pg_advisory_lock(:key)'), key=key)
+        except sa_exc.OperationalError:
+            # lock_timeout exceeded
+            return False
+        return True
+
+    def _do_release(self, conn, id):
+        return bool(conn.execute(text('SELECT pg_advisory_unlock(:key)'),
+                                 key=self._lock_key(id)).scalar())
+
+
+BACKENDS = {
+    TableLockBackend.name: TableLockBackend,
+    MySQLLockBackend.name: MySQLLockBackend,
+    PostgresLockBackend.name: PostgresLockBackend,
+}
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Get lock backend configured by DB_LOCK_BACKEND.
+    With 'auto', advisory locks are used if the database supports them.
+    :return:
+    """
+    global _backend
+
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                name = app.config['DB_LOCK_BACKEND']
+                if name == 'auto':
+                    name = db.engine.dialect.name
+                    if name not in BACKENDS:
+                        name = TableLockBackend.name
+                _backend = BACKENDS[name]()
+                LOG.info('Using lock backend: {}'.format(_backend.name))
+    return _backend
+
+
+class LockStats(object):
+    """
+    Wait and hold time of locks grouped by lock id pattern.
+    """
+
+    def __init__(self):
+        self._items = {}
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def get_key(id):
+        return _METRIC_KEY_PATTERN.sub('*', id)
+
+    def _get_item(self, key):
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = {
+                'acquired': 0,
+                'failed': 0,
+                'contended': 0,
+                'wait_time': 0.0,
+                'wait_time_max': 0.0,
+                'hold_time': 0.0,
+                'hold_time_max': 0.0,
+            }
+        return item
+
+    def add_wait(self, id, wait_time, acquired, contended):
+        with self._lock:
+            item = self._get_item(self.get_key(id))
+            item['acquired' if acquired else 'failed'] += 1
+            if contended:
+                item['contended'] += 1
+            item['wait_time'] += wait_time
+            item['wait_time_max'] = max(item['wait_time_max'], wait_time)
+
+    def add_hold(self, id, hold_time):
+        with self._lock:
+            item = self._get_item(self.get_key(id))
+            item['hold_time'] += hold_time
+            item['hold_time_max'] = max(item['hold_time_max'], hold_time)
+
+    def get(self):
+        with self._lock:
+            return {key: dict(item) for key, item in self._items.items()}
+
+
+lock_stats = LockStats()
+
+# Process-local locks: lock id -> [threading.Lock, number of users]
+_local_locks = {}
+_local_locks_lock = threading.Lock()
+
+
+def _get_local_lock(id):
+    with _local_locks_lock:
+        item = _local_locks.get(id)
+        if item is None:
+            item = _local_locks[id] = [threading.Lock(), 0]
+        item[1] += 1
+        return item[0]
+
+
+def _put_local_lock(id):
+    with _local_locks_lock:
+        item = _local_locks[id]
+        item[1] -= 1
+        if item[1] <= 0:
+            del _local_locks[id]
+
+
+class Lock(object):
+    """
+    An acquired lock.
+    """
+
+    def __init__(self, id, backend, token, local_lock):
+        self.id = id
+        self.backend = backend
+        self.token = token
+        self.local_lock = local_lock
+        self.acquired_at = time.monotonic()
+
+    def release(self):
+        """
+        Release the lock.
+        :return: True if succeeded.
+        """
+        try:
+            released = self.backend.release(self.id, self.token)
+        except sa_exc.SQLAlchemyError as e:
+            LOG.error('Lock {} release failed: {}'.format(self.id, e))
+            released = False
+        finally:
+            self.local_lock.release()
+            _put_local_lock(self.id)
+            lock_stats.add_hold(self.id, time.monotonic() - self.acquired_at)
+        return released
+
+
+def acquire(id, timeout=None, wait_timeout=None, check_interval=1):
+    """
+    Acquire a lock shared by all processes.
+    Threads of this process wait on a local lock first, so only one of them
+    goes to DB for the lock.
+    :param id: lock id
+    :param timeout: consider the lock stale after this time in seconds (table backend)
+    :param wait_timeout: max time in seconds to wait for the lock, None to not wait
+    :param check_interval: max interval in seconds to check the lock (table backend)
+    :return: Lock object or None if failed.
+    """
+    started = time.monotonic()
+    wait_timeout = wait_timeout or 0
+    local_lock = _get_local_lock(id)
+
+    contended = not local_lock.acquire(blocking=False)
+    if contended and (wait_timeout <= 0 or not local_lock.acquire(timeout=wait_timeout)):
+        _put_local_lock(id)
+        wait_time = time.monotonic() - started
+        lock_stats.add_wait(id, wait_time, acquired=False, contended=True)
+        perf_util.add('lock', wait_time)
+        return None
+
+    backend = get_backend()
+    token = None
+    try:
+        remaining = max(wait_timeout - (time.monotonic() - started), 0)
+        token = backend.acquire(id, timeout=timeout, wait_timeout=remaining,
+                                check_interval=check_interval)
+    except sa_exc.SQLAlchemyError as e:
+        LOG.error('Lock {} acquire failed: {}'.format(id, e))
+    finally:
+        if token is None:
+            local_lock.release()
+            _put_local_lock(id)
+
+    wait_time = time.monotonic() - started
+    # Waiting longer than a poll means another process held the lock
+    contended = contended or wait_time >= TABLE_POLL_MIN_INTERVAL
+    lock_stats.add_wait(id, wait_time, acquired=token is not None, contended=contended)
+    perf_util.add('lock', wait_time)
+    if token is None:
+        return None
+    return Lock(id, backend=backend, token=token, local_lock=local_lock)
+
+
+def get_stats():
+    """
+    Get lock backend and metrics.
+    :return:
+    """
+    return {
+        'backend': get_backend().name,
+        'locks': lock_stats.get(),
+    }
@@ -0,0 +1,329 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import bisect
+from contextlib import contextmanager
+import functools
+import threading
+import time
+
+from flask import g, has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from application import app
+
+LOG = app.logger
+
+PERF_METRICS_ENABLED = app.config['PERF_METRICS_ENABLED']
+PERF_SERVER_TIMING = app.config['PERF_SERVER_TIMING']
+PERF_LATENCY_BUCKETS = tuple(sorted(app.config['PERF_LATENCY_BUCKETS']))
+
+# Metrics of a request, in order of Server-Timing header
+METRICS = {
+    'db': 'Database',
+    'os': 'OpenStack',
+    'lock': 'Lock wait',
+    'manager': 'Manager',
+    'serialize': 'Serialization',
+}
+
+# Metrics bound to the current thread, e.g. in worker threads of a request
+_local = threading.local()
+
+
+class RequestMetrics(object):
+    """
+    Count and time of operations in a request.
+    Times of operations run in parallel threads are summed.
+    """
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.counts = {}
+        self.times = {}
+        self._lock = threading.Lock()
+
+    def add(self, name, duration):
+        with self._lock:
+            self.counts[name] = self.counts.get(name, 0) + 1
+            self.times[name] = self.times.get(name, 0.0) + duration
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def server_timing(self, total):
+        """
+        Make value of Server-Timing header.
+        :param total: request time in seconds
+        :return:
+        """
+        items = []
+        for name, desc in METRICS.items():
+            count = self.counts.get(name)
+            if not count:
+                continue
+            items.append('{};dur={:.1f};desc="{} x{}"'.format(name, self.times[name] * 1000, desc, count))
+        items.append('total;dur={:.1f}'.format(total * 1000))
+        return ', '.join(items)
+
+
+def current_metrics():
+    """
+    Get metrics of the current request.
+    :return: RequestMetrics or None if not in a request or metrics are disabled.
+    """
+    metrics = getattr(_local, 'metrics', None)
+    if metrics is not None:
+        return metrics
+    if has_request_context():
+        return g.get('perf_metrics')
+    return None
+
+
+def add(name, duration):
+    """
+    Add an operation to metrics of the current request.
+    :param name: metric name, see METRICS
+    :param duration: in seconds
+    :return:
+    """
+    metrics = current_metrics()
+    if metrics is not None:
+        metrics.add(name, duration)
+
+
+@contextmanager
+def timer(name):
+    """
+    Time a block of code as an operation of the current request.
+    Usage:
+        with perf_util.timer('manager'):
+            func(ctx)
+    :param name: metric name, see METRICS
+    :return:
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics.add(name, time.perf_counter() - started)
+
+
+def bind_metrics(func):
+    """
+    Wrap function to record its operations in metrics of the current request
+    when it is run by another thread.
+    :param func:
+    :return:
+    """
+    metrics = current_metrics()
+    if metrics is None:
+        return func
+    # Calls nested in a timed call of this thread are not counted again
+    depths = {k: v for k, v in vars(_local).items() if k.startswith('depth_')}
+
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        prev = dict(vars(_local))
+        _local.metrics = metrics
+        vars(_local).update(depths)
+        try:
+            return func(*args, **kwargs)
+        finally:
+            vars(_local).clear()
+            vars(_local).update(prev)
+    return _wrapper
+
+
+def timed_call(name, func):
+    """
+    Wrap function to time its calls as operations of the current request.
+    Nested calls of the same metric (e.g. an API method calling another one) count once.
+    :param name: metric name, see METRICS
+    :param func:
+    :return:
+    """
+    depth_attr = 'depth_' + name
+
+    @functools.wraps(func)
+    def _wrapper(*args, **kwargs):
+        metrics = current_metrics()
+        depth = getattr(_local, depth_attr, 0)
+        if metrics is None or depth:
+            return func(*args, **kwargs)
+        setattr(_local, depth_attr, 1)
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            setattr(_local, depth_attr, 0)
+            metrics.add(name, time.perf_counter() - started)
+    _wrapper.timed_call = name
+    return _wrapper
+
+
+class LatencyHistograms(object):
+    """
+    Latency histograms of endpoints.
+    """
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self._items = {}
+        self._lock = threading.Lock()
+
+    def _get_item(self, key):
+        item = self._items.get(key)
+        if item is None:
+            item = self._items[key] = {
+                'count': 0,
+                'errors': 0,
+                'time': 0.0,
+                'time_max': 0.0,
+                'buckets': [0] * (len(self.buckets) + 1),
+                'metrics': {name: {'count': 0, 'time': 0.0} for name in METRICS},
+            }
+        return item
+
+    def add(self, key, total, status, metrics):
+        """
+        Add a request.
+        :param key: endpoint key
+        :param total: request time in seconds
+        :param status: response status code
+        :param metrics: RequestMetrics of the request
+        :return:
+        """
+        total_ms = total * 1000
+        index = bisect.bisect_left(self.buckets, total_ms)
+        with self._lock:
+            item = self._get_item(key)
+            item['count'] += 1
+            if status >= 500:
+                item['errors'] += 1
+            item['time'] += total_ms
+            item['time_max'] = max(item['time_max'], total_ms)
+            item['buckets'][index] += 1
+            for name, count in metrics.counts.items():
+                metric = item['metrics'].get(name)
+                if metric is not None:
+                    metric['count'] += count
+                    metric['time'] += metrics.times[name] * 1000
+
+    def _percentile(self, buckets, count, percent):
+        # Upper bound of the bucket containing the percentile, None if in the overflow bucket
+        rank = count * percent / 100.0
+        seen = 0
+        for index, bucket_count in enumerate(buckets):
+            seen += bucket_count
+            if seen >= rank:
+                return self.buckets[index] if index < len(self.buckets) else None
+        return None
+
+    def get(self):
+        """
+        Get histograms, times are in milliseconds.
+        :return:
+        """
+        with self._lock:
+            items = {key: dict(item, buckets=list(item['buckets']),
+                               metrics={k: dict(v) for k, v in item['metrics'].items()})
+                     for key, item in self._items.items()}
+
+        result = {}
+        for key, item in items.items():
+            count = item['count']
+            buckets = item.pop('buckets')
+            item['time_avg'] = item['time'] / count
+            for percent in (50, 90, 99):
+                item['p{}'.format(percent)] = self._percentile(buckets, count, percent)
+            item['histogram'] = {
+                ('le_{}'.format(bound) if i < len(self.buckets) else 'inf'): buckets[i]
+                for i, bound in enumerate(self.buckets + (None,))
+            }
+            item['metrics'] = {name: metric for name, metric in item['metrics'].items() if metric['count']}
+            result[key] = item
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+
+latency_histograms = LatencyHistograms(PERF_LATENCY_BUCKETS)
+
+
+def _get_endpoint_key():
+    rule = request.url_rule
+    return '{} {}'.format(request.method, rule.rule if rule is not None else '<unmatched>')
+
+
+def _before_request():
+    g.perf_metrics = RequestMetrics()
+
+
+def _after_request(response):
+    metrics = g.pop('perf_metrics', None)
+    if metrics is None:
+        return response
+    total = metrics.elapsed()
+    # Streaming responses are still being serialized, so their time is up to the first byte
+    if PERF_SERVER_TIMING:
+        response.headers['Server-Timing'] = metrics.server_timing(total)
+    try:
+        latency_histograms.add(_get_endpoint_key(), total=total, status=response.status_code,
+                               metrics=metrics)
+    except Exception as e:
+        LOG.error('Unable to record request metrics: {}'.format(e))
+    return response
+
+
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None and current_metrics() is not None:
+        context.perf_started = time.perf_counter()
+
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    started = getattr(context, 'perf_started', None)
+    if started is not None:
+        add('db', time.perf_counter() - started)
+
+
+def init_app(app):
+    """
+    Register request hooks and DB engine events.
+    :param app:
+    :return:
+    """
+    if not PERF_METRICS_ENABLED:
+        return
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    event.listen(Engine, 'before_cursor_execute', _before_cursor_execute)
+    event.listen(Engine, 'after_cursor_execute', _after_cursor_execute)
+
+
+def get_stats():
+    """
+    Get latency histograms of endpoints.
+    :return:
+    """
+    return {
+        'enabled': PERF_METRICS_ENABLED,
+        'buckets': list(PERF_LATENCY_BUCKETS),
+        'endpoints': latency_histograms.get(),
+    }
+
+
+def reset_stats():
+    """
+    Clear latency histograms of endpoints.
+    :return:
+    """
+    latency_histograms.clear()
@@ -0,0 +1,143 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+
+import datetime
+import gzip
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import and_, select
+
+from application import app, db
+
+LOG = app.logger
+
+RETENTION_BATCH_SIZE = app.config['RETENTION_BATCH_SIZE']
+RETENTION_ROWS_PER_SECOND = app.config['RETENTION_ROWS_PER_SECOND']
+RETENTION_ARCHIVE_PATH = app.config['RETENTION_ARCHIVE_PATH']
+
+# Result of the last purge of each table
+_purge_stats = {}
+_purge_stats_lock = threading.Lock()
+
+
+class ArchiveWriter(object):
+    """
+    Write rows to a gzipped JSON lines file.
+    """
+
+    def __init__(self, dir_path, name):
+        os.makedirs(dir_path, exist_ok=True)
+        file_name = '{}-{}.jsonl.gz'.format(name, datetime.datetime.utcnow().strftime('%Y%m%d%H%M%S'))
+        self.path = os.path.join(dir_path, file_name)
+        self._file = gzip.open(self.path, 'wt', encoding='utf-8')
+
+    def write(self, rows):
+        for row in rows:
+            self._file.write(json.dumps(row, default=str, ensure_ascii=False))
+            self._file.write('\n')
+        # Rows must be written out before they are deleted
+        self._file.flush()
+
+    def close(self):
+        self._file.close()
+
+
+def purge(model_class, *conditions, name=None, batch_size=None, rows_per_second=None,
+          archive_path=None):
+    """
+    Delete rows matching the conditions in batches of primary keys.
+    Each batch is deleted in its own transaction, so locks are held shortly,
+    and deleting is throttled to limit load on DB and replication.
+    Usage:
+        purge(md.History, md.History.start_date < timestamp, name='history')
+    :param model_class: model class with an integer primary key `id`
+    :param conditions: conditions of rows to delete
+    :param name: name used in logs and archive file names, default is the table name
+    :param batch_size: max rows in a batch
+    :param rows_per_second: max rows deleted per second, 0 for no limit
+    :param archive_path: directory to archive deleted rows to before deleting them,
+                         None to use RETENTION_ARCHIVE_PATH, '' to not archive
+    :return: a dict of purge result
+    """
+    table = model_class.__table__
+    id_column = table.c.id
+    name = name or table.name
+    batch_size = batch_size or RETENTION_BATCH_SIZE
+    rows_per_second = RETENTION_ROWS_PER_SECOND if rows_per_second is None else rows_per_second
+    archive_path = RETENTION_ARCHIVE_PATH if archive_path is None else archive_path
+
+    condition = and_(*conditions)
+    columns = [table] if archive_path else [id_column]
+    archive = None
+    result = {
+        'name': name,
+        'deleted': 0,
+        'batches': 0,
+        'archive': None,
+        'started_at': datetime.datetime.utcnow(),
+        'finished_at': None,
+        'error': None,
+    }
+    started = time.monotonic()
+    last_id = None
+
+    try:
+        while True:
+            where = condition if last_id is None else and_(condition, id_column > last_id)
+            with db.engine.connect() as conn:
+                rows = conn.execute(select(columns).where(where)
+                                    .order_by(id_column).limit(batch_size)).fetchall()
+            if not rows:
+                break
+
+            ids = [row['id'] for row in rows]
+            if archive_path:
+                if archive is None:
+                    archive = ArchiveWriter(archive_path, name)
+                    result['archive'] = archive.path
+                archive.write([dict(row) for row in rows])
+
+            with db.engine.begin() as conn:
+                deleted = conn.execute(table.delete().where(and_(condition, id_column.in_(ids)))).rowcount
+            last_id = ids[-1]
+            result['deleted'] += deleted
+            result['batches'] += 1
+            if result['batches'] % 10 == 0:
+                LOG.info('Purge {}: deleted {} rows, up to id {}.'.format(name, result['deleted'], last_id))
+
+            if len(rows) < batch_size:
+                break
+
+            # Throttle to keep average speed under the budget
+            if rows_per_second:
+                wait = result['deleted'] / rows_per_second - (time.monotonic() - started)
+                if wait > 0:
+                    time.sleep(wait)
+    except BaseException as e:
+        LOG.exception('Purge {} failed: {}'.format(name, e))
+        result['error'] = str(e)
+    finally:
+        if archive is not None:
+            archive.close()
+
+    result['finished_at'] = datetime.datetime.utcnow()
+    LOG.info('Purge {}: deleted {} rows in {} batches in {:.1f}s{}.'.format(
+        name, result['deleted'], result['batches'], time.monotonic() - started,
+        ', archived to ' + result['archive'] if result['archive'] else ''))
+
+    with _purge_stats_lock:
+        _purge_stats[name] = result
+    return result
+
+
+def get_stats():
+    """
+    Get result of the last purge of each table.
+    :return:
+    """
+    with _purge_stats_lock:
+        return {name: dict(result) for name, result in _purge_stats.items()}
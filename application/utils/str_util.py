@@ -2,14 +2,20 @@
 # Copyright (c) 2020 FTI-CAS
 #
 
+import base64
+import copy
+import hashlib
+import json
 import random
 import re
 import time
 
+from cryptography import fernet
 import jwt
 from werkzeug.security import generate_password_hash, check_password_hash
 
 from application import app
+from application.utils import cache_util
 
 LOG = app.logger
 
@@ -185,22 +191,121 @@ def jwt_encode_token(data, expires_in=None, key=None, algorithm='HS256'):
         raise
 
 
-def jwt_decode_token(token, key=None, algorithms=('HS256',)):
+_jwt_decode_cache = cache_util.TTLCache(max_size=app.config['JWT_DECODE_CACHE_SIZE'],
+                                        ttl=app.config['JWT_DECODE_CACHE_TTL'])
+
+
+def jwt_decode_token(token, key=None, algorithms=('HS256',), use_cache=True):
     """
     Decode token and return the encoded data.
+    Verified payloads are cached by token hash until the token expires.
+    :param token:
+    :param key: secret key
+    :param algorithms: algorithms
+    :param use_cache: use cache of verified tokens
+    :return:
+    """
+    content = jwt_decode_token_content(token, key=key, algorithms=algorithms, use_cache=use_cache)
+    return content['data']
+
+
+def jwt_decode_token_content(token, key=None, algorithms=('HS256',), use_cache=True):
+    """
+    Decode token and return its whole content, including 'data' and 'exp' if set.
     :param token:
     :param key: secret key
     :param algorithms: algorithms
+    :param use_cache: use cache of verified tokens
     :return:
     """
     key = key or app.config['SECRET_KEY']
     algorithms = algorithms or ('HS256',)
+
+    cache_key = None
+    if use_cache:
+        cache_key = _jwt_cache_key(token, key, algorithms)
+        content = _jwt_decode_cache.get(cache_key)
+        if content is not None:
+            # Callers may modify the returned data
+            return _copy_content(content)
+
     try:
-        return jwt.decode(token, key=key, algorithms=algorithms)['data']
+        content = jwt.decode(token, key=key, algorithms=algorithms)
     except ValueError as e:
         LOG.debug(e)
         raise
 
+    if cache_key is not None:
+        _jwt_decode_cache.set(cache_key, content, expire_at=content.get('exp'))
+        return _copy_content(content)
+    return content
+
+
+def _copy_content(content):
+    # Deep copy, nested data (e.g. decrypted ldap_info) must not be shared with the cache
+    return copy.deepcopy(content)
+
+
+def _jwt_cache_key(token, key, algorithms):
+    """
+    Make cache key for a token, the key and algorithms are part of the hash
+    so that a token is never accepted for another secret key.
+    :param token:
+    :param key:
+    :param algorithms:
+    :return:
+    """
+    if isinstance(token, bytes):
+        token = token.decode('utf-8')
+    if isinstance(key, bytes):
+        key = key.decode('utf-8')
+    value = '{}\n{}\n{}'.format(key, ','.join(algorithms), token)
+    return hashlib.sha256(value.encode('utf-8')).digest()
+
+
+def jwt_decode_cache_stats():
+    """
+    Get statistics of the verified token cache.
+    :return:
+    """
+    return _jwt_decode_cache.stats()
+
+
+def encrypt_data(data, key=None):
+    """
+    Encrypt JSON serializable data (AES, Fernet), unlike JWT tokens it can not be read
+    without the key. Use it for credentials stored in DB.
+    :param data:
+    :param key: secret key, default is DATA_ENCRYPTION_KEY
+    :return:
+    """
+    content = json.dumps(data).encode('utf-8')
+    return _get_fernet(key).encrypt(content).decode('utf-8')
+
+
+def decrypt_data(token, key=None):
+    """
+    Decrypt data encrypted by encrypt_data().
+    :param token:
+    :param key: secret key, default is DATA_ENCRYPTION_KEY
+    :return:
+    """
+    if isinstance(token, str):
+        token = token.encode('utf-8')
+    try:
+        content = _get_fernet(key).decrypt(token)
+    except fernet.InvalidToken as e:
+        raise ValueError('Invalid encrypted data.') from e
+    return json.loads(content.decode('utf-8'))
+
+
+def _get_fernet(key=None):
+    key = key or app.config['DATA_ENCRYPTION_KEY']
+    if isinstance(key, str):
+        key = key.encode('utf-8')
+    # Fernet needs a 32 bytes key
+    return fernet.Fernet(base64.urlsafe_b64encode(hashlib.sha256(key).digest()))
+
 
 def valid_email(email):
     """
@@ -0,0 +1,77 @@
+#
+# Copyright (c) 2020 FTI-CAS
+#
+"""
+Workers of the durable task queue, running OpenStack tasks of method 'mq'.
+Each process runs a worker with a thread pool, add processes or hosts to scale.
+Stopped or crashed workers are restarted, their unfinished tasks are delivered again
+after TASK_QUEUE_VISIBILITY_TIMEOUT.
+
+Usage:
+    python queue_worker.py --processes 4 --threads 4
+"""
+
+import argparse
+import multiprocessing
+import os
+import signal
+import time
+
+RESTART_DELAY = 5  # seconds
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description='Run task queue workers.')
+    parser.add_argument('--processes', type=int, default=2)
+    parser.add_argument('--threads', type=int, help='threads per process, default TASK_QUEUE_WORKER_THREADS')
+    parser.add_argument('--queues', default='default', help='comma separated queue names, default: %(default)s')
+    return parser.parse_args()
+
+
+def run_worker(queues, threads):
+    # Scheduled jobs are run by the web processes
+    os.environ['CAS_SCHEDULER_MODE'] = 'none'
+
+    from application.managers import queue_mgr
+    # Register task handlers
+    from application import product_types  # noqa: F401
+
+    worker = queue_mgr.Worker(queues=queues, threads=threads)
+    signal.signal(signal.SIGTERM, lambda *a: worker.stop())
+    signal.signal(signal.SIGINT, lambda *a: worker.stop())
+    worker.run()
+
+
+def main():
+    args = parse_args()
+    queues = args.queues.split(',')
+    stopping = []
+
+    def _start():
+        process = multiprocessing.Process(target=run_worker, args=(queues, args.threads))
+        process.start()
+        return process
+
+    def _stop(*a):
+        stopping.append(True)
+        for process in processes:
+            if process.is_alive():
+                process.terminate()
+
+    processes = [_start() for _ in range(args.processes)]
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    while not stopping:
+        time.sleep(RESTART_DELAY)
+        for i, process in enumerate(processes):
+            if not process.is_alive() and not stopping:
+                print('Worker process {} exited with code {}, restarting.'.format(process.pid, process.exitcode))
+                processes[i] = _start()
+
+    for process in processes:
+        process.join()
+
+
+if __name__ == '__main__':
+    main()